@@ -1,4 +1,5 @@
 #!/bin/bash
 # export PYTHONPATH=$PYTHONPATH add paths here
-# We run this script using a cron job, that runs every 30minutes
+# We run this script using a cron job, that runs every 30minutes, to queue
+# the updates from the external sources run by eff_site/scripts/update_worker.py
 DJANGO_SETTINGS_MODULE=eff_site.settings python ./fetch_external_sources.py
@@ -17,11 +17,14 @@
 
 from user_profile import UserProfile, Handle, ClientHandles
 from project import Project, ProjectAssoc
-from log import TimeLog
+from log import TimeLog, DailyHours, StagedTimeLog
 from avg_hours import AvgHours
+from work_calendar import Calendar, Holiday
 from external_source import ExternalSource, ExternalId
 from wage import Wage
 from client import Client, Currency, BillingEmail
-from dump import Dump
+from dump import Dump, ImportDigest
+from update_job import UpdateJob, FetchLease, FetchCheckpoint
 from commercial_documents import (Billing, CreditNote, Payment,
                                  CommercialDocumentBase)
+from report_cache import DataVersion
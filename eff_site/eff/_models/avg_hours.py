@@ -16,8 +16,10 @@
 # along with Eff.  If not, see <http://www.gnu.org/licenses/>.
 
 from django.db import models
+from django.db.models import signals
 from django.contrib.auth.models import User
 from customfields import HourField
+from timeline import changed
 
 
 class AvgHours(models.Model):
@@ -44,3 +46,9 @@ class AvgHours(models.Model):
         get_latest_by = 'date'
         ordering = ['date', 'user']
         unique_together = (('user', 'date'),)
+
+
+signals.post_save.connect(changed, sender=AvgHours,
+    dispatch_uid='eff._models.avg_hours.changed.post_save')
+signals.post_delete.connect(changed, sender=AvgHours,
+    dispatch_uid='eff._models.avg_hours.changed.post_delete')
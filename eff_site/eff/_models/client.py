@@ -17,8 +17,8 @@
 
 from django.db import models
 from log import TimeLog
-from project import Project
-from django.db.models import Q
+from report_cache import cached_report, client_changed
+from django.db.models import Q, signals
 
 
 class Currency(models.Model):
@@ -65,6 +65,12 @@ class Client(models.Model):
         super(Client, self).save(*args, **kwargs)
 
     def report(self, from_date, to_date, detailed=False, with_rates=False):
+        return cached_report('Client.report', (self.id, from_date, to_date,
+                                               detailed, with_rates),
+                             lambda: self._report(from_date, to_date,
+                                                  detailed, with_rates))
+
+    def _report(self, from_date, to_date, detailed, with_rates):
         report_by_project = {}
         detailed_hours = {}
 
@@ -95,8 +101,10 @@ class Client(models.Model):
                                 format_task_log(detailed_hours, x, y)), x[1])),
                                     report_by_project)
 
-        report_by_project = map(lambda (p, ul):
-                                (Project.objects.get(external_id=p).name, ul),
+        names = dict(self.project_set.filter(
+            external_id__in=[p for p, ul in report_by_project]).values_list(
+                'external_id', 'name'))
+        report_by_project = map(lambda (p, ul): (names[p], ul),
                                 report_by_project)
 
         return zip(report_by_project, totalHrs)
@@ -128,6 +136,12 @@ class Client(models.Model):
         return rows, in_total, out_total, total
 
 
+signals.post_save.connect(client_changed, sender=Client,
+    dispatch_uid='eff._models.client.client_changed.post_save')
+signals.post_delete.connect(client_changed, sender=Client,
+    dispatch_uid='eff._models.client.client_changed.post_delete')
+
+
 class BillingEmail(models.Model):
     KIND_TO = 'TO'
     KIND_CC = 'CC'
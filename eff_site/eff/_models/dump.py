@@ -16,6 +16,7 @@
 # along with Eff.  If not, see <http://www.gnu.org/licenses/>.
 
 from django.db import models
+from django.db.models import signals
 #from external_source import ExternalSource
 
 class Dump(models.Model):
@@ -30,3 +31,37 @@ class Dump(models.Model):
         return u'Dump - source: %s, created by: %s, date: %s' % (self.source,
                                                                  self.creator,
                                                                  self.date)
+
+
+class ImportDigest(models.Model):
+    """
+    Digest of the logs of a client imported from an external source for a
+    date, so an import of the same logs can be skipped (see load_logs).
+    """
+    source = models.ForeignKey('ExternalSource')
+    client = models.ForeignKey('Client')
+    date = models.DateField()
+    digest = models.CharField(max_length=40)
+
+    class Meta:
+        app_label = 'eff'
+        unique_together = (('source', 'client', 'date'),)
+
+    @classmethod
+    def forget(cls, project_id, *dates):
+        """
+        Forgets the digests of the client of the project on dates, whose
+        logs changed, so they are imported again.
+        """
+        cls.objects.filter(client__project=project_id,
+                           date__in=dates).delete()
+
+
+def dump_post_delete(sender, instance, **kwargs):
+    # The logs of the dump are gone, so the days they were imported on are
+    # not unchanged anymore
+    ImportDigest.objects.filter(source=instance.source_id).delete()
+
+signals.post_delete.connect(
+    dump_post_delete, sender=Dump,
+    dispatch_uid='eff._models.dump.dump_post_delete')
@@ -16,17 +16,30 @@
 # You should have received a copy of the GNU General Public License
 # along with Eff.  If not, see <http://www.gnu.org/licenses/>.
 
-from django.db import models
+from django.db import models, connection, transaction
+from django.db.models import signals
 from django.contrib.auth.models import User
 from project import Project, ProjectAssoc
 from django.db.models import Sum
 
-from dump import Dump
+from dump import Dump, ImportDigest
+from avg_hours import AvgHours
+from timeline import Timeline
+from work_calendar import Calendar
 
 from django.db.models import Q
 from customfields import HourField
 from decimal import Decimal
-from datetime import date, timedelta
+from datetime import date, datetime, timedelta
+from itertools import groupby
+from collections import namedtuple
+
+
+# A row of TimeLog.report. The user is given by its username and full name,
+# the rows are kept in the reports cache
+ReportRow = namedtuple('ReportRow', ['project', 'task_name', 'description',
+                                     'hours_booked', 'date', 'user',
+                                     'user_full_name'])
 
 
 class TimeLog(models.Model):
@@ -40,6 +53,8 @@ class TimeLog(models.Model):
 
     dump = models.ForeignKey(Dump)
 
+    # The (user, date) and (project, date, dump) indexes are created by the
+    # 0020_add_timelog_indexes migration
     class Meta:
         app_label = 'eff'
 
@@ -75,6 +90,99 @@ class TimeLog(models.Model):
                                     timelog__date__lte=to_date
                 ).distinct()
 
+    @classmethod
+    def period_stats(cls, user_ids, from_date, to_date):
+        """
+        Batch version of the per-user statistics shown in the eff dashboard.
+
+        Returns a dict keyed by user id. Each value is a dict with the keys
+        'worked_hours', 'billable_hours', 'loggable_hours', 'is_active' and
+        'projects' (list of Project, in the default Project ordering).
+        The number of queries issued does not depend on len(user_ids).
+        """
+        user_ids = list(user_ids)
+        stats = dict((uid, {'worked_hours': Decimal(0),
+                            'billable_hours': Decimal(0),
+                            'loggable_hours': 0,
+                            'is_active': False,
+                            'projects': []}) for uid in user_ids)
+        if not user_ids:
+            return stats
+
+        # Hours per (user, project) in a single grouped query
+        rows = DailyHours.objects.filter(user__in=user_ids,
+                                         date__gte=from_date,
+                                         date__lte=to_date
+                    ).values('user', 'project').annotate(
+                        hours=Sum('hours')).order_by()
+        rows = list(rows)
+
+        projects = list(Project.objects.filter(
+            id__in=set(r['project'] for r in rows)).select_related('client'))
+        billable = set(p.id for p in projects if p.billable)
+        users_per_project = {}
+
+        for r in rows:
+            user_stats = stats[r['user']]
+            user_stats['worked_hours'] += r['hours']
+            if r['project'] in billable:
+                user_stats['billable_hours'] += r['hours']
+            users_per_project.setdefault(r['project'], []).append(r['user'])
+
+        for project in projects:
+            for uid in users_per_project[project.id]:
+                stats[uid]['projects'].append(project)
+
+        # Average hours history and working days calendar, needed for
+        # loggable hours and activity
+        timelines = Timeline.load(AvgHours, 'hours', user_ids, to_date)
+        calendars, by_id = {}, {}
+        for uid, cid, name in Calendar.objects.filter(
+                userprofile__user__in=user_ids).values_list(
+                    'userprofile__user', 'id', 'name'):
+            # Shared, so the version of the holidays is read once for each
+            calendars[uid] = by_id.setdefault(cid, Calendar(id=cid,
+                                                            name=name))
+        for uid in user_ids:
+            stats[uid]['loggable_hours'] = timelines[uid].weekday_sum(
+                from_date, to_date, calendars.get(uid))
+            stats[uid]['is_active'] = timelines[uid].any_positive(from_date,
+                                                                  to_date)
+
+        return stats
+
+    @classmethod
+    def daily_series(cls, user_ids, from_date, to_date, billable_split=True):
+        """
+        Hours logged each day between from_date and to_date (both included)
+        by each user, as read from the daily rollup with one grouped query.
+
+        Returns a dict keyed by user id. Each value is a dict with a
+        'worked' list holding the hours of each day of the range, and a
+        'billable' one with the billable hours if billable_split is True.
+        """
+        user_ids = list(user_ids)
+        n_days = max((to_date - from_date).days + 1, 0)
+        keys = billable_split and ('worked', 'billable') or ('worked',)
+        series = dict((uid, dict((k, [Decimal(0)] * n_days) for k in keys))
+                      for uid in user_ids)
+        if not user_ids or not n_days:
+            return series
+
+        fields = billable_split and ('user', 'date', 'billable') or \
+            ('user', 'date')
+        rows = DailyHours.objects.filter(user__in=user_ids,
+                                         date__gte=from_date,
+                                         date__lte=to_date
+                    ).values(*fields).annotate(hours=Sum('hours')).order_by()
+        for r in rows:
+            day = (r['date'] - from_date).days
+            series[r['user']]['worked'][day] += r['hours']
+            if billable_split and r['billable']:
+                series[r['user']]['billable'][day] += r['hours']
+
+        return series
+
     @classmethod
     def _group_by_project(cls, qset):
         last = None
@@ -106,194 +214,104 @@ class TimeLog(models.Model):
         return cls._group_by_project(qset)
 
     @classmethod
-    def hours_grouped_by_project_with_rates(cls, user, from_date, to_date):
-        project_rates = []
-        # Get the projects related to this user in this period
-        user_projects = cls.user_projects(user, from_date, to_date)
-
-        for project in user_projects:
-            rates = {}
-            # Get the timelogs in this period
-            timelogs = project.timelog_set.filter(
-                Q(user__username=user.user.username),
-                Q(date__gte=from_date),
-                Q(date__lte=to_date)).order_by('date')
-
-            # Discard project associations out of the period
-            projassoc = ProjectAssoc.objects.filter(
-                Q(member__user__username=user.user.username),
-                Q(project=project),
+    def hours_by_rate(cls, timelogs, from_date, to_date, rate_field):
+        """
+        Rate resolution engine: assigns the hours in timelogs to the rates of
+        the ProjectAssoc periods of each (project, user).
+
+        timelogs is a TimeLog queryset already restricted to the period
+        [from_date, to_date] and to the wanted projects/users. rate_field is
+        either 'user_rate' or 'client_rate'.
+
+        Logs outside every period get rate 0. A period without to_date lasts
+        until the day before the next period starts or, when it is the last
+        one, until today.
+
+        Returns a list of (project_id, user_id, rate, hours) tuples, sorted by
+        project and user. This issues two queries: one for the hours per day
+        and one for the ProjectAssoc periods overlapping [from_date, to_date].
+        """
+        days = list(timelogs.values('project', 'user', 'date').annotate(
+            hours=Sum('hours_booked')).order_by('project', 'user', 'date'))
+        if not days:
+            return []
+
+        periods = {}
+        for project, user, p_from, p_to, rate in ProjectAssoc.objects.filter(
+                Q(project__in=set(d['project'] for d in days)),
+                Q(member__user__in=set(d['user'] for d in days)),
                 ~Q(from_date__gt=to_date),
-                ~Q(to_date__lt=from_date)).order_by('from_date')
-
-            # Get the rates for each project.
-            periods = iter(projassoc.values('from_date', 'to_date',
-                                            'user_rate'))
-            try:
-                period = periods.next()
-            except StopIteration:
-                period = None
-
-            while period:
-                aux_period = None
-                # All timelogs before this period belong to a previous period
-                # or do not belong to any period, so they have rate = 0.
-                for t in timelogs:
-                    if t.date < period['from_date']:
-                        rates[Decimal('0.00')] = rates.get(Decimal('0.00'),
-                                                           Decimal('0.00')) +\
-                                                           t.hours_booked
-                    else:
-                        break
-                # Discard timelogs already processed
-                timelogs = timelogs.exclude(date__lt=period['from_date'])
-
-                # If to_date not available then set it to from_date - 1. If this
-                # period is the last one, then set it to today, to process all
-                # remaining logs.
-                if not period['to_date']:
-                    try:
-                        aux_period = periods.next()
-                    except StopIteration:
-                        period['to_date'] = date.today()
-                    else:
-                        period['to_date'] = aux_period['from_date'] - \
-                                            timedelta(days=1)
-
-                # All timelogs inside this period have rate equal to the one
-                # set in the projassoc.
-                for t in timelogs:
-                    if t.date <= period['to_date']:
-                        rates[Decimal(period['user_rate'])] = rates.get(
-                            Decimal(period['user_rate']), Decimal('0.00')) + \
-                            t.hours_booked
-                    else:
-                        break
-
-                # Discard timelogs already processed
-                timelogs = timelogs.exclude(date__lte=period['to_date'])
-
-                # Set next period to process correctly
-                if aux_period:
-                    period = aux_period
-                else:
-                    try:
-                        period = periods.next()
-                    except StopIteration:
-                        break
-
-            # All remaining timelogs have rate = 0
-            tl_hours = map(lambda log: log['hours_booked'],
-                           timelogs.values('hours_booked'))
-            if timelogs:
-                rates[Decimal('0.00')] = rates.get(Decimal('0.00'),
-                                                   Decimal('0.00')) + \
-                                                   sum(tl_hours)
-
+                ~Q(to_date__lt=from_date)).order_by(
+                    'from_date', 'id').values_list('project', 'member__user',
+                        'from_date', 'to_date', rate_field):
+            periods.setdefault((project, user), []).append(
+                (p_from, p_to, rate))
+
+        resolved = []
+        today = date.today()
+        for (project, user), p_days in groupby(days,
+                lambda d: (d['project'], d['user'])):
+            rates = _merge_rates([(d['date'], d['hours']) for d in p_days],
+                                 periods.get((project, user), []), today)
             for rate, hours in rates.items():
-                project_rates.append((project, '', hours, rate))
+                resolved.append((project, user, rate, hours))
 
-        return project_rates
+        return resolved
+
+    @classmethod
+    def hours_grouped_by_project_with_rates(cls, user, from_date, to_date):
+        resolved = cls.hours_by_rate(cls._query(user, from_date, to_date),
+                                     from_date, to_date, 'user_rate')
+        rates = {}
+        for project_id, user_id, rate, hours in resolved:
+            rates.setdefault(project_id, []).append((rate, hours))
+
+        # Keep the default Project ordering
+        return [(project, '', hours, rate)
+                for project in Project.objects.filter(id__in=rates.keys())
+                for rate, hours in rates[project.id]]
 
     @classmethod
     def project_hours(cls, project, from_date, to_date):
-        hours = cls.objects.filter(date__gte=from_date,
-                                    date__lte=to_date,
-                                    project=project)
-        hours = hours.values('user__username').annotate(Sum("hours_booked"))
+        hours = DailyHours.objects.filter(date__gte=from_date,
+                                          date__lte=to_date,
+                                          project=project)
+        hours = hours.values('user__username').annotate(
+            hours_booked__sum=Sum('hours'))
         return hours
 
     @classmethod
-    def project_hours_grouped_by_rate(cls, project, from_date, to_date):
-        users_rates = []
-        # Get the users related to this project
-        project_users = map(lambda member: member.user,
-                            project.members.all().distinct())
-
-        for user in project_users:
-            rates = {}
-            # Get the timelogs in this period
-            timelogs = project.timelog_set.filter(
-                Q(user=user),
-                Q(date__gte=from_date),
-                Q(date__lte=to_date)).order_by('date')
-
-            # Discard project associations out of the period
-            projassoc = ProjectAssoc.objects.filter(
-                Q(member__user=user),
-                Q(project=project),
-                ~Q(from_date__gt=to_date),
-                ~Q(to_date__lt=from_date)).order_by('from_date')
-
-            # Get the rates for each user.
-            periods = iter(projassoc.values('from_date', 'to_date',
-                                            'client_rate'))
-            try:
-                period = periods.next()
-            except StopIteration:
-                period = None
-
-            while period:
-                aux_period = None
-                # All timelogs before this period belong to a previous period
-                # or do not belong to any period, so they have rate = 0.
-                for t in timelogs:
-                    if t.date < period['from_date']:
-                        rates[Decimal('0.00')] = rates.get(Decimal('0.00'),
-                                                           Decimal('0.00')) +\
-                                                           t.hours_booked
-                    else:
-                        break
-                # Discard timelogs already processed
-                timelogs = timelogs.exclude(date__lt=period['from_date'])
-
-                # If to_date not available then set it to from_date - 1. If this
-                # period is the last one, then set it to today, to process all
-                # remaining logs.
-                if not period['to_date']:
-                    try:
-                        aux_period = periods.next()
-                    except StopIteration:
-                        period['to_date'] = date.today()
-                    else:
-                        period['to_date'] = aux_period['from_date'] - \
-                                            timedelta(days=1)
-
-                # All timelogs inside this period have rate equal to the one set
-                # in the projassoc.
-                for t in timelogs:
-                    if t.date <= period['to_date']:
-                        rates[Decimal(period['client_rate'])] = rates.get(
-                            Decimal(period['client_rate']), Decimal('0.00')) + \
-                            t.hours_booked
-                    else:
-                        break
-                # Discard timelogs already processed
-                timelogs = timelogs.exclude(date__lte=period['to_date'])
-
-                # Set next period to process correctly
-                if aux_period:
-                    period = aux_period
-                else:
-                    try:
-                        period = periods.next()
-                    except StopIteration:
-                        break
-
-            # All remaining timelogs have rate = 0
-            tl_hours = map(lambda log: log['hours_booked'],
-                           timelogs.values('hours_booked'))
-            if timelogs:
-                rates[Decimal('0.00')] = rates.get(Decimal('0.00'),
-                                                   Decimal('0.00')) + \
-                                                   sum(tl_hours)
-
-            for rate, hours in rates.items():
-                users_rates.append({'user__username': user.username,
-                                    'rate': rate, 'hours_booked__sum': hours})
-
+    def _hours_grouped_by_rate(cls, projects, from_date, to_date):
+        # Hours of the members of each project grouped by client rate, as
+        # {project_id: [{'user__username':, 'rate':, 'hours_booked__sum':}]}
+        timelogs = cls.objects.filter(project__in=projects,
+                                      date__gte=from_date,
+                                      date__lte=to_date)
+        resolved = cls.hours_by_rate(timelogs, from_date, to_date,
+                                     'client_rate')
+        rates = {}
+        for project_id, user_id, rate, hours in resolved:
+            rates.setdefault((project_id, user_id), []).append((rate, hours))
+
+        # Only the hours of project members are reported, ordered as members
+        # are (by first name)
+        members = ProjectAssoc.objects.filter(project__in=projects).values_list(
+            'project', 'member__user', 'member__user__username').order_by(
+                'member__user__first_name', 'member__user').distinct()
+
+        users_rates = {}
+        for project_id, user_id, username in members:
+            for rate, hours in rates.get((project_id, user_id), []):
+                users_rates.setdefault(project_id, []).append(
+                    {'user__username': username,
+                     'rate': rate, 'hours_booked__sum': hours})
         return users_rates
 
+    @classmethod
+    def project_hours_grouped_by_rate(cls, project, from_date, to_date):
+        return cls._hours_grouped_by_rate([project], from_date,
+                                          to_date).get(project.id, [])
+
     @classmethod
     def project_tasks_hours_log(cls, project, from_date, to_date):
         return cls.objects.filter(date__gte=from_date,
@@ -338,29 +356,37 @@ class TimeLog(models.Model):
         return sum(log.hours_booked
                    for log in cls.objects.filter(**kwargs))
 
-    def _to_tuple(self):
-        return (self.project.name, self.task_name, self.description,
-                self.hours_booked, self.date, self.user)
-
     @classmethod
     def report(cls, user, from_date, to_date, project=None):
+        """
+        Returns the logs of user between from_date and to_date (only those
+        of the project named project, if given) as ReportRow tuples, ordered
+        by date.
+        """
+        logs = cls.objects.filter(date__gte=from_date, date__lte=to_date,
+                                  user=user.user_id)
         if project is not None:
-            return (log._to_tuple()
-                    for log in cls.objects.filter(
-                        date__gte=from_date,
-                        date__lte=to_date,
-                        user__username=user.user.username,
-                        project__name=project))
-        else:
-            return (log._to_tuple()
-                    for log in cls.objects.filter(
-                        date__gte=from_date,
-                        date__lte=to_date,
-                        user__username=user.user.username))
+            logs = logs.filter(project__name=project)
+        logs = logs.order_by('date', 'id').values_list(
+            'project__name', 'task_name', 'description', 'hours_booked',
+            'date')
+        username = user.user.username
+        full_name = user.user.get_full_name()
+        return (ReportRow(name, task_name, description, hours, log_date,
+                          username, full_name)
+                for name, task_name, description, hours, log_date in logs)
 
     @classmethod
     def get_summary_per_project(cls, user, from_date, to_date,
         with_rates=False):
+        from report_cache import cached_report
+        return cached_report('TimeLog.get_summary_per_project',
+                             (user.id, from_date, to_date, with_rates),
+                             lambda: list(cls._summary_per_project(
+                                 user, from_date, to_date, with_rates)))
+
+    @classmethod
+    def _summary_per_project(cls, user, from_date, to_date, with_rates):
         if with_rates:
             return ((item[0].get_external_source(), item[0].name, True, item[2],
                 item[3])
@@ -383,11 +409,12 @@ class TimeLog(models.Model):
         if with_rates:
 
             # Excluding fixed price projects
-            projects = projects.filter(billing_type='HOUR')
+            projects = list(projects.filter(billing_type='HOUR'))
+            users_rates = cls._hours_grouped_by_rate(projects, from_date,
+                                                     to_date)
 
             for p in projects:
-                project_hours = TimeLog.project_hours_grouped_by_rate(p,
-                    from_date, to_date)
+                project_hours = users_rates.get(p.id)
                 if project_hours:
                     projects_users_hours[p.external_id] = []
 
@@ -395,37 +422,234 @@ class TimeLog(models.Model):
                         (i['user__username'], i['hours_booked__sum'], i['rate'])
                         for i in project_hours]
         else:
-            for p in projects:
-                project_hours = TimeLog.project_hours(p, from_date, to_date)
-                if project_hours:
-                    projects_users_hours[p.external_id] = []
-                    projects_users_hours[p.external_id] += [
-                        (i['user__username'], i['hours_booked__sum']) \
-                        for i in project_hours]
+            hours = DailyHours.objects.filter(
+                date__gte=from_date, date__lte=to_date,
+                project__client=client).values_list(
+                    'project__external_id', 'user__username').annotate(
+                        Sum('hours')).order_by('project__external_id',
+                                               'user__username')
+            for external_id, username, hours_booked in hours:
+                projects_users_hours.setdefault(external_id, []).append(
+                    (username, hours_booked))
 
         return projects_users_hours
 
     @classmethod
     def get_client_task_log_summary_per_project(cls, client, from_date,
         to_date):
-        projects = client.project_set.all()
         projects_users_hours = {}
 
-        for p in projects:
-            project_hours = TimeLog.project_tasks_hours_log(p, from_date,
-                to_date)
+        logs = cls.objects.filter(date__gte=from_date, date__lte=to_date,
+                                  project__client=client).values_list(
+            'project__external_id', 'user__username', 'date', 'description',
+            'hours_booked').order_by('date')
+        for external_id, name, log_date, description, hours in logs:
+            user_data = projects_users_hours.setdefault(external_id, {})
+            user_data.setdefault(name, []).append(
+                (log_date, description, hours))
 
-            if project_hours:
-                projects_users_hours[p.external_id] = {}
+        return projects_users_hours
 
-                for i in project_hours:
-                    name = i.user.username
-                    user_data = projects_users_hours[p.external_id]
-                    info = (i.date, i.description, i.hours_booked)
 
-                    if name in user_data:
-                        user_data[name].append(info)
-                    else:
-                        user_data[name] = [info]
+def _merge_rates(days, periods, today):
+    """
+    Sorted merge of the hours logged by a user in a project against the
+    ProjectAssoc periods of that user in that project.
+
+    days is a list of (date, hours) sorted by date, and periods a list of
+    (from_date, to_date, rate) sorted by from_date. Returns a dict mapping
+    each rate to the hours logged with it.
+    """
+    zero = Decimal('0.00')
+    rates = {}
+    i, n_days = 0, len(days)
+
+    for idx, (p_from, p_to, rate) in enumerate(periods):
+        # All days before this period belong to a previous period or do not
+        # belong to any period, so they have rate = 0.
+        while i < n_days and days[i][0] < p_from:
+            rates[zero] = rates.get(zero, zero) + days[i][1]
+            i += 1
+
+        # If to_date not available then set it to the next from_date - 1. If
+        # this period is the last one, then set it to today.
+        if not p_to:
+            if idx + 1 < len(periods):
+                p_to = periods[idx + 1][0] - timedelta(days=1)
+            else:
+                p_to = today
+
+        rate = Decimal(rate)
+        while i < n_days and days[i][0] <= p_to:
+            rates[rate] = rates.get(rate, zero) + days[i][1]
+            i += 1
+
+    # All remaining days have rate = 0
+    if i < n_days:
+        rates[zero] = rates.get(zero, zero) + sum(h for (d, h) in days[i:])
+
+    return rates
+
+
+class StagedTimeLog(models.Model):
+    """
+    Logs being imported by load_dump. They are moved to TimeLog all at once
+    when the whole dump has been read.
+    """
 
-        return projects_users_hours
+    date = models.DateField()
+    project = models.ForeignKey(Project)
+    task_name = models.CharField(max_length=500, blank=True)
+    user = models.ForeignKey(User)
+    hours_booked = HourField()
+    description = models.TextField(blank=True)
+
+    dump = models.ForeignKey(Dump)
+
+    class Meta:
+        app_label = 'eff'
+
+
+class DailyHours(models.Model):
+    """
+    Daily rollup of TimeLog: hours logged by a user in a project on a date.
+
+    Kept in sync by the TimeLog and Project signal handlers below, and by
+    load_dump, which inserts logs without signals and calls rebuild() for
+    the imported range. Use scripts/rebuild_rollup.py to backfill it.
+    """
+
+    user = models.ForeignKey(User)
+    project = models.ForeignKey(Project)
+    date = models.DateField(db_index=True)
+    hours = HourField()
+    billable = models.BooleanField(default=False)
+
+    class Meta:
+        app_label = 'eff'
+        unique_together = (('user', 'project', 'date'),)
+
+    def __unicode__(self):
+        return u'[%s, %s, %s, %s]' % (self.date, self.project, self.user,
+            self.hours)
+
+    @classmethod
+    def refresh(cls, user_id, project_id, a_date):
+        """ Recomputes the rollup row of a single (user, project, date). """
+        hours = TimeLog.objects.filter(user=user_id, project=project_id,
+            date=a_date).aggregate(Sum('hours_booked'))['hours_booked__sum']
+        rows = cls.objects.filter(user=user_id, project=project_id,
+                                  date=a_date)
+        if hours is None:
+            rows.delete()
+        elif not rows.update(hours=hours):
+            billable = Project.objects.filter(id=project_id).values_list(
+                'billable', flat=True)[0]
+            cls.objects.create(user_id=user_id, project_id=project_id,
+                               date=a_date, hours=hours, billable=billable)
+
+    @classmethod
+    def rebuild(cls, from_date=None, to_date=None, client=None):
+        """
+        Recomputes the rollup rows between from_date and to_date (both
+        optional and inclusive), only for the projects of client if given.
+
+        The rows are deleted and re-aggregated from TimeLog with one DELETE
+        and one INSERT ... SELECT, so it is cheap to call after bulk changes
+        to TimeLog.
+        """
+        qn = connection.ops.quote_name
+        table, tl_table = qn(cls._meta.db_table), qn(TimeLog._meta.db_table)
+        p_table = qn(Project._meta.db_table)
+
+        def where(tbl):
+            conds, params = [], []
+            if from_date is not None:
+                conds.append('%s.%s >= %%s' % (tbl, qn('date')))
+                params.append(_as_date(from_date))
+            if to_date is not None:
+                conds.append('%s.%s <= %%s' % (tbl, qn('date')))
+                params.append(_as_date(to_date))
+            if client is not None:
+                conds.append('%s.%s IN (SELECT %s FROM %s WHERE %s = %%s)' % (
+                    tbl, qn('project_id'), qn('id'), p_table, qn('client_id')))
+                params.append(getattr(client, 'pk', client))
+            return ' AND '.join(conds) or '1 = 1', params
+
+        cursor = connection.cursor()
+        conds, params = where(table)
+        cursor.execute('DELETE FROM %s WHERE %s' % (table, conds), params)
+
+        conds, params = where(tl_table)
+        cursor.execute(
+            'INSERT INTO %(table)s (%(user)s, %(project)s, %(date)s, '
+            '%(hours)s, %(billable)s) '
+            'SELECT %(tl)s.%(user)s, %(tl)s.%(project)s, %(tl)s.%(date)s, '
+            'SUM(%(tl)s.%(hours_booked)s), %(p)s.%(billable)s '
+            'FROM %(tl)s INNER JOIN %(p)s ON %(tl)s.%(project)s = %(p)s.%(id)s '
+            'WHERE %(conds)s '
+            'GROUP BY %(tl)s.%(user)s, %(tl)s.%(project)s, %(tl)s.%(date)s, '
+            '%(p)s.%(billable)s' % {
+                'table': table, 'tl': tl_table, 'p': p_table, 'conds': conds,
+                'user': qn('user_id'), 'project': qn('project_id'),
+                'date': qn('date'), 'hours': qn('hours'), 'id': qn('id'),
+                'hours_booked': qn('hours_booked'),
+                'billable': qn('billable')}, params)
+        transaction.commit_unless_managed()
+
+
+def _as_date(value):
+    if isinstance(value, datetime):
+        return value.date()
+    return value
+
+
+#----------------------- Signal handlers ---------------------------------------
+
+def _timelog_key(instance):
+    return (instance.user_id, instance.project_id, instance.date)
+
+
+def timelog_pre_save(sender, instance, **kwargs):
+    # Remember the stored key, so if the log is moved the old row is fixed
+    instance._rollup_old_key = None
+    if instance.pk is not None:
+        old = TimeLog.objects.filter(pk=instance.pk).values_list(
+            'user', 'project', 'date')
+        if old:
+            instance._rollup_old_key = old[0]
+
+
+def timelog_post_save(sender, instance, **kwargs):
+    key = _timelog_key(instance)
+    DailyHours.refresh(*key)
+    ImportDigest.forget(instance.project_id, instance.date)
+    old_key = getattr(instance, '_rollup_old_key', None)
+    if old_key is not None and old_key != key:
+        DailyHours.refresh(*old_key)
+        ImportDigest.forget(old_key[1], old_key[2])
+
+
+def timelog_post_delete(sender, instance, **kwargs):
+    DailyHours.refresh(*_timelog_key(instance))
+    ImportDigest.forget(instance.project_id, instance.date)
+
+
+def project_post_save(sender, instance, **kwargs):
+    DailyHours.objects.filter(project=instance).exclude(
+        billable=instance.billable).update(billable=instance.billable)
+
+signals.pre_save.connect(
+    timelog_pre_save, sender=TimeLog,
+    dispatch_uid='eff._models.log.timelog_pre_save')
+signals.post_save.connect(
+    timelog_post_save, sender=TimeLog,
+    dispatch_uid='eff._models.log.timelog_post_save')
+signals.post_delete.connect(
+    timelog_post_delete, sender=TimeLog,
+    dispatch_uid='eff._models.log.timelog_post_delete')
+signals.post_save.connect(
+    project_post_save, sender=Project,
+    dispatch_uid='eff._models.log.project_post_save')
+
+#-------------------------------------------------------------------------------
@@ -27,6 +27,8 @@ class ProjectAssoc(models.Model):
     from_date = models.DateField()
     to_date = models.DateField(null=True, blank=True)
 
+    # The (member, project, from_date) index is created by the
+    # 0020_add_timelog_indexes migration
     class Meta:
         app_label = 'eff'
         verbose_name = 'Project-User Association'
@@ -0,0 +1,204 @@
+# -*- coding: utf-8 -*-
+# Copyright 2009 - 2011 Machinalis: http://www.machinalis.com/
+#
+# This file is part of Eff.
+#
+# Eff is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Eff is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Eff.  If not, see <http://www.gnu.org/licenses/>.
+
+from django.db import models
+from django.db.models import F, signals
+from django.conf import settings
+from django.core.cache import get_cache
+from django.contrib.comments.models import Comment
+from attachments.models import Attachment
+from datetime import datetime
+from hashlib import sha1
+
+from avg_hours import AvgHours
+from commercial_documents import (Billing, CreditNote, Payment,
+                                  CommercialDocumentBase)
+from log import TimeLog
+from project import Project, ProjectAssoc
+
+# Cache (see settings.CACHES) where the reports are kept
+REPORT_CACHE = getattr(settings, 'REPORT_CACHE', 'reports')
+
+
+class DataVersion(models.Model):
+    """
+    Counter of the changes to some data. The REPORTS one counts the changes
+    to the data the reports are computed from and show: it is bumped by the
+    imports and by the TimeLog, ProjectAssoc, AvgHours, Project, Client,
+    User, UserProfile, Calendar and Holiday saves and deletes, so the
+    reports cached before are stale. The one of the
+    documents_scope of a client counts the changes to its commercial
+    documents, their comments and attachments. The CALENDARS one counts the
+    changes to the calendars and their holidays (see Calendar.holiday_dates).
+    """
+    REPORTS = 'reports'
+    CALENDARS = 'calendars'
+
+    scope = models.CharField(max_length=100, unique=True, default=REPORTS)
+    version = models.IntegerField(default=0)
+    updated = models.DateTimeField()
+
+    class Meta:
+        app_label = 'eff'
+
+    def __unicode__(self):
+        return u'%s: %d (%s)' % (self.scope, self.version, self.updated)
+
+    @staticmethod
+    def documents_scope(client_id):
+        return 'documents:%d' % client_id
+
+    @classmethod
+    def current(cls, scope=REPORTS):
+        """ Returns the current DataVersion of scope. """
+        return cls.objects.get_or_create(
+            scope=scope, defaults={'updated': datetime.now()})[0]
+
+    @classmethod
+    def bump(cls, scope=REPORTS):
+        """ Marks the data of scope as changed. """
+        now = datetime.now()
+        if not cls.objects.filter(scope=scope).update(
+                version=F('version') + 1, updated=now):
+            cls.objects.get_or_create(scope=scope, defaults={'version': 1,
+                                                             'updated': now})
+
+
+def data_changed(sender, **kwargs):
+    """ Signal handler for the models the reports are computed from. """
+    DataVersion.bump()
+
+
+def client_changed(sender, instance, **kwargs):
+    """
+    Signal handler for the clients, shown in the reports and in their
+    account summary.
+    """
+    DataVersion.bump()
+    DataVersion.bump(DataVersion.documents_scope(instance.id))
+
+
+def connect_changes(model, ignored=()):
+    """
+    Connects the signals of model, shown in the reports, so DataVersion
+    REPORTS is bumped when an instance is deleted or saved with values
+    other than the stored ones (but for the ignored fields). For the models
+    often saved without changes, as User on each login (and its UserProfile
+    with it).
+    """
+    fields = [f for f in model._meta.fields if f.name not in ignored]
+
+    def values_changing(sender, instance, **kwargs):
+        stored = sender.objects.filter(pk=instance.pk).values(
+            *[f.attname for f in fields])[:1]
+        instance._data_changed = not stored or any(
+            f.to_python(getattr(instance, f.attname)) != stored[0][f.attname]
+            for f in fields)
+
+    def values_changed(sender, instance, **kwargs):
+        if getattr(instance, '_data_changed', True):
+            data_changed(sender)
+
+    uid = 'eff._models.report_cache.connect_changes.%s.%s' % (
+        model.__module__, model.__name__)
+    signals.pre_save.connect(values_changing, sender=model, weak=False,
+                             dispatch_uid=uid + '.pre_save')
+    signals.post_save.connect(values_changed, sender=model, weak=False,
+                              dispatch_uid=uid + '.post_save')
+    signals.post_delete.connect(data_changed, sender=model,
+                                dispatch_uid=uid + '.post_delete')
+
+
+def documents_changed(sender, instance, **kwargs):
+    """ Signal handler for the commercial documents. """
+    DataVersion.bump(DataVersion.documents_scope(instance.client_id))
+
+
+def document_notes_changed(sender, instance, **kwargs):
+    """
+    Signal handler for the comments and attachments, shown with the
+    commercial documents in the account summary of the client.
+    """
+    model = instance.content_type.model_class()
+    if model is not None and issubclass(model, CommercialDocumentBase):
+        document = instance.content_object
+        if document is not None:
+            documents_changed(sender, document)
+
+
+def cached_report(name, key, compute):
+    """
+    Returns the result of compute(), the report name for key (the entity,
+    period and flags it is computed for). The result is kept in the
+    REPORT_CACHE cache, shared by the workers, until the data changes (see
+    DataVersion). The hits and misses are counted, see report_cache_stats.
+    """
+    cache = get_cache(REPORT_CACHE)
+    version = DataVersion.current()
+    # The date of the version keeps apart the versions of different data
+    # bases, as the test ones
+    cache_key = 'report:%s' % sha1(repr((version.version, version.updated,
+                                         name, key))).hexdigest()
+    result = cache.get(cache_key)
+    if result is None:
+        _count(cache, 'misses')
+        result = compute()
+        cache.set(cache_key, result)
+    else:
+        _count(cache, 'hits')
+    return result
+
+
+def _count(cache, counter):
+    key = 'report:%s' % counter
+    if not cache.add(key, 1):
+        try:
+            cache.incr(key)
+        except ValueError:
+            # Culled by the cache between add and incr
+            cache.add(key, 1)
+
+
+def report_cache_stats():
+    """ Returns the number of 'hits' and 'misses' of the report cache. """
+    cache = get_cache(REPORT_CACHE)
+    return dict((counter, cache.get('report:%s' % counter, 0))
+                for counter in ('hits', 'misses'))
+
+
+for model in (TimeLog, ProjectAssoc, AvgHours, Project):
+    signals.post_save.connect(data_changed, sender=model,
+        dispatch_uid='eff._models.report_cache.data_changed.post_save.%s' %
+                     model.__name__)
+    signals.post_delete.connect(data_changed, sender=model,
+        dispatch_uid='eff._models.report_cache.data_changed.post_delete.%s' %
+                     model.__name__)
+for model in (Billing, CreditNote, Payment):
+    signals.post_save.connect(documents_changed, sender=model,
+        dispatch_uid='eff._models.report_cache.documents_changed.'
+                     'post_save.%s' % model.__name__)
+    signals.post_delete.connect(documents_changed, sender=model,
+        dispatch_uid='eff._models.report_cache.documents_changed.'
+                     'post_delete.%s' % model.__name__)
+for model in (Comment, Attachment):
+    signals.post_save.connect(document_notes_changed, sender=model,
+        dispatch_uid='eff._models.report_cache.document_notes_changed.'
+                     'post_save.%s' % model.__name__)
+    signals.post_delete.connect(document_notes_changed, sender=model,
+        dispatch_uid='eff._models.report_cache.document_notes_changed.'
+                     'post_delete.%s' % model.__name__)
@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+# Copyright 2009 - 2011 Machinalis: http://www.machinalis.com/
+#
+# This file is part of Eff.
+#
+# Eff is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Eff is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Eff.  If not, see <http://www.gnu.org/licenses/>.
+
+from bisect import bisect_right
+from datetime import timedelta
+
+
+# Number of changes seen for each model, see changed()
+_generations = {}
+
+
+def changed(sender, **kwargs):
+    """
+    Signal handler for the models timelines are built from, as AvgHours.
+    The timelines loaded before the change are no longer current.
+    """
+    _generations[sender] = _generations.get(sender, 0) + 1
+
+
+def generation(model):
+    """ Number of changes seen for model, see changed(). """
+    return _generations.get(model, 0)
+
+
+def weekdays_between(from_date, to_date):
+    """
+    Returns the number of days from Monday to Friday between from_date and
+    to_date (both included).
+    """
+    if from_date > to_date:
+        return 0
+    weeks, rest = divmod((to_date - from_date).days + 1, 7)
+    start = from_date.weekday()
+    return weeks * 5 + len([i for i in range(rest) if (start + i) % 7 < 5])
+
+
+class Timeline(object):
+    """
+    Effective dated values of a user, like the AvgHours history.
+
+    Each value is in effect from its date until the day before the next
+    one. Before the first date the value is default.
+    """
+
+    def __init__(self, changes, default=0, model=None):
+        changes = sorted(changes)
+        self.dates = [d for (d, v) in changes]
+        self.values = [v for (d, v) in changes]
+        self.default = default
+        self.model = model
+        self.generation = generation(model)
+
+    @classmethod
+    def load(cls, model, field, user_ids, to_date=None):
+        """
+        Returns a dict mapping each user id to the Timeline of the field
+        values of model (as AvgHours), up to to_date if given.
+        Only one query is issued.
+        """
+        current = generation(model)
+        timelines = dict((uid, []) for uid in user_ids)
+        qset = model.objects.filter(user__in=timelines.keys())
+        if to_date is not None:
+            qset = qset.filter(date__lte=to_date)
+        for uid, a_date, value in qset.order_by('user', 'date').values_list(
+                'user', 'date', field):
+            timelines[uid].append((a_date, value))
+        for uid, changes in timelines.items():
+            timelines[uid] = cls(changes, model=model)
+            timelines[uid].generation = current
+        return timelines
+
+    def is_current(self):
+        """ False if the model changed after this timeline was loaded. """
+        return self.generation == generation(self.model)
+
+    def value_at(self, a_date):
+        i = bisect_right(self.dates, a_date)
+        if i:
+            return self.values[i - 1]
+        return self.default
+
+    def segments(self, from_date, to_date):
+        """
+        Yields (from, to, value) for each stretch of days between from_date
+        and to_date (both included) with the same value.
+        """
+        if from_date > to_date:
+            return
+        i = bisect_right(self.dates, from_date)
+        start, value = from_date, self.value_at(from_date)
+        while i < len(self.dates) and self.dates[i] <= to_date:
+            yield start, self.dates[i] - timedelta(days=1), value
+            start, value = self.dates[i], self.values[i]
+            i += 1
+        yield start, to_date, value
+
+    def weekday_sum(self, from_date, to_date, calendar=None):
+        """
+        Returns the sum of the values in effect on each working day between
+        from_date and to_date (both included). Working days are the ones of
+        calendar if given, else Monday to Friday.
+        """
+        if calendar is None:
+            count = weekdays_between
+        else:
+            count = calendar.working_days
+        return sum(value * count(start, end)
+                   for (start, end, value) in self.segments(from_date,
+                                                            to_date))
+
+    def any_positive(self, from_date, to_date):
+        """
+        Returns True if the value is greater than zero at least one day
+        between from_date and to_date (both included).
+        """
+        return any(value > 0 for (start, end, value) in
+                   self.segments(from_date, to_date))
@@ -0,0 +1,286 @@
+# -*- coding: utf-8 -*-
+# Copyright 2009 - 2011 Machinalis: http://www.machinalis.com/
+#
+# This file is part of Eff.
+#
+# Eff is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Eff is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Eff.  If not, see <http://www.gnu.org/licenses/>.
+
+from django.db import models
+from django.conf import settings
+from django.contrib.auth.models import User
+from datetime import date, datetime, timedelta
+from dateutil.relativedelta import relativedelta
+
+
+class FetchLease(models.Model):
+    """
+    Lock on the logs of a client imported from an external source. It is
+    held by owner (a worker) until expires, so a crashed worker does not
+    keep it forever.
+    """
+    source = models.ForeignKey('ExternalSource')
+    client = models.ForeignKey('Client')
+    owner = models.CharField(max_length=200, blank=True)
+    expires = models.DateTimeField()
+
+    class Meta:
+        app_label = 'eff'
+        unique_together = (('source', 'client'),)
+
+    def __unicode__(self):
+        return u'%s, %s: %s until %s' % (self.source, self.client, self.owner,
+                                         self.expires)
+
+    @classmethod
+    def acquire(cls, source_id, client_id, owner, seconds):
+        """
+        Takes (or extends, if owner already holds it) the lease of the
+        client logs from the source for the given seconds.
+
+        @return: True if owner holds the lease
+        """
+        now = datetime.now()
+        expires = now + timedelta(seconds=seconds)
+        lease, created = cls.objects.get_or_create(
+            source_id=source_id, client_id=client_id,
+            defaults={'owner': owner, 'expires': expires})
+        return created or cls.objects.filter(pk=lease.pk).filter(
+            models.Q(expires__lt=now) | models.Q(owner=owner)).update(
+                owner=owner, expires=expires) == 1
+
+    @classmethod
+    def release(cls, source_id, client_id, owner):
+        cls.objects.filter(source=source_id, client=client_id,
+                           owner=owner).update(owner='',
+                                               expires=datetime.now())
+
+    @classmethod
+    def is_held(cls, source_id, client_id, owner):
+        return cls.objects.filter(source=source_id, client=client_id,
+                                  owner=owner,
+                                  expires__gte=datetime.now()).exists()
+
+
+class FetchCheckpoint(models.Model):
+    """
+    Date up to which the logs of a client were last fetched successfully
+    from an external source, so the next fetch can start there.
+    """
+    source = models.ForeignKey('ExternalSource')
+    client = models.ForeignKey('Client')
+    fetched_to = models.DateField()
+    updated = models.DateTimeField()
+
+    class Meta:
+        app_label = 'eff'
+        unique_together = (('source', 'client'),)
+
+    def __unicode__(self):
+        return u'%s, %s: %s' % (self.source, self.client, self.fetched_to)
+
+    @classmethod
+    def fetch_range(cls, source_id, client_id, to_date=None, full=False):
+        """
+        Returns the (from_date, to_date) range of the next fetch of the
+        client logs from the source: from FETCH_EXTERNALS_OVERLAP_DAYS
+        before the checkpoint (to catch the logs added or changed late) to
+        to_date (by default, today). Without a checkpoint, or if full is
+        set, the range starts on the first day of the previous month.
+        """
+        if to_date is None:
+            to_date = date.today()
+        fetched_to = None
+        if not full:
+            fetched_to = cls.objects.filter(
+                source=source_id, client=client_id).values_list(
+                    'fetched_to', flat=True)[:1]
+        if fetched_to:
+            overlap = getattr(settings, 'FETCH_EXTERNALS_OVERLAP_DAYS', 7)
+            from_date = min(fetched_to[0], to_date) - timedelta(days=overlap)
+        else:
+            from_date = date(to_date.year, to_date.month, 1) - \
+                relativedelta(months=1)
+        return from_date, to_date
+
+    @classmethod
+    def advance(cls, source_id, client_id, fetched_to):
+        """ Moves the checkpoint forward to fetched_to, never back. """
+        if isinstance(fetched_to, datetime):
+            fetched_to = fetched_to.date()
+        now = datetime.now()
+        checkpoint, created = cls.objects.get_or_create(
+            source_id=source_id, client_id=client_id,
+            defaults={'fetched_to': fetched_to, 'updated': now})
+        if not created:
+            cls.objects.filter(pk=checkpoint.pk,
+                               fetched_to__lt=fetched_to).update(
+                                   fetched_to=fetched_to, updated=now)
+
+
+class UpdateJob(models.Model):
+    """
+    Request to fetch the logs of a client from its external source and to
+    import them, run by the update worker (see scripts/update_worker.py).
+    A full update imports the days whose logs did not change too.
+    """
+    PENDING = 'pending'
+    FETCHING = 'fetching'
+    IMPORTING = 'importing'
+    DONE = 'done'
+    EMPTY = 'empty'
+    UNCHANGED = 'unchanged'
+    FAILED = 'failed'
+    STATUS_CHOICES = (
+        (PENDING, 'Pending'),
+        (FETCHING, 'Fetching'),
+        (IMPORTING, 'Importing'),
+        (DONE, 'Done'),
+        (EMPTY, 'Nothing to import'),
+        (UNCHANGED, 'Unchanged, import skipped'),
+        (FAILED, 'Failed'),
+    )
+    RUNNING = (FETCHING, IMPORTING)
+
+    source = models.ForeignKey('ExternalSource')
+    client = models.ForeignKey('Client')
+    from_date = models.DateField()
+    to_date = models.DateField()
+    requested_by = models.ForeignKey(User, null=True, blank=True)
+    full = models.BooleanField(default=False)
+    created = models.DateTimeField(auto_now_add=True)
+    status = models.CharField(max_length=20, default=PENDING,
+                              choices=STATUS_CHOICES, db_index=True)
+    owner = models.CharField(max_length=200, blank=True)
+    started = models.DateTimeField(null=True, blank=True)
+    finished = models.DateTimeField(null=True, blank=True)
+    fetch_seconds = models.FloatField(null=True, blank=True)
+    import_seconds = models.FloatField(null=True, blank=True)
+    added = models.IntegerField(null=True, blank=True)
+    removed = models.IntegerField(null=True, blank=True)
+    unchanged = models.IntegerField(null=True, blank=True)
+    error = models.TextField(blank=True)
+
+    class Meta:
+        app_label = 'eff'
+        ordering = ['-created']
+
+    def __unicode__(self):
+        return u'%s, %s (%s - %s): %s' % (self.source, self.client,
+                                          self.from_date, self.to_date,
+                                          self.status)
+
+    @classmethod
+    def enqueue(cls, client, from_date=None, to_date=None,
+                requested_by=None, full=False):
+        """
+        Queues the update of the client logs between from_date and to_date
+        (by default, the range given by FetchCheckpoint.fetch_range), unless
+        an update of them (a full one, if full is set) is already queued or
+        running. A full update also imports the unchanged days.
+
+        @return: (job, created)
+        """
+        if from_date is None:
+            from_date, to_date = FetchCheckpoint.fetch_range(
+                client.external_source_id, client.id, to_date, full)
+        elif to_date is None:
+            to_date = date.today()
+        queued = cls.objects.filter(
+            source=client.external_source_id, client=client,
+            status__in=(cls.PENDING,) + cls.RUNNING,
+            from_date__lte=from_date, to_date__gte=to_date)
+        if full:
+            queued = queued.filter(full=True)
+        if queued:
+            return queued[0], False
+        return cls.objects.create(source_id=client.external_source_id,
+                                  client=client, from_date=from_date,
+                                  to_date=to_date, requested_by=requested_by,
+                                  full=full), True
+
+    @classmethod
+    def enqueue_all(cls, from_date=None, to_date=None, requested_by=None,
+                    full=False):
+        """
+        Queues the update of the logs of every client with an external
+        source, see enqueue.
+
+        @return: the number of jobs created
+        """
+        from client import Client
+        return len([client for client in Client.objects.filter(
+                        external_source__isnull=False)
+                    if cls.enqueue(client, from_date, to_date,
+                                   requested_by, full)[1]])
+
+    @classmethod
+    def requeue_stale(cls):
+        """ Puts back in the queue the running jobs whose lease expired. """
+        for job in cls.objects.filter(status__in=cls.RUNNING):
+            if not FetchLease.is_held(job.source_id, job.client_id,
+                                      job.owner):
+                cls.objects.filter(pk=job.pk, owner=job.owner,
+                                   status__in=cls.RUNNING).update(
+                                       status=cls.PENDING, owner='')
+
+    @classmethod
+    def claim_next(cls, owner, lease_seconds):
+        """
+        Takes the oldest pending job whose client logs lease can be acquired
+        by owner, and marks it as being fetched.
+
+        @return: the job, or None if there are none
+        """
+        cls.requeue_stale()
+        pending = cls.objects.filter(status=cls.PENDING)
+        for job in pending.order_by('created', 'id'):
+            if not FetchLease.acquire(job.source_id, job.client_id, owner,
+                                      lease_seconds):
+                continue
+            if cls.objects.filter(pk=job.pk, status=cls.PENDING).update(
+                    status=cls.FETCHING, owner=owner,
+                    started=datetime.now()):
+                return cls.objects.get(pk=job.pk)
+            FetchLease.release(job.source_id, job.client_id, owner)
+        return None
+
+    def progress(self, status, **fields):
+        """
+        Saves the status and the given fields of the job, unless it is no
+        longer owned by its owner (it was put back in the queue, or taken by
+        another worker, after the lease expired).
+
+        @return: False if the update was lost
+        """
+        fields['status'] = status
+        if status not in (self.PENDING,) + self.RUNNING:
+            fields['finished'] = datetime.now()
+        if not type(self).objects.filter(pk=self.pk, owner=self.owner).update(
+                **fields):
+            return False
+        for name, value in fields.items():
+            setattr(self, name, value)
+        return True
+
+    def as_dict(self):
+        """ Progress of the job, as returned by eff_update_db. """
+        _str = lambda x: x and unicode(x)
+        return dict(source=self.source.name, client=self.client.name,
+                    from_date=_str(self.from_date), to_date=_str(self.to_date),
+                    status=self.status, created=_str(self.created),
+                    started=_str(self.started), finished=_str(self.finished),
+                    fetch_seconds=self.fetch_seconds,
+                    import_seconds=self.import_seconds, added=self.added,
+                    removed=self.removed, unchanged=self.unchanged,
+                    full=self.full, error=self.error)
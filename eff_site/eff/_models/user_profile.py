@@ -17,14 +17,16 @@
 
 from django.db import models
 from django.contrib.auth.models import User, Group
-from datetime import timedelta, datetime
 from avg_hours import AvgHours
+from timeline import Timeline
+from work_calendar import Calendar
 from client import Client
 from django.db.models import permalink, signals
 from django.core.exceptions import MultipleObjectsReturned
 
 from project import Project, ProjectAssoc
 from log import TimeLog
+from report_cache import cached_report, connect_changes
 from decimal import Decimal
 
 
@@ -71,6 +73,9 @@ class UserProfile(models.Model):
     handles = models.ManyToManyField(Handle, through="ClientHandles")
     receive_report_email = models.BooleanField(default=True,
         help_text="Receive weekly report by email")
+    calendar = models.ForeignKey(Calendar, blank=True, null=True,
+        help_text="Holidays are not loggable days. If empty, every day "
+                  "from Monday to Friday is loggable")
 
     class Meta:
         app_label = 'eff'
@@ -97,33 +102,24 @@ class UserProfile(models.Model):
     def __unicode__(self):
         return u'%s (%s)' % (self.user.get_full_name(), self.user.username)
 
-    def get_avg_hours_for(self, ndate):
-        try:
-            hours = self.user.avghours_set.filter(
-                date__lte=ndate).latest().hours
-        except AvgHours.DoesNotExist:
-            hours = 0
-        return hours
-
-    def num_loggable_hours(self, from_date, to_date):
+    def _timeline(self, model, field):
+        # Cached in the instance (so for the request) until the model changes
+        attr = '_%s_timeline' % model.__name__.lower()
+        timeline = getattr(self, attr, None)
+        if timeline is None or not timeline.is_current():
+            timeline = Timeline.load(model, field, [self.user_id])[self.user_id]
+            setattr(self, attr, timeline)
+        return timeline
 
-        start_hours = self.get_avg_hours_for(from_date)
-        lista_ah = list(self.user.avghours_set.filter(date__gt=from_date,
-                                                      date__lte=to_date))
-        delta = timedelta(days=1)
-        num = 0
+    def avg_hours_timeline(self):
+        return self._timeline(AvgHours, 'hours')
 
-        hours = start_hours
-        while(from_date <= to_date):
-            if lista_ah:
-                if from_date == lista_ah[0].date:
-                    hours = lista_ah[0].hours
-                    from_date = lista_ah.pop(0).date
-            if 1 <= from_date.isoweekday() <= 5:
-                num += hours
-            from_date += delta
+    def get_avg_hours_for(self, ndate):
+        return self.avg_hours_timeline().value_at(ndate)
 
-        return num
+    def num_loggable_hours(self, from_date, to_date):
+        return self.avg_hours_timeline().weekday_sum(from_date, to_date,
+                                                     self.calendar)
 
     def add_avg_hours(self, new_date, hours):
         if hours >= 0:
@@ -146,11 +142,7 @@ class UserProfile(models.Model):
             raise ValueError, "Negative value for hours"
 
     def is_active(self, from_date, to_date):
-        delta = timedelta(days=1)
-        while to_date >= from_date:
-            if self.get_avg_hours_for(to_date) > 0:
-                return True
-            to_date -= delta
+        return self.avg_hours_timeline().any_positive(from_date, to_date)
 
     def get_worked_hours(self, from_date, to_date):
         return self.__sum_hours(
@@ -205,12 +197,13 @@ class UserProfile(models.Model):
         return self.user
 
     def report(self, from_date, to_date, project=None):
-        report = list(TimeLog.report(self, from_date, to_date, project))
+        return cached_report('UserProfile.report', (self.id, from_date,
+                                                    to_date, project),
+                             lambda: self._report(from_date, to_date,
+                                                  project))
 
-        #Ordenamos por fecha
-        report.sort(lambda x, y: cmp(datetime(x[4].year, x[4].month, x[4].day),\
-                                    datetime(y[4].year, y[4].month, y[4].day)))
-        return report
+    def _report(self, from_date, to_date, project):
+        return list(TimeLog.report(self, from_date, to_date, project))
 
     def get_absolute_url(self):
         return ('profiles_profile_detail', (), {'username': self.user.username})
@@ -244,6 +237,11 @@ signals.post_save.connect(
     create_profile_for_user, sender=User,
     dispatch_uid='eff._models.user_profile.create_profile_for_user')
 
+# The users and their profiles are shown in the reports. Logging in saves
+# them, with a new last_login
+connect_changes(User, ignored=('last_login', 'password'))
+connect_changes(UserProfile)
+
 #-------------------------------------------------------------------------------
 
 
@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+# Copyright 2009 - 2011 Machinalis: http://www.machinalis.com/
+#
+# This file is part of Eff.
+#
+# Eff is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Eff is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Eff.  If not, see <http://www.gnu.org/licenses/>.
+
+from django.db import models
+from django.db.models import signals
+from bisect import bisect_left, bisect_right
+from timeline import weekdays_between
+
+
+# Sorted working-day holidays of each calendar: {calendar_id: (version,
+# [date, ...])}, where version is the one of the CALENDARS DataVersion. The
+# position of a date in the list is the number of holidays before it, so
+# any range is counted with two bisections.
+_holidays = {}
+
+
+class Calendar(models.Model):
+    """
+    Working days of a country or office: Monday to Friday except holidays.
+    """
+    name = models.CharField(max_length=100, unique=True)
+
+    class Meta:
+        app_label = 'eff'
+        ordering = ['name']
+
+    def __unicode__(self):
+        return u'%s' % (self.name,)
+
+    def holiday_dates(self):
+        """
+        Returns the sorted dates of the holidays that fall from Monday to
+        Friday. They are loaded once by each process and kept until the
+        CALENDARS DataVersion changes, which is read once by each instance.
+        """
+        version = getattr(self, '_holidays_version', None)
+        if version is None:
+            # Imported here, as report_cache imports the models that need
+            # the calendars
+            from report_cache import DataVersion
+            current = DataVersion.current(DataVersion.CALENDARS)
+            version = self._holidays_version = (current.version,
+                                                current.updated)
+        cached = _holidays.get(self.id)
+        if cached is None or cached[0] != version:
+            dates = [d for d in Holiday.objects.filter(calendar=self.id
+                        ).order_by('date').values_list('date', flat=True)
+                     if d.weekday() < 5]
+            cached = _holidays[self.id] = (version, dates)
+        return cached[1]
+
+    def working_days(self, from_date, to_date):
+        """
+        Returns the number of working days between from_date and to_date
+        (both included).
+        """
+        if from_date > to_date:
+            return 0
+        holidays = self.holiday_dates()
+        return (weekdays_between(from_date, to_date) -
+                (bisect_right(holidays, to_date) -
+                 bisect_left(holidays, from_date)))
+
+
+class Holiday(models.Model):
+    calendar = models.ForeignKey(Calendar)
+    date = models.DateField()
+    name = models.CharField(max_length=100, blank=True)
+
+    class Meta:
+        app_label = 'eff'
+        ordering = ['date']
+        unique_together = (('calendar', 'date'),)
+
+    def __unicode__(self):
+        return u'%s: %s %s' % (self.calendar, self.date, self.name)
+
+
+def calendars_changed(sender, **kwargs):
+    """
+    Signal handler for the calendars and their holidays. The holidays
+    loaded before by any process are stale, the ones of this one are
+    dropped right away, and so are the reports (see DataVersion).
+    """
+    from report_cache import DataVersion
+    DataVersion.bump(DataVersion.CALENDARS)
+    DataVersion.bump()
+    _holidays.clear()
+
+for model in (Calendar, Holiday):
+    signals.post_save.connect(calendars_changed, sender=model,
+        dispatch_uid='eff._models.work_calendar.calendars_changed.'
+                     'post_save.%s' % model.__name__)
+    signals.post_delete.connect(calendars_changed, sender=model,
+        dispatch_uid='eff._models.work_calendar.calendars_changed.'
+                     'post_delete.%s' % model.__name__)
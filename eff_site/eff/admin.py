@@ -19,7 +19,8 @@ from django.contrib import admin
 from eff_site.eff.models import Project, Client, ExternalSource, Wage, BillingEmail
 from eff_site.eff.models import (AvgHours, Currency, ProjectAssoc, TimeLog,
                                  Handle, ClientHandles, Billing, CreditNote,
-                                 Payment, CommercialDocumentBase)
+                                 Payment, CommercialDocumentBase, Calendar,
+                                 Holiday, UpdateJob)
 from _models.user_profile import UserProfile
 from eff_site.eff.forms import UserAdminForm, UserAdminChangeForm
 from django.contrib.auth.models import User
@@ -150,6 +151,14 @@ class AvgHoursAdmin(admin.ModelAdmin):
     form = AvgHoursAdminForm
 
 
+class HolidayInLine(admin.TabularInline):
+    model = Holiday
+
+
+class CalendarAdmin(admin.ModelAdmin):
+    inlines = [HolidayInLine]
+
+
 class UserProfileInLine(admin.TabularInline):
     model = UserProfile
 
@@ -280,6 +289,12 @@ class PaymentAdmin(admin.ModelAdmin):
     inlines = [AttachmentInlines]
 
 
+class UpdateJobAdmin(admin.ModelAdmin):
+    list_display = ('source', 'client', 'from_date', 'to_date', 'status',
+                    'created', 'finished', 'added', 'removed')
+    list_filter = ('status', 'source')
+
+
 admin.site.unregister(User)
 admin.site.register(User, UserAdmin)
 admin.site.register(Project, ProjectAdmin)
@@ -288,6 +303,7 @@ admin.site.register(Client, ClientAdmin)
 admin.site.register(ExternalSource, ExternalSourceAdmin)
 admin.site.register(Wage, WageAdmin)
 admin.site.register(AvgHours, AvgHoursAdmin)
+admin.site.register(Calendar, CalendarAdmin)
 admin.site.register(UserProfile, UserProfileAdmin)
 admin.site.register(Currency, CurrencyAdmin)
 admin.site.register(ExternalId, ExternalIdAdmin)
@@ -297,4 +313,5 @@ admin.site.register(Handle, HandleAdmin)
 admin.site.register(Billing, BillingAdmin)
 admin.site.register(CreditNote, CreditNoteAdmin)
 admin.site.register(Payment, PaymentAdmin)
+admin.site.register(UpdateJob, UpdateJobAdmin)
 admin.site.register(Attachment, AttachmentAdmin)
@@ -19,11 +19,60 @@
 
 from datetime import datetime
 from django.contrib.auth.models import User
+from relatorio.templates.opendocument import Template
+from threading import Lock
+from _models.log import TimeLog
+from utils import debug, ERROR
+import csv
 import itertools
+import os
 from django.contrib.humanize.templatetags import humanize
 from decimal import Decimal
 
 
+# Directory of the ODT templates of the reports
+ODT_TEMPLATES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                 os.pardir, 'templates')
+
+# Compiled ODT templates, as {path: (mtime, template)}
+_odt_templates = {}
+_odt_templates_lock = Lock()
+
+
+def odt_template(name):
+    """
+    Returns the relatorio template of the ODT file name (relative to
+    ODT_TEMPLATES_DIR). It is parsed once per process, and again only if
+    the file changes.
+    """
+    path = os.path.join(ODT_TEMPLATES_DIR, name)
+    mtime = os.stat(path).st_mtime
+    cached = _odt_templates.get(path)
+    if cached is None or cached[0] != mtime:
+        with _odt_templates_lock:
+            cached = _odt_templates.get(path)
+            if cached is None or cached[0] != mtime:
+                template = Template(source=None, filepath=path)
+                # Genshi prepares the stream on first use, do it now rather
+                # than in concurrent requests
+                template.stream
+                cached = _odt_templates[path] = (mtime, template)
+    return cached[1]
+
+
+def warm_odt_templates():
+    """
+    Parses every ODT template, so no export has to. A template that can not
+    be parsed is left for the exports that use it to fail.
+    """
+    for name in os.listdir(ODT_TEMPLATES_DIR):
+        if name.endswith('.odt'):
+            try:
+                odt_template(name)
+            except Exception, e:
+                debug('Can not parse %s: %s', name, e, level=ERROR)
+
+
 # For further usage i.e. to calculate totals
 class ClientReverseBilling(dict):
     pass
@@ -51,12 +100,17 @@ def format_invoice_period(from_date, to_date):
 def format_report_data(rep, client, from_date, to_date, detailed=False):
     report_list = []
     total_sum = Decimal('0.00')
+    full_names = dict((username, first_name + " " + last_name)
+                      for username, first_name, last_name in
+                      User.objects.filter(username__in=set(
+                          user[0] for users in rep.itervalues()
+                          for user in users)).values_list(
+                              'username', 'first_name', 'last_name'))
     for p, users in rep.iteritems():
         user_list = []
         for user in users:
-            du = User.objects.get(username=user[0])
             if not detailed:
-                user_d = {'full_name': du.first_name + " " + du.last_name,
+                user_d = {'full_name': full_names[user[0]],
                           'hs': str(user[1].quantize(Decimal('.000')))}
                 # Include rates in report
                 if len(user) > 2:
@@ -68,7 +122,7 @@ def format_report_data(rep, client, from_date, to_date, detailed=False):
                 user_list.append(user_d)
             else:
                 user_list.append({
-                        'full_name': du.first_name + " " + du.last_name,
+                        'full_name': full_names[user[0]],
                         'hs': str(user[1].quantize(Decimal('.000'))),
                         'hs_detail': map(
                             lambda x: {
@@ -160,3 +214,69 @@ def format_report_data_user(rep, user, from_date, to_date, detailed=False):
             today = datetime.now().strftime("%A, %d %B %Y")
         )
     return reverse_billing
+
+
+# Rows of the streamed csv exports joined in each chunk of the response
+CSV_CHUNK_ROWS = 100
+
+
+class _Echo(object):
+    """ File-like object that returns what is written to it. """
+
+    def write(self, value):
+        return value
+
+
+def csv_lines(rows):
+    """
+    Yields the rows formatted as csv, a few lines at a time, so exports can
+    be streamed by an HttpResponse without building them in memory.
+    """
+    writer = csv.writer(_Echo(), quoting=csv.QUOTE_ALL, lineterminator='\n')
+    chunk = []
+    for row in rows:
+        chunk.append(writer.writerow([isinstance(x, unicode) and
+                                      x.encode('utf-8') or x for x in row]))
+        if len(chunk) == CSV_CHUNK_ROWS:
+            yield ''.join(chunk)
+            chunk = []
+    if chunk:
+        yield ''.join(chunk)
+
+
+def user_detailed_csv_rows(user, from_date, to_date, project=None):
+    """
+    Logs of user between from_date and to_date (only those of the project
+    named project, if given) as rows of its detailed csv report, sorted by
+    date: (date, project, task name, description, hours).
+    """
+    logs = TimeLog.objects.filter(user=user, date__gte=from_date,
+                                  date__lte=to_date)
+    if project is not None:
+        logs = logs.filter(project__name=project)
+    logs = logs.order_by('date', 'id').values_list(
+        'date', 'project__name', 'task_name', 'description', 'hours_booked')
+    for log_date, project_name, task_name, description, hours in \
+            logs.iterator():
+        yield (log_date.strftime("%d/%m/%Y"), project_name, task_name,
+               description, str(hours.quantize(Decimal('.000'))))
+
+
+def client_detailed_csv_rows(client, from_date, to_date):
+    """
+    Logs of the client projects between from_date and to_date as rows of
+    its detailed csv report, sorted by project, user and date: (date,
+    project, user full name, description, hours).
+    """
+    logs = TimeLog.objects.filter(project__client=client,
+                                  date__gte=from_date, date__lte=to_date)
+    logs = logs.order_by('project__name', 'user__first_name',
+                         'user__last_name', 'user__username', 'date',
+                         'id').values_list(
+        'date', 'project__name', 'user__first_name', 'user__last_name',
+        'description', 'hours_booked')
+    for log_date, project_name, first_name, last_name, description, hours in \
+            logs.iterator():
+        yield (log_date.strftime("%d/%m/%Y"), project_name,
+               first_name + " " + last_name, description,
+               str(hours.quantize(Decimal('.000'))))
@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+# Copyright 2009 - 2011 Machinalis: http://www.machinalis.com/
+#
+# This file is part of Eff.
+#
+# Eff is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Eff is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Eff.  If not, see <http://www.gnu.org/licenses/>.
+
+from django.conf import settings
+from django.test.simple import DjangoTestSuiteRunner
+
+
+class EffTestSuiteRunner(DjangoTestSuiteRunner):
+    """
+    Runs the tests keeping the reports in memory, so they do not leave
+    cached reports behind (see settings.TEST_RUNNER).
+    """
+
+    def setup_test_environment(self, **kwargs):
+        super(EffTestSuiteRunner, self).setup_test_environment(**kwargs)
+        self._reports_cache = settings.CACHES['reports']
+        settings.CACHES['reports'] = {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'reports',
+        }
+
+    def teardown_test_environment(self, **kwargs):
+        settings.CACHES['reports'] = self._reports_cache
+        super(EffTestSuiteRunner, self).teardown_test_environment(**kwargs)
@@ -0,0 +1,887 @@
+# -*- coding: utf-8 -*-
+# Copyright 2009 - 2011 Machinalis: http://www.machinalis.com/
+#
+# This file is part of Eff.
+#
+# Eff is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Eff is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Eff.  If not, see <http://www.gnu.org/licenses/>.
+
+from django.test import TestCase
+from django.test.client import Client as TestClient
+from django.contrib.auth.models import User
+from django.core.urlresolvers import reverse
+from django.utils import simplejson
+from eff.models import (TimeLog, ExternalId, UpdateJob, FetchLease,
+                        FetchCheckpoint, ImportDigest, Dump)
+from factories import (ExternalSourceFactory, ClientFactory, ProjectFactory,
+                       ProjectAssocFactory, AdminFactory)
+from eff_site.scripts import fetch_all
+from eff_site.scripts.fetch_all import FetchJob, run_jobs
+from eff_site.scripts.update_worker import run_job, LeaseHeartbeat
+from eff.utils import load_logs
+from eff_site.scripts.jira import Jira
+from eff_site.scripts.tutos import Tutos
+from eff_site.scripts.dotproject import DotProject
+
+from unittest import TestSuite, makeSuite
+from datetime import datetime, date, timedelta
+from dateutil.relativedelta import relativedelta
+from decimal import Decimal
+import os
+from threading import Lock, Thread
+from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+from SocketServer import ThreadingMixIn
+from StringIO import StringIO
+import cgi
+import csv
+import shutil
+import sqlite3
+import tempfile
+import time
+
+
+class FakeAdapter(object):
+    """ Stand-in for an external source module, see FetchJob.adapter. """
+
+    def __init__(self, days=(), error=None):
+        self.days = days
+        self.error = error
+        self.lock = Lock()
+        self.running = 0
+        self.max_running = 0
+
+    def fetch_all(self, source, client, author, from_date, to_date, _file):
+        with self.lock:
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+        try:
+            time.sleep(0.2)
+            if self.error:
+                raise self.error
+            _file.write("# ExternalSource: %s\r\n# Client: %s\r\n"
+                        "# Author: %s\r\n# From date: %s\r\n"
+                        "# To date: %s\r\n" % (source.name, client.name,
+                                               author, from_date, to_date))
+            for day in self.days:
+                _file.write('"2010-09-%02d","proj1","login0","2","task",'
+                            '"desc"\r\n' % day)
+        finally:
+            with self.lock:
+                self.running -= 1
+
+
+class StreamingAdapter(object):
+    """ Stand-in for an external source module that streams its logs. """
+
+    def __init__(self, days=()):
+        self.days = days
+
+    def fetch_logs(self, source, client, author, from_date, to_date):
+        return from_date, to_date, ((date(2010, 9, day), u'proj1', u'login0',
+                                     Decimal('1.5'), u'task', u'desc')
+                                    for day in self.days)
+
+
+class ExpiringAdapter(StreamingAdapter):
+    """
+    Stand-in for an external source module whose fetch outlasts the lease
+    of the logs, which are taken by worker2 meanwhile.
+    """
+
+    def fetch_logs(self, source, client, author, from_date, to_date):
+        FetchLease.objects.update(expires=datetime.now() -
+                                  timedelta(seconds=1))
+        self.taken = UpdateJob.claim_next('worker2', 60)
+        return super(ExpiringAdapter, self).fetch_logs(
+            source, client, author, from_date, to_date)
+
+
+class FetchTestCase(TestCase):
+
+    def setUp(self):
+        self.csv_dir = fetch_all.settings.FETCH_EXTERNALS_CSV_DIR
+        fetch_all.settings.FETCH_EXTERNALS_CSV_DIR = tempfile.mkdtemp()
+        self.source = ExternalSourceFactory()
+        self.clients = [ClientFactory(external_source=self.source)
+                        for i in range(3)]
+        for client in self.clients:
+            project = ProjectFactory(client=client, external_id='proj1',
+                                     start_date=date(2010, 1, 1))
+        user = User.objects.create_user(username='test', password='test',
+                                        email='test@test.com')
+        ExternalId.objects.create(login='login0', source=self.source,
+                                  userprofile=user.get_profile())
+        ProjectAssocFactory(project=project, member=user.get_profile())
+
+    def tearDown(self):
+        shutil.rmtree(fetch_all.settings.FETCH_EXTERNALS_CSV_DIR)
+        fetch_all.settings.FETCH_EXTERNALS_CSV_DIR = self.csv_dir
+
+    def _jobs(self, adapters):
+        return [FetchJob(self.source, client, 'Eff Fetcher',
+                         datetime(2010, 9, 1), datetime(2010, 9, 30), adapter)
+                for (client, adapter) in zip(self.clients, adapters)]
+
+
+class FetchJobsTest(FetchTestCase):
+
+    def test_run_jobs(self):
+        adapter = FakeAdapter()
+        failing = FakeAdapter(error=IOError('connection refused'))
+        jobs = self._jobs([FakeAdapter(days=[1, 2, 3]), adapter, failing])
+        run_jobs(jobs, workers=3)
+
+        self.assertEqual(['done', 'empty', 'failed'],
+                         [job.status for job in jobs])
+        self.assertEqual({'added': 3, 'removed': 0, 'unchanged': 0},
+                         dict((k, jobs[0].stats[k]) for k in
+                              ('added', 'removed', 'unchanged')))
+        self.assertTrue('connection refused' in jobs[2].error)
+        self.assertTrue(jobs[2].import_seconds is None)
+        self.assertTrue(all(job.fetch_seconds >= 0.2 for job in jobs))
+        self.assertEqual(3, TimeLog.objects.count())
+
+    def test_bounded_workers(self):
+        adapter = FakeAdapter()
+        jobs = self._jobs([adapter] * 3)
+        run_jobs(jobs, workers=2)
+        self.assertEqual(2, adapter.max_running)
+        self.assertEqual(['empty'] * 3, [job.status for job in jobs])
+
+    def test_streaming(self):
+        jobs = self._jobs([StreamingAdapter(days=[1, 2]),
+                           StreamingAdapter(days=[3])])
+        jobs[1].archive = False
+        run_jobs(jobs)
+        self.assertEqual(['done', 'done'], [job.status for job in jobs])
+        self.assertEqual(Decimal('4.5'), sum(log.hours_booked for log in
+                                             TimeLog.objects.all()))
+
+        # The streamed logs are archived
+        lines = open(jobs[0].filename).read().splitlines()
+        self.assertEqual(7, len(lines))
+        self.assertEqual('"2010-09-02","proj1","login0","1.5","task","desc"',
+                         lines[-1])
+        self.assertFalse(os.path.exists(jobs[1].filename))
+
+        # Nothing fetched, nothing is replaced
+        jobs = self._jobs([StreamingAdapter()])
+        run_jobs(jobs)
+        self.assertEqual('empty', jobs[0].status)
+        self.assertEqual(3, TimeLog.objects.count())
+
+    def test_unchanged(self):
+        jobs = self._jobs([StreamingAdapter(days=[1, 2, 3])])
+        run_jobs(jobs)
+        self.assertEqual('done', jobs[0].status)
+        ids = dict(TimeLog.objects.values_list('date', 'id'))
+        # One per day of the fetched range
+        self.assertEqual(30, ImportDigest.objects.count())
+
+        # The same logs again, the import is skipped
+        jobs = self._jobs([StreamingAdapter(days=[3, 2, 1])])
+        run_jobs(jobs)
+        self.assertEqual('unchanged', jobs[0].status)
+        self.assertTrue(jobs[0].stats['skipped'])
+        self.assertEqual(3, jobs[0].stats['unchanged'])
+        self.assertTrue('unchanged' in jobs[0].report())
+        self.assertEqual(ids, dict(TimeLog.objects.values_list('date', 'id')))
+
+        # Only the changed day is imported again
+        jobs = self._jobs([StreamingAdapter(days=[1, 2, 3, 3])])
+        run_jobs(jobs)
+        self.assertEqual('done', jobs[0].status)
+        self.assertEqual(4, TimeLog.objects.count())
+        logs = TimeLog.objects.exclude(date=date(2010, 9, 3))
+        self.assertEqual(dict((d, ids[d]) for d in (date(2010, 9, 1),
+                                                    date(2010, 9, 2))),
+                         dict(logs.values_list('date', 'id')))
+
+        # A day without logs anymore changed too
+        jobs = self._jobs([StreamingAdapter(days=[1, 2])])
+        run_jobs(jobs)
+        self.assertEqual('done', jobs[0].status)
+        self.assertEqual(2, TimeLog.objects.count())
+        self.assertEqual(30, ImportDigest.objects.count())
+
+    def test_unchanged_without_digests(self):
+        # Imported without digests, as before they were saved
+        client = self.clients[0]
+        load_logs(self.source, client, 'Eff Fetcher', datetime(2010, 9, 1),
+                  datetime(2010, 9, 30), StreamingAdapter(
+                      days=[1, 2]).fetch_logs(None, None, None, None,
+                                              None)[2])
+        self.assertEqual(0, ImportDigest.objects.count())
+
+        # The logs of the days without digest are gone
+        stats = {}
+        load_logs(self.source, client, 'Eff Fetcher', datetime(2010, 9, 1),
+                  datetime(2010, 9, 30), [], skip_unchanged=True,
+                  stats=stats)
+        self.assertFalse(stats.get('skipped'))
+        self.assertEqual(2, stats['removed'])
+        self.assertEqual(0, TimeLog.objects.count())
+
+    def test_unchanged_not_imported(self):
+        client = self.clients[0]
+        rows = [(date(2010, 9, 1), u'proj1', u'login1', Decimal('1.5'),
+                 u'task', u'desc')]
+
+        def load():
+            stats = {}
+            load_logs(self.source, client, 'Eff Fetcher',
+                      datetime(2010, 9, 1), datetime(2010, 9, 30), rows,
+                      is_api=True, skip_unchanged=True, stats=stats)
+            return stats.get('skipped', False), stats['added']
+
+        # login1 is unknown, the day is imported again once it is known
+        self.assertEqual((False, 0), load())
+        user = User.objects.create_user(username='test1', password='test1',
+                                        email='test1@test.com')
+        ExternalId.objects.create(login='login1', source=self.source,
+                                  userprofile=user.get_profile())
+        self.assertEqual((False, 1), load())
+        self.assertEqual((True, 0), load())
+
+        # And once its logs are deleted, or their dump
+        TimeLog.objects.all().delete()
+        self.assertEqual((False, 1), load())
+        Dump.objects.all().delete()
+        self.assertEqual(0, TimeLog.objects.count())
+        self.assertEqual((False, 1), load())
+
+    def test_full(self):
+        jobs = self._jobs([StreamingAdapter(days=[1])])
+        run_jobs(jobs)
+        jobs = self._jobs([StreamingAdapter(days=[1])])
+        jobs[0].skip_unchanged = False
+        run_jobs(jobs)
+        self.assertEqual('done', jobs[0].status)
+        self.assertEqual(1, jobs[0].stats['added'])
+
+        # A full update is queued even if a plain one is
+        job, created = UpdateJob.enqueue(self.clients[0], date(2010, 9, 1),
+                                         date(2010, 9, 30))
+        full, created = UpdateJob.enqueue(self.clients[0], date(2010, 9, 1),
+                                          date(2010, 9, 30), full=True)
+        self.assertTrue(created and full.full and not job.full)
+
+    def test_checkpoints(self):
+        source, client = self.source.id, self.clients[0].id
+        today = date.today()
+        default_from = date(today.year, today.month, 1) - \
+            relativedelta(months=1)
+        self.assertEqual((default_from, today),
+                         FetchCheckpoint.fetch_range(source, client))
+
+        jobs = self._jobs([StreamingAdapter(days=[1]),
+                           FakeAdapter(error=IOError('down'))])
+        run_jobs(jobs)
+        self.assertEqual([(source, client, date(2010, 9, 30))],
+                         list(FetchCheckpoint.objects.values_list(
+                             'source', 'client', 'fetched_to')))
+
+        self.assertEqual((date(2010, 9, 23), date(2010, 10, 5)),
+                         FetchCheckpoint.fetch_range(source, client,
+                                                     date(2010, 10, 5)))
+        self.assertEqual((default_from, today),
+                         FetchCheckpoint.fetch_range(source, client,
+                                                     full=True))
+
+        # A refetch of older logs does not move the checkpoint back
+        FetchCheckpoint.advance(source, client, datetime(2010, 8, 31))
+        self.assertEqual(date(2010, 9, 30), FetchCheckpoint.objects.get(
+            source=source, client=client).fetched_to)
+
+        job, created = UpdateJob.enqueue(self.clients[0],
+                                         to_date=date(2010, 10, 5))
+        self.assertEqual((date(2010, 9, 23), date(2010, 10, 5)),
+                         (job.from_date, job.to_date))
+
+
+class UpdateJobTest(FetchTestCase):
+
+    def test_enqueue(self):
+        job, created = UpdateJob.enqueue(self.clients[0], date(2010, 9, 1),
+                                         date(2010, 9, 30))
+        self.assertTrue(created)
+        # Already queued
+        self.assertEqual((job, False),
+                         UpdateJob.enqueue(self.clients[0], date(2010, 9, 10),
+                                           date(2010, 9, 20)))
+        self.assertEqual(2, UpdateJob.enqueue_all(date(2010, 9, 1),
+                                                  date(2010, 9, 30)))
+
+    def test_leases(self):
+        UpdateJob.enqueue(self.clients[0], date(2010, 9, 1),
+                          date(2010, 9, 30))
+        UpdateJob.enqueue(self.clients[0], date(2010, 8, 1),
+                          date(2010, 8, 31))
+        job = UpdateJob.claim_next('worker1', 60)
+        self.assertEqual((UpdateJob.FETCHING, 'worker1'),
+                         (job.status, job.owner))
+        # The logs of the client are being updated by worker1
+        self.assertEqual(None, UpdateJob.claim_next('worker2', 60))
+
+        # worker1 crashed
+        FetchLease.objects.update(expires=datetime.now() -
+                                  timedelta(seconds=1))
+        job2 = UpdateJob.claim_next('worker2', 60)
+        self.assertEqual(job.pk, job2.pk)
+        self.assertEqual('worker2', job2.owner)
+
+    def test_run_job(self):
+        job, created = UpdateJob.enqueue(self.clients[0], date(2010, 9, 1),
+                                         date(2010, 9, 30))
+        job = UpdateJob.claim_next('worker1', 60)
+        run_job(job, 'worker1', adapter=StreamingAdapter(days=[1, 2]))
+        job = UpdateJob.objects.get(pk=job.pk)
+        self.assertEqual((UpdateJob.DONE, 2, 0),
+                         (job.status, job.added, job.removed))
+        self.assertTrue(job.finished >= job.started)
+        self.assertFalse(FetchLease.is_held(self.source.id,
+                                            self.clients[0].id, 'worker1'))
+
+        job, created = UpdateJob.enqueue(self.clients[0])
+        job = UpdateJob.claim_next('worker1', 60)
+        run_job(job, 'worker1', adapter=FakeAdapter(error=IOError('down')))
+        job = UpdateJob.objects.get(pk=job.pk)
+        self.assertEqual(UpdateJob.FAILED, job.status)
+        self.assertTrue('down' in job.error)
+
+    def test_expired_lease(self):
+        job, created = UpdateJob.enqueue(self.clients[0], date(2010, 9, 1),
+                                         date(2010, 9, 30))
+        job = UpdateJob.claim_next('worker1', 60)
+        adapter = ExpiringAdapter(days=[1, 2])
+        run_job(job, 'worker1', adapter=adapter)
+
+        # worker2 took the job while worker1 was fetching: worker1 neither
+        # imports the logs nor overwrites the job or the lease of worker2
+        self.assertEqual(job.pk, adapter.taken.pk)
+        job = UpdateJob.objects.get(pk=job.pk)
+        self.assertEqual((UpdateJob.FETCHING, 'worker2', ''),
+                         (job.status, job.owner, job.error))
+        self.assertEqual(0, TimeLog.objects.count())
+        self.assertTrue(FetchLease.is_held(self.source.id,
+                                           self.clients[0].id, 'worker2'))
+
+        # The update of a stale copy of the job is lost
+        job.owner = 'worker1'
+        self.assertFalse(job.progress(UpdateJob.FAILED, error='late'))
+        self.assertEqual((UpdateJob.FETCHING, ''), (job.status, job.error))
+        self.assertEqual(UpdateJob.FETCHING,
+                         UpdateJob.objects.get(pk=job.pk).status)
+
+    def test_heartbeat(self):
+        renewals = []
+
+        def renew():
+            renewals.append(True)
+            return len(renewals) < 3
+
+        heartbeat = LeaseHeartbeat(renew, interval=0.01)
+        heartbeat.start()
+        self.assertTrue(heartbeat.lost.wait(5))
+        heartbeat.stop()
+        self.assertEqual(3, len(renewals))
+
+        heartbeat = LeaseHeartbeat(renew, interval=60)
+        heartbeat.start()
+        heartbeat.stop()
+        self.assertFalse(heartbeat.lost.is_set())
+        self.assertEqual(3, len(renewals))
+
+    def test_eff_update_db(self):
+        admin = AdminFactory(username='admin')
+        test_client = TestClient()
+        test_client.login(username=admin.username, password=admin.username)
+
+        response = test_client.get(reverse('eff_update_db'))
+        data = simplejson.loads(response.content)
+        self.assertEqual('ok', data['status'])
+        self.assertEqual(3, len(data['jobs']))
+        self.assertEqual(['pending'] * 3,
+                         [job['status'] for job in data['jobs']])
+
+        response = test_client.get(reverse('eff_update_db'))
+        self.assertEqual('wait', simplejson.loads(response.content)['status'])
+        self.assertEqual(3, UpdateJob.objects.count())
+
+
+class DotProjectStandIn(DotProject):
+    """ DotProject reading from a SQLite data base with its schema. """
+    PARAM = '?'
+    path = None
+    connections = 0
+    queries = 0
+
+    @classmethod
+    def _driver(cls):
+        return sqlite3
+
+    @classmethod
+    def _connect(cls):
+        cls.connections += 1
+        return sqlite3.connect(cls.path, check_same_thread=False,
+                               detect_types=sqlite3.PARSE_DECLTYPES)
+
+    @classmethod
+    def _cursor(cls, connection):
+        return connection.cursor()
+
+    @classmethod
+    def _execute(cls, sql, params):
+        cls.queries += 1
+        return super(DotProjectStandIn, cls)._execute(sql, params)
+
+    @classmethod
+    def create(cls, path, companies):
+        """
+        Creates the data base, with a project of each company and the logs
+        of a user in them, given as (company, date, hours).
+        """
+        cls.path, cls._connection = path, None
+        cls.connections = cls.queries = 0
+        db = sqlite3.connect(path)
+        db.executescript("""
+            CREATE TABLE companies (company_id integer primary key,
+                                    company_name text);
+            CREATE TABLE projects (project_id integer primary key,
+                                   project_short_name text,
+                                   project_company integer);
+            CREATE TABLE tasks (task_id integer primary key,
+                                task_project integer);
+            CREATE TABLE users (user_id integer primary key,
+                                user_username text);
+            CREATE TABLE task_log (task_log_id integer primary key,
+                                   task_log_task integer,
+                                   task_log_creator integer,
+                                   task_log_date timestamp,
+                                   task_log_hours real,
+                                   task_log_name text,
+                                   task_log_description text);
+            INSERT INTO users VALUES (1, 'login0');
+        """)
+        for i, (company, logs) in enumerate(companies.items()):
+            db.execute('INSERT INTO companies VALUES (?, ?)', (i, company))
+            db.execute('INSERT INTO projects VALUES (?, ?, ?)',
+                       (i, 'proj1', i))
+            db.execute('INSERT INTO tasks VALUES (?, ?)', (i, i))
+            for log_date, hours in logs:
+                db.execute('INSERT INTO task_log (task_log_task, '
+                           'task_log_creator, task_log_date, task_log_hours, '
+                           'task_log_name, task_log_description) '
+                           'VALUES (?, 1, ?, ?, ?, ?)',
+                           (i, log_date, hours, 'task', 'desc'))
+        db.commit()
+        db.close()
+
+
+class BrokenConnection(object):
+    """ Connection lost by the server. """
+
+    def cursor(self):
+        return self
+
+    def execute(self, sql, params):
+        raise sqlite3.OperationalError('server has gone away')
+
+    def close(self):
+        pass
+
+
+class DotProjectTest(FetchTestCase):
+
+    def setUp(self):
+        super(DotProjectTest, self).setUp()
+        for i, client in enumerate(self.clients):
+            client.external_id = 'company%d' % i
+            client.save()
+        path = os.path.join(fetch_all.settings.FETCH_EXTERNALS_CSV_DIR,
+                            'dotproject.db')
+        DotProjectStandIn.create(path, {
+            self.clients[0].external_id: [(datetime(2010, 9, 5), 2.5),
+                                          (datetime(2010, 10, 5), 1)],
+            self.clients[1].external_id: [(datetime(2010, 9, 30, 15), 4)],
+            self.clients[2].external_id: []})
+
+    def tearDown(self):
+        DotProjectStandIn._connection.close()
+        super(DotProjectTest, self).tearDown()
+
+    def test_one_query_per_source(self):
+        jobs = self._jobs([DotProjectStandIn] * 3)
+        run_jobs(jobs)
+        self.assertEqual(['done', 'done', 'empty'],
+                         [job.status for job in jobs])
+        self.assertEqual((1, 1), (DotProjectStandIn.connections,
+                                  DotProjectStandIn.queries))
+        self.assertEqual([(date(2010, 9, 5), Decimal('2.5')),
+                          (date(2010, 9, 30), Decimal('4'))],
+                         list(TimeLog.objects.order_by('date').values_list(
+                             'date', 'hours_booked')))
+
+    def test_reconnect(self):
+        DotProjectStandIn.BATCH_SIZE, batch_size = 1, \
+            DotProjectStandIn.BATCH_SIZE
+        try:
+            from_date, to_date, logs = DotProjectStandIn.fetch_logs(
+                self.source, self.clients[0], 'Eff Fetcher',
+                datetime(2010, 9, 1), datetime(2010, 10, 31))
+            self.assertEqual(2, len(list(logs)))
+
+            DotProjectStandIn._connection = BrokenConnection()
+            from_date, to_date, logs = DotProjectStandIn.fetch_logs(
+                self.source, self.clients[1], 'Eff Fetcher',
+                datetime(2010, 9, 1), datetime(2010, 9, 30))
+            self.assertEqual([(datetime(2010, 9, 30, 15), 'proj1', 'login0',
+                               4, 'task', 'desc')], list(logs))
+            self.assertEqual(2, DotProjectStandIn.connections)
+        finally:
+            DotProjectStandIn.BATCH_SIZE = batch_size
+
+    def test_streaming(self):
+        DotProjectStandIn.BATCH_SIZE, batch_size = 1, \
+            DotProjectStandIn.BATCH_SIZE
+        try:
+            names = [client.external_id for client in self.clients]
+            logs = DotProjectStandIn.get_logs({
+                names[0]: (datetime(2010, 9, 1), datetime(2010, 10, 31)),
+                names[1]: (datetime(2010, 9, 1), datetime(2010, 9, 29)),
+                names[2]: (datetime(2010, 9, 1), datetime(2010, 9, 30))})
+            self.assertEqual(names, list(logs))
+            # The logs are read while the iterators are consumed
+            self.assertTrue(DotProjectStandIn._lock.locked())
+            # Out of their order too, with the range of each company
+            self.assertEqual([], list(logs[names[1]]))
+            self.assertEqual([datetime(2010, 9, 5), datetime(2010, 10, 5)],
+                             [log[0] for log in logs[names[0]]])
+            self.assertEqual([], list(logs[names[2]]))
+            self.assertFalse(DotProjectStandIn._lock.locked())
+            self.assertEqual(1, DotProjectStandIn.queries)
+        finally:
+            DotProjectStandIn.BATCH_SIZE = batch_size
+
+    def test_closed_unread(self):
+        names = [client.external_id for client in self.clients]
+        ranges = dict((name, (datetime(2010, 9, 1), datetime(2010, 10, 31)))
+                      for name in names)
+        for logs in DotProjectStandIn.get_logs(ranges).values():
+            logs.close()
+        self.assertFalse(DotProjectStandIn._lock.locked())
+        logs = DotProjectStandIn.get_logs(ranges)
+        self.assertEqual(2, len(list(logs[names[0]])))
+        self.assertEqual(1, DotProjectStandIn.connections)
+        # Some read, the rest closed
+        self.assertTrue(DotProjectStandIn._lock.locked())
+        for company_logs in logs.values():
+            company_logs.close()
+        self.assertFalse(DotProjectStandIn._lock.locked())
+
+    def test_lost_lease(self):
+        job, created = UpdateJob.enqueue(self.clients[0], date(2010, 9, 1),
+                                         date(2010, 9, 30))
+        job = UpdateJob.claim_next('worker1', 60)
+        FetchLease.objects.update(expires=datetime.now() -
+                                  timedelta(seconds=1))
+        FetchLease.acquire(self.source.id, self.clients[0].id, 'worker2', 60)
+        # The fetched logs are not read, but the connection is released
+        run_job(job, 'worker1', adapter=DotProjectStandIn)
+        self.assertFalse(DotProjectStandIn._lock.locked())
+        self.assertEqual(0, TimeLog.objects.count())
+
+    def test_concurrent_fetches(self):
+        first = DotProjectStandIn.fetch_logs(
+            self.source, self.clients[0], 'Eff Fetcher',
+            datetime(2010, 9, 1), datetime(2010, 10, 31))[2]
+        # While the shared connection streams the first logs, the second
+        # fetch opens its own
+        second = DotProjectStandIn.fetch_logs(
+            self.source, self.clients[1], 'Eff Fetcher',
+            datetime(2010, 9, 1), datetime(2010, 9, 30))[2]
+        self.assertEqual(1, len(list(second)))
+        self.assertEqual(2, len(list(first)))
+        self.assertEqual(2, DotProjectStandIn.connections)
+        self.assertFalse(DotProjectStandIn._lock.locked())
+
+
+class JiraStandIn(ThreadingMixIn, HTTPServer):
+    """
+    Local stand-in for the Jira export: GET returns the form, POST the csv
+    with the logs between startdate and enddate (both included), after
+    delay seconds. One log is booked each day at midnight.
+    """
+    daemon_threads = True
+    form = ('<html><body><form method="post" action="/export">'
+            '<select name="startdate">%(options)s</select>'
+            '<select name="enddate">%(options)s</select>'
+            '<input type="submit" value="Export"/></form></body></html>')
+
+    def __init__(self, delay=0):
+        HTTPServer.__init__(self, ('127.0.0.1', 0), JiraStandInHandler)
+        self.delay = delay
+        self.lock = Lock()
+        self.running = 0
+        self.max_running = 0
+        self.requests = []
+        months = [datetime(2010, 1, 1) + relativedelta(months=i)
+                  for i in range(24)]
+        self.options = ''.join(['<option value="%s">%s</option>' % (
+            m.strftime('%Y%m%d%H%M%S'), m.strftime('%Y-%m')) for m in months])
+        self.thread = Thread(target=self.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:%d/' % self.server_port
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+class JiraStandInHandler(BaseHTTPRequestHandler):
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html')
+        self.end_headers()
+        self.wfile.write(self.server.form % {'options': self.server.options})
+
+    def do_POST(self):
+        server = self.server
+        with server.lock:
+            server.running += 1
+            server.max_running = max(server.max_running, server.running)
+        try:
+            length = int(self.headers['Content-Length'])
+            data = cgi.parse_qs(self.rfile.read(length))
+            start, end = [datetime.strptime(data[name][0], '%Y%m%d%H%M%S')
+                          for name in ('startdate', 'enddate')]
+            server.requests.append((start, end))
+            time.sleep(server.delay)
+
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/csv')
+            self.end_headers()
+            writer = csv.writer(self.wfile)
+            writer.writerow(Jira.csv_header)
+            day = start
+            while day <= end:
+                line = dict.fromkeys(Jira.csv_header, '')
+                line.update(timetrack_id=day.strftime('%Y%m%d'),
+                            timetrack_vtime=str(day),
+                            timetrack_volume='8',
+                            timetrack_description='d\xe9sc',
+                            person_loginname='login0',
+                            project_name='proj1 Project One',
+                            project_types='task')
+                writer.writerow([line[name] for name in Jira.csv_header])
+                day += timedelta(days=1)
+        finally:
+            with server.lock:
+                server.running -= 1
+
+
+class JiraTest(TestCase):
+
+    def setUp(self):
+        self.server = JiraStandIn(delay=0.2)
+
+    def tearDown(self):
+        self.server.stop()
+
+    def _fetch(self, from_date, to_date, **kwargs):
+        jira = Jira(self.server.url, 'user', 'password', from_date, to_date,
+                    **kwargs)
+        jira.fetch_data()
+        return list(jira._process_data())
+
+    def test_windows(self):
+        rows = self._fetch(datetime(2010, 9, 14), datetime(2010, 11, 2))
+        self.assertEqual([(datetime(2010, 9, 1), datetime(2010, 10, 1)),
+                          (datetime(2010, 10, 1), datetime(2010, 11, 1)),
+                          (datetime(2010, 11, 1), datetime(2010, 12, 1))],
+                         sorted(self.server.requests))
+        self.assertEqual(3, self.server.max_running)
+
+        # Only the logs in the range, each once although the edges of the
+        # windows are returned twice
+        days = [row[0] for row in rows]
+        self.assertEqual(50, len(days))
+        self.assertEqual(50, len(set(days)))
+        self.assertEqual((date(2010, 9, 14), date(2010, 11, 2)),
+                         (min(days), max(days)))
+        self.assertEqual((date(2010, 9, 14), 'proj1', 'login0', '8', 'task',
+                          'd\xc3\xa9sc'), rows[0])
+
+    def test_window_size_and_workers(self):
+        started = time.time()
+        rows = self._fetch(datetime(2010, 9, 1), datetime(2010, 12, 31),
+                           window_months=2, workers=1)
+        elapsed = time.time() - started
+        self.assertEqual(2, len(self.server.requests))
+        self.assertEqual(1, self.server.max_running)
+        self.assertEqual(122, len(rows))
+        self.assertTrue(elapsed >= 0.4)
+
+
+class TutosStandIn(HTTPServer):
+    """
+    Local stand-in for Tutos: a login form, then the form of the team hours
+    offering the months from March to December 2010, the last one up to
+    the 15th. The csv returned has the logs between startdate and enddate
+    (both included), one each day at midnight.
+    """
+    login_form = ('<html><body><form method="post" '
+                  'action="/tutos/php/bookinginserter/login.php">'
+                  '<input type="text" name="username"/>'
+                  '<input type="password" name="password"/>'
+                  '<input type="submit" value="Login"/></form></body></html>')
+    menu = ('<html><body><a href="showteamhours.php">Team hours</a>'
+            '</body></html>')
+    form = ('<html><body><form method="post" '
+            'action="/tutos/php/bookinginserter/showteamhours.php">'
+            '<select name="startdate">%s</select>'
+            '<select name="enddate">%s</select>'
+            '<input type="submit" value="Show"/></form></body></html>')
+    csv_header = ('timetrack_vtime', 'project_name', 'person_loginname',
+                  'timetrack_volume', 'project_types',
+                  'timetrack_description')
+
+    def __init__(self):
+        HTTPServer.__init__(self, ('127.0.0.1', 0), TutosStandInHandler)
+        self.requests = []
+        months = [datetime(2010, 3, 1) + relativedelta(months=i)
+                  for i in range(10)]
+        ends = months[1:] + [datetime(2010, 12, 15)]
+        self.options = tuple(
+            ''.join(['<option value="%s">%s</option>' % (
+                d.strftime('%Y%m%d%H%M%S'), d.strftime('%Y-%m-%d'))
+                for d in dates])
+            for dates in (months, ends))
+        self.thread = Thread(target=self.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:%d/' % self.server_port
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+class TutosStandInHandler(BaseHTTPRequestHandler):
+
+    def log_message(self, *args):
+        pass
+
+    def _send(self, content_type, contents):
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(contents)))
+        self.end_headers()
+        self.wfile.write(contents)
+
+    def do_GET(self):
+        server = self.server
+        if self.path.endswith('showteamhours.php'):
+            self._send('text/html', server.form % server.options)
+        else:
+            self._send('text/html', server.login_form)
+
+    def do_POST(self):
+        server = self.server
+        length = int(self.headers['Content-Length'])
+        data = cgi.parse_qs(self.rfile.read(length))
+        if self.path.endswith('login.php'):
+            self._send('text/html', server.menu)
+            return
+        start, end = [datetime.strptime(data[name][0], '%Y%m%d%H%M%S')
+                      for name in ('startdate', 'enddate')]
+        server.requests.append((start, end))
+        lines = StringIO()
+        writer = csv.writer(lines)
+        writer.writerow(server.csv_header)
+        day = start
+        while day <= end:
+            writer.writerow((str(day), 'proj1 Project One', 'login0', '8',
+                             'task', 'd\xe9sc'))
+            day += timedelta(days=1)
+        self._send('text/csv', lines.getvalue())
+
+
+class TutosTest(TestCase):
+
+    def setUp(self):
+        self.server = TutosStandIn()
+
+    def tearDown(self):
+        self.server.stop()
+
+    def _fetch(self, from_date=None, to_date=None):
+        tutos = Tutos(self.server.url, 'user', 'password', from_date=from_date,
+                      to_date=to_date)
+        tutos.fetch_data()
+        return list(tutos._process_data())
+
+    def _assertDays(self, first, last, rows):
+        # Each day once, although the edges of the chunks are returned twice
+        days = [row[0] for row in rows]
+        self.assertEqual((last - first).days + 1, len(days))
+        self.assertEqual(len(days), len(set(days)))
+        self.assertEqual((first, last), (min(days), max(days)))
+
+    def test_months(self):
+        rows = self._fetch(datetime(2010, 5, 20), datetime(2010, 7, 10))
+        self.assertEqual([(datetime(2010, 5, 1), datetime(2010, 6, 1)),
+                          (datetime(2010, 6, 1), datetime(2010, 7, 1)),
+                          (datetime(2010, 7, 1), datetime(2010, 8, 1))],
+                         self.server.requests)
+        self._assertDays(date(2010, 5, 20), date(2010, 7, 10), rows)
+        self.assertEqual((date(2010, 5, 20), 'proj1', 'login0', '8', 'task',
+                          'd\xc3\xa9sc'), rows[0])
+
+    def test_months_outside_of_the_options(self):
+        # The months before March are skipped, December is fetched up to
+        # the 15th, and the following January is skipped
+        rows = self._fetch(datetime(2010, 1, 20), datetime(2011, 1, 10))
+        self.assertEqual(10, len(self.server.requests))
+        self.assertEqual((datetime(2010, 3, 1), datetime(2010, 4, 1)),
+                         self.server.requests[0])
+        self.assertEqual((datetime(2010, 12, 1), datetime(2010, 12, 15)),
+                         self.server.requests[-1])
+        self._assertDays(date(2010, 3, 1), date(2010, 12, 15), rows)
+
+    def test_whole_history(self):
+        rows = self._fetch()
+        self.assertEqual([(datetime(2010, 3, 1), datetime(2010, 12, 15))],
+                         self.server.requests)
+        self._assertDays(date(2010, 3, 1), date(2010, 12, 15), rows)
+
+
+def suite():
+    suite = TestSuite()
+    suite.addTest(makeSuite(FetchJobsTest))
+    suite.addTest(makeSuite(UpdateJobTest))
+    suite.addTest(makeSuite(DotProjectTest))
+    suite.addTest(makeSuite(JiraTest))
+    suite.addTest(makeSuite(TutosTest))
+    return suite
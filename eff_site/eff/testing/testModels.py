@@ -23,18 +23,27 @@ from pyquery import PyQuery
 from django.contrib.auth.models import User, Permission, Group
 from django.core.exceptions import ValidationError
 from django.core import mail
+from django.db.models import F
 
 from eff.models import UserProfile, AvgHours, Project, TimeLog, ExternalSource
 from eff.models import Wage, ClientHandles, Handle
-from eff.models import Client as EffClient, Dump
+from eff.models import Client as EffClient, Dump, DailyHours, ExternalId
+from eff.models import Calendar, Holiday, DataVersion
+from eff._models.timeline import Timeline, weekdays_between
 from eff.views import Data
+from eff.utils import load_dump
 from factories import (ClientFactory, BillingFactory, CreditNoteFactory,
-                       PaymentFactory, ExternalSourceFactory)
+                       PaymentFactory, ExternalSourceFactory, ProjectFactory,
+                       TimeLogFactory, DumpFactory)
 
 from eff_site.eff.forms import UserAdminForm
 
 from unittest import TestSuite, makeSuite
 from datetime import date, timedelta, datetime
+from importlib import import_module
+from decimal import Decimal
+from StringIO import StringIO
+import random
 
 
 class HelperTest(TestCase):
@@ -149,6 +158,99 @@ class QueriesTest(HelperTest):
                           date(2007, 01, 01), 6)
 
 
+class TimelineTest(HelperTest):
+
+    def _walk(self, from_date, to_date):
+        # Day by day computation of the loggable hours
+        num, a_date = 0, from_date
+        while a_date <= to_date:
+            hours = self.usr.avghours_set.filter(date__lte=a_date).order_by(
+                '-date').values_list('hours', flat=True)[:1]
+            if a_date.isoweekday() <= 5 and hours:
+                num += hours[0]
+            a_date += timedelta(days=1)
+        return num
+
+    def test_weekdays_between(self):
+        a_date = date(2011, 1, 1)
+        for i in range(30):
+            for j in range(i, 30):
+                from_date = a_date + timedelta(days=i)
+                to_date = a_date + timedelta(days=j)
+                days = [from_date + timedelta(days=k)
+                        for k in range((to_date - from_date).days + 1)]
+                self.assertEqual(weekdays_between(from_date, to_date),
+                    len([d for d in days if d.isoweekday() <= 5]))
+        self.assertEqual(weekdays_between(date(2011, 1, 2), date(2011, 1, 1)),
+                         0)
+
+    def test_value_at(self):
+        timeline = self.usr.get_profile().avg_hours_timeline()
+        self.assertEqual(timeline.value_at(date(2008, 3, 3)), 0)
+        self.assertEqual(timeline.value_at(date(2008, 3, 4)), 5)
+        self.assertEqual(timeline.value_at(date(2008, 3, 19)), 0)
+        self.assertEqual(timeline.value_at(date(2008, 4, 28)), 5)
+        self.assertEqual(timeline.value_at(date(2009, 1, 1)), 6)
+
+    def test_weekday_sum(self):
+        timeline = self.usr.get_profile().avg_hours_timeline()
+        rnd = random.Random(4)
+        for i in range(20):
+            from_date = date(2008, 2, 20) + timedelta(days=rnd.randint(0, 80))
+            to_date = from_date + timedelta(days=rnd.randint(-2, 40))
+            self.assertEqual(timeline.weekday_sum(from_date, to_date),
+                             self._walk(from_date, to_date))
+
+    def test_queries(self):
+        profile = self.usr.get_profile()
+        self.assertNumQueries(1, profile.is_active, date(2008, 1, 1),
+                              date(2008, 12, 31))
+        self.assertNumQueries(0, profile.num_loggable_hours, date(2008, 1, 1),
+                              date(2008, 12, 31))
+        self.assertNumQueries(0, profile.get_avg_hours_for, date(2008, 4, 1))
+
+    def test_invalidation(self):
+        profile = self.usr.get_profile()
+        self.assertEqual(profile.get_avg_hours_for(date(2008, 5, 5)), 6)
+        profile.add_avg_hours(date(2008, 5, 5), 8)
+        self.assertEqual(profile.get_avg_hours_for(date(2008, 5, 5)), 8)
+
+    def test_calendar(self):
+        profile = self.usr.get_profile()
+        calendar = Calendar.objects.create(name='Argentina')
+        # Monday, Saturday and Thursday
+        for a_date in (date(2008, 3, 24), date(2008, 3, 29),
+                       date(2008, 4, 3)):
+            Holiday.objects.create(calendar=calendar, date=a_date)
+        self.assertEqual(calendar.holiday_dates(),
+                         [date(2008, 3, 24), date(2008, 4, 3)])
+        self.assertEqual(calendar.working_days(date(2008, 3, 24),
+                                               date(2008, 4, 2)), 7)
+        self.assertNumQueries(0, calendar.working_days, date(2008, 3, 1),
+                              date(2008, 4, 30))
+        Holiday.objects.filter(date=date(2008, 4, 3)).delete()
+        self.assertEqual(calendar.working_days(date(2008, 3, 1),
+                                               date(2008, 4, 30)), 42)
+
+        # Changed by another process, which bumped the version
+        self.assertEqual(Calendar.objects.get(id=calendar.id).holiday_dates(),
+                         [date(2008, 3, 24)])
+        Holiday.objects.filter(date=date(2008, 3, 24)).update(
+            date=date(2008, 3, 25))
+        self.assertEqual(Calendar.objects.get(id=calendar.id).holiday_dates(),
+                         [date(2008, 3, 24)])
+        DataVersion.objects.filter(scope=DataVersion.CALENDARS).update(
+            version=F('version') + 1)
+        self.assertEqual(Calendar.objects.get(id=calendar.id).holiday_dates(),
+                         [date(2008, 3, 25)])
+
+        # 4 hours a day until 30/03 and 5 after, without the 24/03 holiday
+        profile.calendar = calendar
+        profile.save()
+        self.assertEqual(profile.num_loggable_hours(date(2008, 3, 20),
+                                                    date(2008, 4, 1)), 34)
+
+
 class PageTest(HelperTest):
 
     def setUp(self):
@@ -955,9 +1057,117 @@ class CommercialDocumentsTest(TestCase):
             self.assert_(hasattr(self.cnote, attr))
 
 
+class DailyHoursTest(TestCase):
+
+    def setUp(self):
+        self.source = ExternalSourceFactory(name='DotprojectMachinalis')
+        self.client = ClientFactory(external_source=self.source)
+        self.project = ProjectFactory(client=self.client, billable=True,
+                                      external_id='proj1',
+                                      start_date=date(2010, 1, 1))
+        self.other_project = ProjectFactory(client=self.client, billable=False,
+                                            external_id='proj2',
+                                            start_date=date(2010, 1, 1))
+        self.usr = User.objects.create_user(username='test1',
+                                            email='test1@test.com',
+                                            password='test1')
+        ExternalId.objects.create(login='test1', source=self.source,
+                                  userprofile=self.usr.get_profile())
+        self.dump = DumpFactory(source=self.source)
+        self.day = date(2010, 9, 6)
+
+    def _log(self, **kwargs):
+        defaults = dict(date=self.day, project=self.project, user=self.usr,
+                        hours_booked=Decimal('2.000'), dump=self.dump)
+        defaults.update(kwargs)
+        return TimeLogFactory(**defaults)
+
+    def _rollup(self):
+        return sorted(DailyHours.objects.values_list(
+            'user', 'project', 'date', 'hours', 'billable'))
+
+    def _expected(self):
+        # The rollup as computed straight from TimeLog
+        expected = {}
+        for log in TimeLog.objects.select_related('project'):
+            key = (log.user_id, log.project_id, log.date)
+            expected[key] = expected.get(key, 0) + log.hours_booked
+        return sorted(k + (v, Project.objects.get(id=k[1]).billable)
+                      for k, v in expected.items())
+
+    def test_save_and_delete(self):
+        log = self._log()
+        self._log(hours_booked=Decimal('1.500'))
+        self.assertEqual(self._rollup(), [(self.usr.id, self.project.id,
+            self.day, Decimal('3.500'), True)])
+
+        # Moving a log fixes both the old and the new rows
+        log.date = self.day + timedelta(days=1)
+        log.project = self.other_project
+        log.save()
+        self.assertEqual(self._rollup(), self._expected())
+        self.assertEqual(DailyHours.objects.count(), 2)
+
+        log.delete()
+        self.assertEqual(self._rollup(), [(self.usr.id, self.project.id,
+            self.day, Decimal('1.500'), True)])
+
+    def test_project_billable(self):
+        self._log()
+        self.project.billable = False
+        self.project.save()
+        self.assertEqual(self._rollup(), self._expected())
+
+    def test_load_dump(self):
+        # This one is replaced by the import, the other one is kept
+        self._log(date=date(2010, 9, 1))
+        self._log(date=date(2010, 8, 31))
+        csv = StringIO("# ExternalSource: %s\r\n"
+                       "# Client: %s\r\n"
+                       "# Author: Eff Fetcher\r\n"
+                       "# From date: 2010-09-01 00:00:00\r\n"
+                       "# To date: 2010-09-10 00:00:00\r\n"
+                       '"2010-09-02","%s","test1","4.0","task","desc"\r\n'
+                       '"2010-09-02","%s","test1","1.5","task","desc"\r\n'
+                       '"2010-09-12","%s","test1","3.0","task","desc"\r\n' % (
+                           self.source.name, self.client.name,
+                           self.project.external_id,
+                           self.project.external_id,
+                           self.other_project.external_id))
+        load_dump(csv, is_api=True)
+        self.assertEqual(TimeLog.objects.count(), 4)
+        self.assertEqual(self._rollup(), self._expected())
+        self.assertEqual(DailyHours.objects.get(date=date(2010, 9, 2)).hours,
+                         Decimal('5.500'))
+
+    def test_rebuild(self):
+        for i in range(5):
+            self._log(date=self.day + timedelta(days=i % 3))
+        self._log(project=self.other_project)
+        expected = self._rollup()
+        DailyHours.objects.all().delete()
+        DailyHours.rebuild(self.day, self.day + timedelta(days=1))
+        self.assertEqual(len(self._rollup()), 3)
+        DailyHours.rebuild()
+        self.assertEqual(self._rollup(), expected)
+        self.assertEqual(self._rollup(), self._expected())
+
+    def test_backfill_migration(self):
+        # The logs imported before the rollup existed
+        for i in range(5):
+            self._log(date=self.day + timedelta(days=i % 3))
+        self._log(project=self.other_project)
+        DailyHours.objects.all().delete()
+        backfill = import_module('eff.migrations.0021_backfill_daily_hours')
+        backfill.Migration().forwards(None)
+        self.assertEqual(len(self._rollup()), 4)
+        self.assertEqual(self._rollup(), self._expected())
+
+
 def suite():
     suite = TestSuite()
     suite.addTest(makeSuite(QueriesTest))
+    suite.addTest(makeSuite(TimelineTest))
     suite.addTest(makeSuite(PageTest))
     suite.addTest(makeSuite(UserProfileCreationTest))
     suite.addTest(makeSuite(UserCreationTest))
@@ -967,4 +1177,5 @@ def suite():
     suite.addTest(makeSuite(TimeLogsAttributesTest))
     suite.addTest(makeSuite(UserProfileTest))
     suite.addTest(makeSuite(CommercialDocumentsTest))
+    suite.addTest(makeSuite(DailyHoursTest))
     return suite
@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+# Copyright 2009 - 2011 Machinalis: http://www.machinalis.com/
+#
+# This file is part of Eff.
+#
+# Eff is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Eff is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Eff.  If not, see <http://www.gnu.org/licenses/>.
+
+from django.test import TransactionTestCase
+from django.db import connection
+from eff.models import TimeLog, ProjectAssoc, AvgHours
+from eff.utils import _delete_logs_sql
+from factories import (ExternalSourceFactory, ClientFactory, ProjectFactory,
+                       UserFactory)
+
+from unittest import TestSuite, makeSuite, skipUnless
+from datetime import date
+from importlib import import_module
+import re
+
+# The tests are run on the syncdb schema, without the indexes added by
+# this migration. Creating them commits (sqlite3 commits before DDL), so
+# the test data is flushed by TransactionTestCase instead of rolled back.
+indexes = import_module('eff.migrations.0020_add_timelog_indexes')
+
+
+@skipUnless(connection.vendor == 'sqlite', 'EXPLAIN QUERY PLAN is sqlite')
+class QueryPlansTest(TransactionTestCase):
+
+    def setUp(self):
+        self.source = ExternalSourceFactory(name='DotprojectMachinalis')
+        self.client = ClientFactory(name='Fake Client',
+                                    external_source=self.source)
+        self.project = ProjectFactory(name='Fake Project', client=self.client,
+                                      external_id='FP', start_date=date.today())
+        self.profile = UserFactory(username='user1').get_profile()
+        self.from_date, self.to_date = date(2012, 1, 1), date(2012, 12, 31)
+        indexes.Migration().forwards(None)
+        self.addCleanup(indexes.Migration().backwards, None)
+
+    def assertUsesIndex(self, column_names, sql, params):
+        """ Checks the plan of sql uses an index on exactly column_names. """
+        cursor = connection.cursor()
+        cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+        plan = '\n'.join(row[-1] for row in cursor.fetchall())
+        used = []
+        for name in re.findall(r'USING (?:COVERING )?INDEX (\S+)', plan):
+            cursor.execute('PRAGMA index_info(%s)' % name)
+            used.append([row[2] for row in cursor.fetchall()])
+        self.assertTrue(column_names in used, plan)
+
+    def assertQuerySetUsesIndex(self, column_names, qset):
+        sql, params = qset.query.get_compiler(using=qset.db).as_sql()
+        self.assertUsesIndex(column_names, sql, params)
+
+    def test_user_logs(self):
+        # TimeLog.report
+        self.assertQuerySetUsesIndex(['user_id', 'date'],
+            TimeLog.objects.filter(
+                user=self.profile.user_id, date__gte=self.from_date,
+                date__lte=self.to_date).order_by('date', 'id').values_list(
+                    'project__name', 'task_name', 'description',
+                    'hours_booked', 'date'))
+
+    def test_project_logs(self):
+        self.assertQuerySetUsesIndex(['project_id', 'date', 'dump_id'],
+            TimeLog.objects.filter(project=self.project,
+                                   date__gte=self.from_date,
+                                   date__lte=self.to_date))
+
+    def test_load_dump_delete(self):
+        sql, params = _delete_logs_sql(self.source, self.client,
+                                       self.from_date, self.to_date)
+        self.assertUsesIndex(['project_id', 'date', 'dump_id'], sql, params)
+
+    def test_member_periods(self):
+        self.assertQuerySetUsesIndex(['member_id', 'project_id', 'from_date'],
+            ProjectAssoc.objects.filter(member=self.profile,
+                                        project=self.project,
+                                        from_date__lte=self.to_date))
+
+    def test_avg_hours_timeline(self):
+        # Timeline.load, served by the unique index
+        self.assertQuerySetUsesIndex(['user_id', 'date'],
+            AvgHours.objects.filter(
+                user__in=[self.profile.user_id],
+                date__lte=self.to_date).order_by('user', 'date').values_list(
+                    'user', 'date', 'hours'))
+
+
+def suite():
+    suite = TestSuite()
+    suite.addTest(makeSuite(QueryPlansTest))
+    return suite
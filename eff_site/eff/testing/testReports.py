@@ -17,6 +17,8 @@
 # along with Eff.  If not, see <http://www.gnu.org/licenses/>.
 
 from django.contrib.auth.models import User
+from django.contrib.comments.models import Comment
+from django.conf import settings
 from django.db.models import signals
 from eff._models.user_profile import create_profile_for_user
 from django.test import TestCase
@@ -25,11 +27,208 @@ from django.core.urlresolvers import reverse
 from django.test.client import Client as TestClient
 from urllib import urlencode
 from decimal import Decimal
-from eff.models import TimeLog
+from eff.models import (TimeLog, ProjectAssoc, Calendar, Holiday, DataVersion,
+                        Client)
+from eff._models.report_cache import report_cache_stats
+from django.db.models import Q
 from factories import (UserProfileFactory, ProjectFactory, ClientFactory,
                        ProjectAssocFactory, ExternalSourceFactory, DumpFactory,
-                       TimeLogFactory, AdminFactory)
+                       TimeLogFactory, AdminFactory, AvgHoursFactory,
+                       CurrencyFactory, BillingFactory)
 from datetime import date, timedelta
+from StringIO import StringIO
+from eff import reports
+import csv
+import os
+import random
+import re
+import shutil
+import tempfile
+
+
+# Loop based implementations of the rate reports, kept as reference for the
+# differential tests of the rate resolution engine (TimeLog.hours_by_rate)
+
+
+def legacy_hours_grouped_by_project_with_rates(user, from_date, to_date):
+    project_rates = []
+    # Get the projects related to this user in this period
+    user_projects = TimeLog.user_projects(user, from_date, to_date)
+
+    for project in user_projects:
+        rates = {}
+        # Get the timelogs in this period
+        timelogs = project.timelog_set.filter(
+            Q(user__username=user.user.username),
+            Q(date__gte=from_date),
+            Q(date__lte=to_date)).order_by('date')
+
+        # Discard project associations out of the period
+        projassoc = ProjectAssoc.objects.filter(
+            Q(member__user__username=user.user.username),
+            Q(project=project),
+            ~Q(from_date__gt=to_date),
+            ~Q(to_date__lt=from_date)).order_by('from_date')
+
+        # Get the rates for each project.
+        periods = iter(projassoc.values('from_date', 'to_date',
+                                        'user_rate'))
+        try:
+            period = periods.next()
+        except StopIteration:
+            period = None
+
+        while period:
+            aux_period = None
+            # All timelogs before this period belong to a previous period
+            # or do not belong to any period, so they have rate = 0.
+            for t in timelogs:
+                if t.date < period['from_date']:
+                    rates[Decimal('0.00')] = rates.get(Decimal('0.00'),
+                                                       Decimal('0.00')) +\
+                                                       t.hours_booked
+                else:
+                    break
+            # Discard timelogs already processed
+            timelogs = timelogs.exclude(date__lt=period['from_date'])
+
+            # If to_date not available then set it to from_date - 1. If this
+            # period is the last one, then set it to today, to process all
+            # remaining logs.
+            if not period['to_date']:
+                try:
+                    aux_period = periods.next()
+                except StopIteration:
+                    period['to_date'] = date.today()
+                else:
+                    period['to_date'] = aux_period['from_date'] - \
+                                        timedelta(days=1)
+
+            # All timelogs inside this period have rate equal to the one
+            # set in the projassoc.
+            for t in timelogs:
+                if t.date <= period['to_date']:
+                    rates[Decimal(period['user_rate'])] = rates.get(
+                        Decimal(period['user_rate']), Decimal('0.00')) + \
+                        t.hours_booked
+                else:
+                    break
+
+            # Discard timelogs already processed
+            timelogs = timelogs.exclude(date__lte=period['to_date'])
+
+            # Set next period to process correctly
+            if aux_period:
+                period = aux_period
+            else:
+                try:
+                    period = periods.next()
+                except StopIteration:
+                    break
+
+        # All remaining timelogs have rate = 0
+        tl_hours = map(lambda log: log['hours_booked'],
+                       timelogs.values('hours_booked'))
+        if timelogs:
+            rates[Decimal('0.00')] = rates.get(Decimal('0.00'),
+                                               Decimal('0.00')) + \
+                                               sum(tl_hours)
+
+        for rate, hours in rates.items():
+            project_rates.append((project, '', hours, rate))
+
+    return project_rates
+
+
+def legacy_project_hours_grouped_by_rate(project, from_date, to_date):
+    users_rates = []
+    # Get the users related to this project
+    project_users = map(lambda member: member.user,
+                        project.members.all().distinct())
+
+    for user in project_users:
+        rates = {}
+        # Get the timelogs in this period
+        timelogs = project.timelog_set.filter(
+            Q(user=user),
+            Q(date__gte=from_date),
+            Q(date__lte=to_date)).order_by('date')
+
+        # Discard project associations out of the period
+        projassoc = ProjectAssoc.objects.filter(
+            Q(member__user=user),
+            Q(project=project),
+            ~Q(from_date__gt=to_date),
+            ~Q(to_date__lt=from_date)).order_by('from_date')
+
+        # Get the rates for each user.
+        periods = iter(projassoc.values('from_date', 'to_date',
+                                        'client_rate'))
+        try:
+            period = periods.next()
+        except StopIteration:
+            period = None
+
+        while period:
+            aux_period = None
+            # All timelogs before this period belong to a previous period
+            # or do not belong to any period, so they have rate = 0.
+            for t in timelogs:
+                if t.date < period['from_date']:
+                    rates[Decimal('0.00')] = rates.get(Decimal('0.00'),
+                                                       Decimal('0.00')) +\
+                                                       t.hours_booked
+                else:
+                    break
+            # Discard timelogs already processed
+            timelogs = timelogs.exclude(date__lt=period['from_date'])
+
+            # If to_date not available then set it to from_date - 1. If this
+            # period is the last one, then set it to today, to process all
+            # remaining logs.
+            if not period['to_date']:
+                try:
+                    aux_period = periods.next()
+                except StopIteration:
+                    period['to_date'] = date.today()
+                else:
+                    period['to_date'] = aux_period['from_date'] - \
+                                        timedelta(days=1)
+
+            # All timelogs inside this period have rate equal to the one set
+            # in the projassoc.
+            for t in timelogs:
+                if t.date <= period['to_date']:
+                    rates[Decimal(period['client_rate'])] = rates.get(
+                        Decimal(period['client_rate']), Decimal('0.00')) + \
+                        t.hours_booked
+                else:
+                    break
+            # Discard timelogs already processed
+            timelogs = timelogs.exclude(date__lte=period['to_date'])
+
+            # Set next period to process correctly
+            if aux_period:
+                period = aux_period
+            else:
+                try:
+                    period = periods.next()
+                except StopIteration:
+                    break
+
+        # All remaining timelogs have rate = 0
+        tl_hours = map(lambda log: log['hours_booked'],
+                       timelogs.values('hours_booked'))
+        if timelogs:
+            rates[Decimal('0.00')] = rates.get(Decimal('0.00'),
+                                               Decimal('0.00')) + \
+                                               sum(tl_hours)
+
+        for rate, hours in rates.items():
+            users_rates.append({'user__username': user.username,
+                                'rate': rate, 'hours_booked__sum': hours})
+
+    return users_rates
 
 
 class HelperTest(TestCase):
@@ -224,6 +423,29 @@ class UserReportTest(HelperTest):
             ]
         self.assertEqual(expected, list(report))
 
+    def test_report_rows(self):
+        from_date, to_date = date(2010, 9, 25), date(2010, 10, 5)
+        report = self.user1._report(from_date, to_date, None)
+        logs = TimeLog.objects.filter(user=self.user1.user,
+                                      date__gte=from_date,
+                                      date__lte=to_date).order_by('date', 'id')
+        self.assertEqual([(log.project.name, log.task_name, log.description,
+                           log.hours_booked, log.date, log.user.username,
+                           log.user.get_full_name())
+                          for log in logs], report)
+        self.assertEqual((report[0].project, report[0].date),
+                         (report[0][0], report[0][4]))
+
+        report = self.user1._report(from_date, to_date, 'Fake Project 10')
+        self.assertEqual(7, len(report))
+        self.assertEqual(set(['Fake Project 10']),
+                         set(row.project for row in report))
+
+        # A single query, whatever the number of logs
+        self.assertNumQueries(1, self.user1._report, from_date, to_date, None)
+        self.assertNumQueries(1, self.user1._report, date(2008, 1, 1),
+                              date(2012, 12, 31), None)
+
 
 class ClientReportTest(HelperTest):
 
@@ -317,6 +539,199 @@ class ClientReportTest(HelperTest):
                     }
         self.assertEqual(expected, report)
 
+    def test_client_report_query_count(self):
+        CurrencyFactory()
+        from_date, to_date = date(2010, 9, 1), date(2010, 10, 31)
+
+        def check():
+            self.assertNumQueries(2, self.client._report, from_date, to_date,
+                                  False, False)
+            self.assertNumQueries(3, self.client._report, from_date, to_date,
+                                  True, False)
+            self.assertNumQueries(6, self.client._report, from_date, to_date,
+                                  True, True)
+            # The users and the currency of the client
+            report = dict(x[0] for x in self.client._report(
+                from_date, to_date, False, True))
+            self.assertNumQueries(2, reports.format_report_data, report,
+                                  Client.objects.get(pk=self.client.pk),
+                                  from_date, to_date)
+            report = dict(x[0] for x in self.client._report(
+                from_date, to_date, True, False))
+            self.assertNumQueries(2, reports.format_report_data, report,
+                                  Client.objects.get(pk=self.client.pk),
+                                  from_date, to_date, True)
+
+        check()
+        # More projects, users and logs, same queries
+        for i in range(3):
+            project = ProjectFactory(name='Other Project %d' % i,
+                                     client=self.client,
+                                     external_id='OP%d' % i,
+                                     start_date=date.today())
+            users = [UserProfileFactory(user__username='user%d%d' % (i, j))
+                     for j in range(3)]
+            for profile in users:
+                ProjectAssocFactory(project=project, member=profile,
+                                    client_rate=Decimal('0.50'),
+                                    user_rate=Decimal('0.20'),
+                                    from_date=date(2010, 9, 1), to_date=None)
+            self.create_timelogs_for_users(
+                5, [(profile.user, 2.0) for profile in users],
+                date(2010, 9, 20), project)
+        check()
+        report = self.client._report(from_date, to_date, True, True)
+        self.assertEqual(5, len(report))
+        self.assertEqual(['Fake Project 10', 'Fake Project 42',
+                          'Other Project 0', 'Other Project 1',
+                          'Other Project 2'],
+                         sorted(x[0][0] for x in report))
+
+
+class RateResolutionTest(HelperTest):
+
+    def setUp(self):
+        super(RateResolutionTest, self).setUp()
+        rnd = random.Random(42)
+        start = date.today() - timedelta(days=400)
+        client = ClientFactory(name='Big Client', external_source=self.ext_src)
+        self.projects = [ProjectFactory(name='Big Project %s' % i,
+                                        client=client, external_id='BP%s' % i,
+                                        start_date=start)
+                         for i in xrange(3)]
+        self.profiles = [UserProfileFactory(user__username='member%s' % i)
+                         for i in xrange(4)]
+
+        for project in self.projects:
+            for profile in self.profiles:
+                # Some periods are open ended, some overlap and some have
+                # rate 0
+                from_dates = sorted(rnd.sample(xrange(0, 420, 7), 3))
+                for from_day in from_dates:
+                    to_date = rnd.choice([None, start + timedelta(
+                        days=from_day + rnd.randint(-10, 90))])
+                    ProjectAssocFactory(project=project, member=profile,
+                        client_rate=Decimal(rnd.choice(['0', '1.25', '3.5'])),
+                        user_rate=Decimal(rnd.choice(['0', '0.75', '2'])),
+                        from_date=start + timedelta(days=from_day),
+                        to_date=to_date)
+                # Logs up to some days after today
+                for n in xrange(60):
+                    TimeLogFactory(user=profile.user, project=project,
+                        date=start + timedelta(days=rnd.randint(-20, 420)),
+                        hours_booked=Decimal(rnd.choice(['1', '2.5', '0.25'])))
+        # Logs from someone who is not a project member
+        outsider = UserProfileFactory(user__username='outsider')
+        TimeLogFactory(user=outsider.user, project=self.projects[0],
+                       date=start + timedelta(days=10),
+                       hours_booked=Decimal('3'))
+        self.profiles.append(outsider)
+
+        self.ranges = [(start - timedelta(days=30), date.today() +
+                        timedelta(days=30)),
+                       (start + timedelta(days=100), start + timedelta(days=130)),
+                       (date(2008, 1, 1), date(2012, 5, 10)),
+                       (date(2010, 9, 29), date(2010, 10, 1))]
+
+    def test_user_rates_match_legacy_implementation(self):
+        for from_date, to_date in self.ranges:
+            for profile in self.profiles + [self.user1, self.user2]:
+                self.assertEqual(
+                    legacy_hours_grouped_by_project_with_rates(profile,
+                        from_date, to_date),
+                    TimeLog.hours_grouped_by_project_with_rates(profile,
+                        from_date, to_date))
+
+    def test_client_rates_match_legacy_implementation(self):
+        for from_date, to_date in self.ranges:
+            for project in self.projects + list(self.client.project_set.all()):
+                self.assertEqual(
+                    legacy_project_hours_grouped_by_rate(project, from_date,
+                                                         to_date),
+                    TimeLog.project_hours_grouped_by_rate(project, from_date,
+                                                          to_date))
+
+    def test_hours_by_rate_query_count(self):
+        timelogs = TimeLog.objects.filter(project__in=self.projects)
+        from_date, to_date = self.ranges[0]
+        self.assertNumQueries(2, TimeLog.hours_by_rate, timelogs, from_date,
+                              to_date, 'client_rate')
+
+    def test_hours_by_rate_keeps_all_hours(self):
+        from_date, to_date = self.ranges[0]
+        timelogs = TimeLog.objects.filter(project__in=self.projects,
+                                          date__gte=from_date,
+                                          date__lte=to_date)
+        resolved = TimeLog.hours_by_rate(timelogs, from_date, to_date,
+                                         'user_rate')
+        self.assertEqual(sum(log.hours_booked for log in timelogs),
+                         sum(hours for (p, u, rate, hours) in resolved))
+
+
+class PeriodStatsTest(HelperTest):
+
+    def setUp(self):
+        super(PeriodStatsTest, self).setUp()
+        AvgHoursFactory(user=self.user1.user, date=date(2010, 1, 1),
+                        hours=Decimal('8.000'))
+        AvgHoursFactory(user=self.user2.user, date=date(2010, 9, 20),
+                        hours=Decimal('0.000'))
+        AvgHoursFactory(user=self.user2.user, date=date(2010, 10, 6),
+                        hours=Decimal('4.000'))
+        # Hours in a non billable project
+        project = ProjectFactory(name='Internal', client=self.client,
+                                 external_id='INT', billable=False,
+                                 start_date=date.today())
+        self.create_timelogs_for_users(3, [(self.user2.user, 2.0)],
+                                       date(2010, 10, 4), project)
+        # Holidays on a Monday and on a Sunday
+        calendar = Calendar.objects.create(name='Argentina')
+        Holiday.objects.create(calendar=calendar, date=date(2010, 10, 11))
+        Holiday.objects.create(calendar=calendar, date=date(2010, 10, 17))
+        self.user1.calendar = calendar
+        self.user1.save()
+        self.users = [self.user1, self.user2]
+
+    def _check_stats(self, from_date, to_date):
+        stats = TimeLog.period_stats([u.user_id for u in self.users],
+                                     from_date, to_date)
+        for up in self.users:
+            user_stats = stats[up.user_id]
+            self.assertEqual(up.get_worked_hours(from_date, to_date),
+                             user_stats['worked_hours'])
+            self.assertEqual(up.billable_hours(from_date, to_date),
+                             user_stats['billable_hours'])
+            self.assertEqual(up.num_loggable_hours(from_date, to_date),
+                             user_stats['loggable_hours'])
+            self.assertEqual(bool(up.is_active(from_date, to_date)),
+                             user_stats['is_active'])
+            self.assertEqual(list(up.projects(from_date, to_date)),
+                             user_stats['projects'])
+
+    def test_period_stats_match_per_user_values(self):
+        self._check_stats(date(2010, 9, 1), date(2010, 10, 31))
+        self._check_stats(date(2010, 9, 20), date(2010, 10, 5))
+        self._check_stats(date(2012, 1, 1), date(2012, 5, 10))
+        self._check_stats(date(2005, 1, 1), date(2005, 1, 31))
+
+    def test_period_stats_query_count(self):
+        user_ids = [u.user_id for u in self.users]
+        TimeLog.period_stats(user_ids, date(2008, 1, 1), date(2012, 12, 31))
+        # hours per user and project, projects, average hours, calendars and
+        # the version of the holidays (already loaded)
+        self.assertNumQueries(5, TimeLog.period_stats, user_ids,
+                              date(2008, 1, 1), date(2012, 12, 31))
+
+    def test_period_stats_user_without_logs(self):
+        other = UserProfileFactory(user__username='user3')
+        stats = TimeLog.period_stats([other.user_id], date(2010, 9, 1),
+                                     date(2010, 10, 31))
+        self.assertEqual({'worked_hours': Decimal(0),
+                          'billable_hours': Decimal(0),
+                          'loggable_hours': 0,
+                          'is_active': False,
+                          'projects': []}, stats[other.user_id])
+
 
 class ChartsTest(HelperTest):
 
@@ -352,10 +767,323 @@ class ChartsTest(HelperTest):
         response = self.test_client.get(url)
         self.assertEqual(response.status_code, 200)
 
+    def test_daily_series(self):
+        # A non billable project, so billable and worked hours differ
+        project = ProjectFactory(name='Internal', client=self.client,
+                                 external_id='INT', billable=False,
+                                 start_date=date.today())
+        self.create_timelogs_for_users(3, [(self.user1.user, 2.0)],
+                                       date(2010, 9, 29), project)
+        from_date, to_date = date(2010, 9, 25), date(2010, 10, 12)
+        profiles = [self.user1, self.user2]
+        series = TimeLog.daily_series([p.user_id for p in profiles],
+                                      from_date, to_date)
+        for p in profiles:
+            user_series = series[p.user_id]
+            self.assertEqual(len(user_series['worked']), 18)
+            for i in range(18):
+                a_date = from_date + timedelta(days=i)
+                self.assertEqual(user_series['worked'][i],
+                                 p.get_worked_hours_per_day(a_date))
+                self.assertEqual(user_series['billable'][i],
+                                 p.billable_hours_a_day(a_date))
+
+        series = TimeLog.daily_series([self.user1.user_id], from_date,
+                                      to_date, billable_split=False)
+        self.assertEqual(series[self.user1.user_id].keys(), ['worked'])
+        self.assertNumQueries(1, TimeLog.daily_series,
+                              [p.user_id for p in profiles], from_date,
+                              to_date)
+
+
+class CsvExportTest(HelperTest):
+
+    def setUp(self):
+        super(CsvExportTest, self).setUp()
+        CurrencyFactory()
+        self.admin = AdminFactory(username='admin')
+        UserProfileFactory(user=self.admin)
+        self.test_client = TestClient()
+        self.test_client.login(username=self.admin.username,
+                               password=self.admin.username)
+        self.dates = {'from_date': '2010-09-16', 'to_date': '2010-09-30'}
+
+    def _export(self, view, arg, **kwargs):
+        kwargs.update(self.dates, export='csv')
+        response = self.test_client.get('%s?%s' % (
+            reverse(view, args=[arg]), urlencode(kwargs)))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual('text/csv', response['Content-Type'])
+        # The rows are streamed, not rendered before returning
+        self.assertFalse(response._is_string)
+        return list(csv.reader(StringIO(response.content)))
+
+    def test_user_detailed_export(self):
+        log = TimeLog.objects.get(user=self.user1.user, date=date(2010, 9, 30),
+                                  hours_booked=Decimal('3.5'))
+        log.description = u'Says "hi", in espa\xf1ol'
+        log.save()
+        rows = self._export('eff_report', 'user1', detailed=True)
+        logs = TimeLog.objects.filter(user=self.user1.user,
+                                      date__gte=date(2010, 9, 16),
+                                      date__lte=date(2010, 9, 30))
+        self.assertEqual(logs.count(), len(rows))
+        self.assertEqual(sorted(rows, key=lambda r: r[0].split('/')[::-1]),
+                         rows)
+        self.assertTrue(['30/09/2010', 'Fake Project 10', log.task_name,
+                         'Says "hi", in espa\xc3\xb1ol', '3.500'] in rows)
+
+        rows = self._export('eff_report', 'user1', detailed=True,
+                            project='Fake Project 42')
+        self.assertEqual([('30/09/2010', 'Fake Project 42', '5.000')],
+                         [(row[0], row[1], row[4]) for row in rows])
+
+    def test_client_detailed_export(self):
+        rows = self._export('eff_client_report', self.client.slug,
+                            detailed=True)
+        self.assertEqual(TimeLog.objects.filter(
+            project__client=self.client, date__gte=date(2010, 9, 16),
+            date__lte=date(2010, 9, 30)).count(), len(rows))
+        self.assertEqual(sorted(rows, key=lambda r: (
+            r[1], r[2], r[0].split('/')[::-1])), rows)
+        self.assertEqual(Decimal('173.5'),
+                         sum(Decimal(row[4]) for row in rows))
+
+    def test_client_export(self):
+        rows = self._export('eff_client_report', self.client.slug)
+        self.assertEqual(Decimal('173.5'),
+                         sum(Decimal(row[2]) for row in rows))
+
+
+class OdtTemplateTest(TestCase):
+
+    class FakeTemplate(object):
+        parsed = []
+
+        def __init__(self, source, filepath):
+            self.parsed.append(filepath)
+            self.stream = []
+
+    def setUp(self):
+        self.template = reports.Template
+        reports.Template = self.FakeTemplate
+        self.FakeTemplate.parsed[:] = []
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'report.odt')
+        open(self.path, 'w').close()
+
+    def tearDown(self):
+        reports.Template = self.template
+        reports._odt_templates.pop(self.path, None)
+        shutil.rmtree(self.dir)
+
+    def test_templates_are_parsed_once(self):
+        template = reports.odt_template(self.path)
+        self.assertTrue(template is reports.odt_template(self.path))
+        self.assertEqual([self.path], self.FakeTemplate.parsed)
+
+        # Parsed again when the file changes
+        mtime = os.stat(self.path).st_mtime
+        os.utime(self.path, (mtime + 1, mtime + 1))
+        self.assertFalse(template is reports.odt_template(self.path))
+        self.assertEqual([self.path] * 2, self.FakeTemplate.parsed)
+
+    def test_warm_odt_templates(self):
+        templates_dir = reports.ODT_TEMPLATES_DIR
+        reports.ODT_TEMPLATES_DIR = self.dir
+        try:
+            reports.warm_odt_templates()
+        finally:
+            reports.ODT_TEMPLATES_DIR = templates_dir
+        self.assertEqual([self.path], self.FakeTemplate.parsed)
+        reports.odt_template(self.path)
+        self.assertEqual([self.path], self.FakeTemplate.parsed)
+
+
+class ReportCacheTest(HelperTest):
+
+    def _stats(self, before):
+        after = report_cache_stats()
+        return dict((k, after[k] - before[k]) for k in after)
+
+    def test_reports_are_cached(self):
+        from_date, to_date = date(2010, 9, 1), date(2010, 10, 31)
+        before = report_cache_stats()
+        report = self.client.report(from_date, to_date, with_rates=True)
+        self.assertEqual(report, self.client.report(from_date, to_date,
+                                                     with_rates=True))
+        self.assertEqual({'hits': 1, 'misses': 1}, self._stats(before))
+        self.assertNumQueries(1, self.client.report, from_date, to_date,
+                              with_rates=True)
+
+        # Other flags, other report
+        before = report_cache_stats()
+        self.client.report(from_date, to_date)
+        user_report = self.user1.report(from_date, to_date)
+        summary = TimeLog.get_summary_per_project(self.user1, from_date,
+                                                  to_date)
+        self.assertEqual({'hits': 0, 'misses': 3}, self._stats(before))
+        self.assertEqual(user_report, self.user1.report(from_date, to_date))
+        self.assertEqual(summary, TimeLog.get_summary_per_project(
+            self.user1, from_date, to_date))
+        self.assertEqual({'hits': 2, 'misses': 3}, self._stats(before))
+
+    def test_changes_invalidate_reports(self):
+        from_date, to_date = date(2010, 9, 1), date(2010, 10, 31)
+        hours = lambda: sum(report[1] for report in self.client.report(
+            from_date, to_date))
+        self.assertEqual(Decimal('173.5') + Decimal('11.5') * 31, hours())
+
+        log = TimeLog.objects.filter(project__client=self.client,
+                                     date=date(2010, 10, 1))[0]
+        version = DataVersion.current().version
+        log.hours_booked += 1
+        log.save()
+        self.assertEqual(version + 1, DataVersion.current().version)
+        self.assertEqual(Decimal('174.5') + Decimal('11.5') * 31, hours())
+
+        log.delete()
+        self.assertEqual(version + 2, DataVersion.current().version)
+
+        ProjectAssoc.objects.all()[0].save()
+        self.assertEqual(version + 3, DataVersion.current().version)
+
+
+class ConditionalViewsTest(HelperTest):
+
+    def setUp(self):
+        super(ConditionalViewsTest, self).setUp()
+        CurrencyFactory()
+        self.admin = AdminFactory(username='admin')
+        UserProfileFactory(user=self.admin)
+        self.test_client = TestClient()
+        self.test_client.login(username=self.admin.username,
+                               password=self.admin.username)
+        self.dates = {'from_date': '2010-09-16', 'to_date': '2010-09-30'}
+
+    def _get(self, view, arg, response=None, **kwargs):
+        kwargs = dict(self.dates, **kwargs)
+        headers = {}
+        if response is not None:
+            headers = {'HTTP_IF_NONE_MATCH': response['ETag'],
+                       'HTTP_IF_MODIFIED_SINCE': response['Last-Modified']}
+        return self.test_client.get('%s?%s' % (
+            reverse(view, args=[arg]), urlencode(kwargs)), **headers)
+
+    def test_report_not_modified(self):
+        response = self._get('eff_client_report', self.client.slug)
+        self.assertEqual(200, response.status_code)
+        self.assertTrue('Cookie' in response['Vary'])
+
+        # The report is not computed again
+        before = report_cache_stats()
+        self.assertEqual(304, self._get('eff_client_report', self.client.slug,
+                                        response).status_code)
+        self.assertEqual(before, report_cache_stats())
+
+        # Another period
+        self.assertEqual(200, self._get('eff_client_report', self.client.slug,
+                                        response,
+                                        to_date='2010-10-30').status_code)
+
+        # Another user
+        other = AdminFactory(username='other')
+        UserProfileFactory(user=other)
+        self.test_client.login(username='other', password='other')
+        self.assertEqual(200, self._get('eff_client_report', self.client.slug,
+                                        response).status_code)
+
+    def test_changes_modify_reports(self):
+        response = self._get('eff_chart', 'user1')
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(304, self._get('eff_chart', 'user1',
+                                        response).status_code)
+        log = TimeLog.objects.filter(user=self.user1.user)[0]
+        log.hours_booked += 1
+        log.save()
+        changed = self._get('eff_chart', 'user1', response)
+        self.assertEqual(200, changed.status_code)
+        self.assertNotEqual(response['ETag'], changed['ETag'])
+
+        # The account summaries do not depend on the logs
+        response = self._get('eff_client_summary', self.client.slug)
+        self.assertEqual(200, response.status_code)
+        log.delete()
+        self.assertEqual(304, self._get('eff_client_summary', self.client.slug,
+                                        response).status_code)
+
+    def test_shown_data_modify_reports(self):
+        response = self._get('eff_chart', 'user1')
+        self.assertEqual(200, response.status_code)
+
+        # Logging in saves the user, without changes to what is shown
+        self.test_client.login(username=self.admin.username,
+                               password=self.admin.username)
+        self.assertEqual(304, self._get('eff_chart', 'user1',
+                                        response).status_code)
+
+        user = self.user1.user
+        user.first_name = 'Renamed'
+        user.save()
+        changed = self._get('eff_chart', 'user1', response)
+        self.assertEqual(200, changed.status_code)
+
+        # Saved unchanged
+        self.user1.save()
+        self.assertEqual(304, self._get('eff_chart', 'user1',
+                                        changed).status_code)
+
+        calendar = Calendar.objects.create(name='Argentina')
+        self.user1.calendar = calendar
+        for instance in (self.user1, self.client, calendar):
+            instance.save()
+            changed = self._get('eff_chart', 'user1', changed)
+            self.assertEqual(200, changed.status_code)
+
+        summary = self._get('eff_client_summary', self.client.slug)
+        self.client.save()
+        self.assertEqual(200, self._get('eff_client_summary', self.client.slug,
+                                        summary).status_code)
+
+    def test_documents_modify_summary(self):
+        response = self._get('eff_client_summary', self.client.slug)
+        self.assertEqual(200, response.status_code)
+
+        # The documents of another client
+        BillingFactory(date=date(2010, 9, 20))
+        self.assertEqual(304, self._get('eff_client_summary', self.client.slug,
+                                        response).status_code)
+
+        billing = BillingFactory(client=self.client, date=date(2010, 9, 20))
+        changed = self._get('eff_client_summary', self.client.slug, response)
+        self.assertEqual(200, changed.status_code)
+        self.assertTrue(billing.concept in changed.content)
+
+        # A comment on the document
+        Comment.objects.create(content_object=billing, user=self.admin,
+                               site_id=settings.SITE_ID, comment='Paid?')
+        commented = self._get('eff_client_summary', self.client.slug, changed)
+        self.assertEqual(200, commented.status_code)
+        forms = re.findall(r'(?is)<form[^>]*method="post".*?</form>',
+                           commented.content)
+        self.assertTrue(forms)
+        for form in forms:
+            self.assertTrue('csrfmiddlewaretoken' in form)
+
+        billing.delete()
+        self.assertEqual(200, self._get('eff_client_summary', self.client.slug,
+                                        commented).status_code)
+
 
 def suite():
     suite = TestSuite()
     suite.addTest(makeSuite(UserReportTest))
     suite.addTest(makeSuite(ClientReportTest))
+    suite.addTest(makeSuite(RateResolutionTest))
+    suite.addTest(makeSuite(PeriodStatsTest))
     suite.addTest(makeSuite(ChartsTest))
+    suite.addTest(makeSuite(CsvExportTest))
+    suite.addTest(makeSuite(OdtTemplateTest))
+    suite.addTest(makeSuite(ReportCacheTest))
+    suite.addTest(makeSuite(ConditionalViewsTest))
     return suite
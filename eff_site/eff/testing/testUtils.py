@@ -20,9 +20,18 @@ from django.conf import settings
 from django.test import TestCase
 from django.contrib.auth.models import User
 from eff.utils import overtime_period, period, load_dump
+from eff import utils
+from eff.models import (TimeLog, ProjectAssoc, Project, ExternalId,
+                        DailyHours, StagedTimeLog)
+from factories import (ExternalSourceFactory, ClientFactory, ProjectFactory,
+                       ProjectAssocFactory)
 
 from unittest import TestSuite, makeSuite
-from datetime import date
+from datetime import date, datetime
+from decimal import Decimal
+from StringIO import StringIO
+import os
+import tempfile
 import time
 # change name to be testeable
 from eff.views import __aux_mk_time as aux_mk_time
@@ -207,10 +216,226 @@ class TestOtherFunctions(TestCase):
         self.assertEqual(None, load_res[4])
 
 
+class TestLoadDump(TestCase):
+
+    def setUp(self):
+        self.source = ExternalSourceFactory(name='DotprojectMachinalis')
+        self.client = ClientFactory(external_source=self.source)
+        self.project = ProjectFactory(client=self.client, external_id='proj1',
+                                      start_date=date(2010, 1, 1))
+        self.users = []
+        for i in range(3):
+            usr = User.objects.create_user(username='test%d' % i,
+                                           email='test%d@test.com' % i,
+                                           password='test')
+            ExternalId.objects.create(login='login%d' % i, source=self.source,
+                                      userprofile=usr.get_profile())
+            self.users.append(usr)
+        # Only the first user is a member of the project
+        ProjectAssocFactory(project=self.project,
+                            member=self.users[0].get_profile())
+        self.batch_size = utils.LOAD_DUMP_BATCH_SIZE
+        utils.LOAD_DUMP_BATCH_SIZE = 4
+
+    def tearDown(self):
+        utils.LOAD_DUMP_BATCH_SIZE = self.batch_size
+
+    def _csv(self, rows):
+        header = ("# ExternalSource: %s\r\n"
+                  "# Client: %s\r\n"
+                  "# Author: Eff Fetcher\r\n"
+                  "# From date: 2010-09-01 00:00:00\r\n"
+                  "# To date: 2010-09-30 00:00:00\r\n") % (self.source.name,
+                                                           self.client.name)
+        return StringIO(header + ''.join(
+            '"2010-09-%02d","%s","%s","%s","task","desc"\r\n' % row
+            for row in rows))
+
+    def test_batches(self):
+        rows = [(day, 'proj1', 'login0', '1.5') for day in range(1, 11)]
+        res = load_dump(self._csv(rows), is_api=True)
+        self.assertEqual(([], set(), set(), set()), res)
+        self.assertEqual(TimeLog.objects.count(), 10)
+        self.assertEqual(sum(t.hours_booked for t in TimeLog.objects.all()),
+                         Decimal('15'))
+        self.assertEqual(DailyHours.objects.count(), 10)
+
+        # A new import of the range replaces the logs
+        load_dump(self._csv(rows[:3]), is_api=True)
+        self.assertEqual(TimeLog.objects.count(), 3)
+        self.assertEqual(DailyHours.objects.count(), 3)
+
+    def test_not_imported(self):
+        rows = [(1, 'proj1', 'login0', '1'), (2, 'proj1', 'login1', '2'),
+                (3, 'proj2', 'login0', '3'), (4, 'proj1', 'nobody', '4')]
+        res = load_dump(self._csv(rows), create_projects=False,
+                        create_project_assocs=False, is_api=True)
+        profile = self.users[0].get_profile()
+        self.assertEqual([['2010-09-02', 'proj1', 'login1', '2', 'task',
+                           'desc'],
+                          ['2010-09-03', 'proj2', 'login0', '3', 'task',
+                           'desc'],
+                          ['2010-09-04', 'proj1', 'nobody', '4', 'task',
+                           'desc']], res[0])
+        self.assertEqual(set(['nobody']), res[1])
+        self.assertEqual(set(['proj2']), res[2])
+        self.assertEqual(set([('proj1', self.users[1].get_profile()),
+                              ('proj2', profile)]), res[3])
+        self.assertEqual(4, len(res))
+        self.assertEqual(TimeLog.objects.count(), 1)
+
+    def test_not_imported_file(self):
+        # Rows as given by an adapter, of an unknown user
+        rows = [(date(2010, 9, 2), self.project, u'nobody', Decimal('2'),
+                 u'task', u'desc')]
+        res = utils.load_logs(self.source, self.client, 'Eff Fetcher',
+                              datetime(2010, 9, 1), datetime(2010, 9, 30),
+                              rows)
+        self.assertEqual(set(['nobody']), res[1])
+        self.addCleanup(os.remove, res[4])
+        lines = open(res[4]).read().splitlines()
+        self.assertEqual('"2010-09-02","proj1","nobody","2","task","desc"',
+                         lines[-1])
+
+    def test_creates_projects_and_assocs(self):
+        rows = [(1, 'proj1', 'login1', '1'), (2, 'proj1', 'login1', '2'),
+                (3, 'proj2', 'login0', '3'), (4, 'proj2', 'login2', '4')]
+        res = load_dump(self._csv(rows), is_api=True)
+        self.assertEqual(([], set(), set(), set()), res)
+        self.assertEqual(TimeLog.objects.count(), 4)
+        project = Project.objects.get(external_id='proj2')
+        self.assertEqual(ProjectAssoc.objects.filter(project=project).count(),
+                         2)
+        self.assertEqual(ProjectAssoc.objects.filter(
+            project=self.project).count(), 2)
+
+    def test_incremental(self):
+        rows = [(day, 'proj1', 'login0', '1.5') for day in range(1, 6)]
+        rows.append((1, 'proj1', 'login0', '1.5'))
+        stats = {}
+        load_dump(self._csv(rows), is_api=True, stats=stats)
+        self.assertEqual((6, 0, 0), (stats['added'], stats['removed'],
+                                     stats['unchanged']))
+        ids = set(TimeLog.objects.values_list('id', flat=True))
+
+        # One duplicate and one log vanish, one log changes and one is new
+        rows = rows[1:4] + [(5, 'proj1', 'login0', '2'),
+                            (1, 'proj1', 'login0', '1.500'),
+                            (6, 'proj1', 'login0', '1.5')]
+        res = load_dump(self._csv(rows), is_api=True, incremental=True,
+                        stats=stats)
+        self.assertEqual(([], set(), set(), set()), res)
+        self.assertEqual((2, 2, 4), (stats['added'], stats['removed'],
+                                     stats['unchanged']))
+        self.assertEqual(6, TimeLog.objects.count())
+        self.assertEqual(4, len(ids & set(TimeLog.objects.values_list(
+            'id', flat=True))))
+        self.assertEqual(sorted((t.date.day, t.hours_booked)
+                                for t in TimeLog.objects.all()),
+                         [(1, Decimal('1.5')), (2, Decimal('1.5')),
+                          (3, Decimal('1.5')), (4, Decimal('1.5')),
+                          (5, Decimal('2')), (6, Decimal('1.5'))])
+        self.assertEqual(DailyHours.objects.get(date=date(2010, 9, 5)).hours,
+                         Decimal('2'))
+
+        # Nothing changed
+        load_dump(self._csv(rows), is_api=True, incremental=True,
+                  stats=stats)
+        self.assertEqual((0, 0, 6), (stats['added'], stats['removed'],
+                                     stats['unchanged']))
+
+    def test_staged(self):
+        rows = [(day, 'proj1', 'login0', '1') for day in range(1, 11)]
+        stats = {}
+        load_dump(self._csv(rows), is_api=True, stats=stats)
+        self.assertEqual(0, StagedTimeLog.objects.count())
+        self.assert_(0 <= stats['swap_seconds'] <= stats['seconds'])
+
+        # A failed import leaves the logs as they were
+        bad = StringIO(self._csv(rows[:5]).getvalue() +
+                       '"2010-13-01","proj1","login0","1","task","desc"\r\n')
+        self.assertRaises(ValueError, load_dump, bad, is_api=True)
+        self.assertEqual(10, TimeLog.objects.count())
+        self.assertEqual(10, DailyHours.objects.count())
+        self.assertEqual(0, StagedTimeLog.objects.count())
+
+    def test_queries_do_not_depend_on_rows(self):
+        rows = [(day, 'proj1', 'login0', '1') for day in range(1, 5)]
+        self.assertNumQueries(14, load_dump, self._csv(rows), is_api=True)
+        rows = [(day, 'proj1', 'login0', '1') for day in range(1, 29)]
+        self.assertNumQueries(20, load_dump, self._csv(rows), is_api=True)
+
+
+class TestEffCsvWriter(TestCase):
+
+    def setUp(self):
+        self.source = ExternalSourceFactory(name='Source')
+        self.client = ClientFactory(external_source=self.source,
+                                    name='Client')
+        self.project = ProjectFactory(client=self.client, external_id='proj1',
+                                      start_date=date(2010, 1, 1))
+        self.rows = [(date(2010, 9, 1), self.project, u'login0',
+                      Decimal('1.5'), u'task', u'descripci\xf3n'),
+                     (datetime(2010, 9, 2, 10), 'proj2', 'login1', '2',
+                      'task', 'desc')]
+        self.lines = ['"2010-09-01","proj1","login0","1.5","task",'
+                      '"descripci\xc3\xb3n"',
+                      '"2010-09-02","proj2","login1","2","task","desc"']
+
+    def _writer(self, _file):
+        return utils.EffCsvWriter(self.source, self.client, 'Author', _file,
+                                  from_date=date(2010, 9, 1),
+                                  to_date=date(2010, 9, 30))
+
+    def test_write(self):
+        _file = StringIO()
+        writer = self._writer(_file)
+        for row in self.rows:
+            writer.write(row)
+        lines = _file.getvalue().splitlines()
+        self.assertEqual('# ExternalSource: Source', lines[0])
+        self.assertEqual('# To date: 2010-09-30', lines[4])
+        self.assertEqual(self.lines, lines[5:])
+
+    def test_writerows(self):
+        _file = StringIO()
+        self._writer(_file).writerows(self.rows * 2)
+        self.assertEqual(self.lines * 2, _file.getvalue().splitlines()[5:])
+
+    def test_free_text_is_not_cached(self):
+        writer = self._writer(StringIO())
+        writer.writerows((date(2010, 9, 1), self.project, u'login0', '1',
+                          u'task %d' % i, u'desc %d' % i) for i in range(100))
+        # Only the date, the project and the user
+        self.assertEqual(3, len(writer._encoded))
+
+    def test_validation(self):
+        bad = (date(2010, 9, 3), 'proj1', 'login0', 'x', 'task', 'desc')
+        self.assertRaises(Exception, self._writer(StringIO()).writerows,
+                          self.rows + [bad])
+        self.assertRaises(Exception, self._writer(StringIO()).write,
+                          self.rows[0][:5])
+
+        # Only the sampled rows are validated
+        writer = self._writer(StringIO())
+        writer.VALIDATE_EVERY = 2
+        writer.writerows([self.rows[0], bad])
+        self.assertRaises(Exception, writer.write, bad)
+
+    def test_validation_removes_file(self):
+        fd, filename = tempfile.mkstemp()
+        os.close(fd)
+        writer = self._writer(open(filename, 'w'))
+        self.assertRaises(Exception, writer.write, self.rows[0][:5])
+        self.assertFalse(os.path.exists(filename))
+
+
 def suite():
     suite = TestSuite()
     suite.addTest(makeSuite(TestNextPeriod))
     suite.addTest(makeSuite(TestPreviousPeriod))
     suite.addTest(makeSuite(TestOvertimePeriod))
     suite.addTest(makeSuite(TestDateFormat))
+    suite.addTest(makeSuite(TestLoadDump))
+    suite.addTest(makeSuite(TestEffCsvWriter))
     return suite
@@ -20,18 +20,20 @@
 import unittest
 import doctest
 
-from eff_site.scripts import jira
+from eff_site.scripts import jira, tutos
 
 from testing import testUtils
 from testing import testModels
 from testing import (testAdmin, testReports, testUserPassChange,
                      testUserReportsPerms, testUserProfileViews,
-                     testClientProjects, testClientSummary)
+                     testClientProjects, testClientSummary, testFetch,
+                     testQueryPlans)
 
 
 def suite():
     suite = unittest.TestSuite()
     suite.addTest(doctest.DocTestSuite(jira))
+    suite.addTest(doctest.DocTestSuite(tutos))
     suite.addTest(testUtils.suite())
     suite.addTest(testModels.suite())
     suite.addTest(testAdmin.suite())
@@ -41,4 +43,6 @@ def suite():
     suite.addTest(testUserProfileViews.suite())
     suite.addTest(testClientProjects.suite())
     suite.addTest(testClientSummary.suite())
+    suite.addTest(testFetch.suite())
+    suite.addTest(testQueryPlans.suite())
     return suite
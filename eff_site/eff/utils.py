@@ -19,21 +19,27 @@
 
 from os import stat, remove, symlink
 from os.path import basename
-from datetime import date, datetime
+from datetime import date, datetime, timedelta
 from dateutil.relativedelta import relativedelta, SU, SA
 
 import csv
+import cPickle
 import tempfile
+from hashlib import sha1
+from time import time
 
 from _models.project import Project, ProjectAssoc
-from _models.log import TimeLog
-from _models.external_source import ExternalSource
-from _models.dump import Dump
+from _models.log import TimeLog, DailyHours, StagedTimeLog
+from _models.external_source import ExternalSource, ExternalId
+from _models.dump import Dump, ImportDigest
 from _models.user_profile import UserProfile
 from _models.client import Client
+from _models.report_cache import DataVersion
 from django.conf import settings
+from django.db import connection, transaction
 from django.utils.encoding import force_unicode
-from decimal import Decimal
+from decimal import Decimal, InvalidOperation
+from itertools import imap
 
 
 def previous_week(a_date):
@@ -118,30 +124,38 @@ def force_symlink(src, dst):
 
 class Data (object):
     """ This is a 'bag of data' just holds data and it's use inside the views.
+
+    stats is the entry for the profile in the result of
+    L{TimeLog.period_stats<eff_site.eff.models.TimeLog.period_stats>}; when
+    not given it is computed for this profile alone.
     """
 
-    def __init__(self, profile, from_date, to_date):
+    def __init__(self, profile, from_date, to_date, stats=None):
+        if stats is None:
+            stats = TimeLog.period_stats([profile.user_id], from_date,
+                                         to_date)[profile.user_id]
         self.username = profile.user.username
         self.name = profile.user.first_name or profile.user.username
         self.url = profile.get_absolute_url()
-        self.is_active = profile.is_active(from_date, to_date)
-        self.worked_hours = profile.get_worked_hours(from_date, to_date)
-        self.loggable_hours = profile.num_loggable_hours(from_date, to_date)
-        self.billable_hours = profile.billable_hours(from_date, to_date)
-        try:
-            self.percentage_billable_hours =\
-                profile.percentage_billable_hours(from_date, to_date)
-        except ValueError:
-            self.percentage_billable_hours = 0
-
-        try:
-            self.percentage_hours_worked =\
-                profile.percentage_hours_worked(from_date, to_date)
-
-        except ValueError:
+        self.is_active = stats['is_active']
+        self.worked_hours = stats['worked_hours']
+        self.loggable_hours = stats['loggable_hours']
+        self.billable_hours = stats['billable_hours']
+        self._set_percentages()
+        self.projects = stats['projects']
+
+    def _set_percentages(self):
+        if self.loggable_hours > 0:
+            # Same as UserProfile.percentage_hours_worked()
+            self.percentage_hours_worked = (self.worked_hours /
+                self.loggable_hours * 100).quantize(Decimal('.00'))
+
+            # Same as UserProfile.percentage_billable_hours()
+            self.percentage_billable_hours = (self.billable_hours /
+                self.loggable_hours * 100).quantize(Decimal('.00'))
+        else:
             self.percentage_hours_worked = 0
-
-        self.projects = profile.projects(from_date, to_date)
+            self.percentage_billable_hours = 0
 
     def __eq__(self, other):
         return (
@@ -170,17 +184,40 @@ class DataTotal (Data):
         self.worked_hours = wh
         self.loggable_hours = lh
         self.billable_hours = bh
-        if lh > 0:
-            # Total of UserProfile.percentage_hours_worked()
-            self.percentage_hours_worked = (wh / lh * 100).quantize(
-                Decimal('.00'))
-
-            # Total of UserProfile.percentage_billable_hours()
-            self.percentage_billable_hours = (bh / lh * 100).quantize(
-                Decimal('.00'))
-        else:
-            self.percentage_hours_worked = 0
-            self.percentage_billable_hours = 0
+        self._set_percentages()
+
+    @classmethod
+    def from_stats(cls, stats):
+        """ Totalizes the values (per user dicts) of a
+        L{TimeLog.period_stats<eff_site.eff.models.TimeLog.period_stats>}
+        result.
+        """
+        wh, lh, bh = 0, 0, 0
+        for s in stats:
+            wh += s['worked_hours']
+            lh += s['loggable_hours']
+            bh += s['billable_hours']
+        return cls(wh, lh, bh)
+
+
+def _utf8(value):
+    """ Encodes unicode values in utf-8, leaving the rest as they are. """
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    return value
+
+
+def _is_hours(value):
+    """ Whether value is a number or a string holding one. """
+    if isinstance(value, (Decimal, int, long, float)):
+        return True
+    if isinstance(value, basestring):
+        try:
+            Decimal(value)
+        except InvalidOperation:
+            return False
+        return True
+    return hasattr(value, '__int__')
 
 
 class EffCsvWriter(object):
@@ -200,9 +237,12 @@ class EffCsvWriter(object):
 
     @cvar VALIDATE_ROWS: Determines if each row and its fields must be validated
     (size and type) before being writed to file
+    @cvar VALIDATE_EVERY: Only one in every VALIDATE_EVERY rows is validated,
+    for large exports from trusted sources
     """
 
     VALIDATE_ROWS = True
+    VALIDATE_EVERY = 1
 
     def __init__(self, ext_src, client, author, _file, date_format="%Y-%m-%d",
                  from_date=None, to_date=None):
@@ -233,6 +273,8 @@ class EffCsvWriter(object):
         self.date_format = date_format
         self.from_date = from_date
         self.to_date = to_date
+        self.n_rows = 0
+        self._encoded = {}
 
         if not self.to_date:
             self.to_date = date.today()
@@ -249,13 +291,14 @@ class EffCsvWriter(object):
                        self.to_date, )
 
         self.file.write(csv_header.encode('utf-8'))
-        if isinstance(self.file, file):
-            self.file.close()
-            self.writer = csv.writer(open(self.file.name, 'a'), delimiter=",",
-                quoting=csv.QUOTE_ALL)
+        self.writer = csv.writer(self.file, delimiter=",",
+                                 quoting=csv.QUOTE_ALL)
+
+        # The date formatter is chosen once, not for each row
+        if date_format == "%Y-%m-%d":
+            self._format_date = lambda d: d.isoformat()
         else:
-            self.writer = csv.writer(self.file, delimiter=",",
-                quoting=csv.QUOTE_ALL)
+            self._format_date = lambda d: d.strftime(date_format)
 
     def _validate_row(self, row):
         """ Check that a row to be writed is a valid task log.
@@ -278,7 +321,7 @@ class EffCsvWriter(object):
             return "Second row item must be a project name or Project instance"
         if not isinstance(row[2], basestring):
             return "Third row item must be a string"
-        if not hasattr(row[3], '__int__'):
+        if not _is_hours(row[3]):
             return "Fourth row item must be a number"
         if not isinstance(row[4], basestring):
             return "Fifth row item must be a string"
@@ -286,6 +329,65 @@ class EffCsvWriter(object):
             return "Sixth row item must be a string"
         return "OK"
 
+    @staticmethod
+    def _is_valid_row(row, _date=(date, datetime), _project=(basestring,
+                                                             Project)):
+        """ Fast version of _validate_row, for the rows that are valid. """
+        try:
+            log_date, project, user, hours, task_name, description = row
+        except (TypeError, ValueError):
+            return False
+        return (isinstance(log_date, _date) and
+                isinstance(project, _project) and
+                isinstance(user, basestring) and
+                isinstance(task_name, basestring) and
+                isinstance(description, basestring) and
+                _is_hours(hours))
+
+    def _check_row(self, row):
+        """ Validates row, if it is among the sampled ones. """
+        if not self.n_rows % self.VALIDATE_EVERY and \
+           not self._is_valid_row(row):
+            validation_msg = self._validate_row(row)
+            if validation_msg != "OK":
+                if isinstance(self.file, file):
+                    self.file.close()
+                    remove(self.file.name)
+                raise Exception("Error writing %s to csv file: %s"
+                                % (row, validation_msg, ))
+        self.n_rows += 1
+
+    def _encode(self, value):
+        """ Returns a date, project or user as written to the csv file. """
+        if isinstance(value, datetime):
+            return self._format_date(value.date())
+        if isinstance(value, date):
+            return self._format_date(value)
+        if isinstance(value, Project):
+            return _utf8(value.external_id)
+        return _utf8(value)
+
+    def _encode_row(self, row):
+        """ Returns row as written to the csv file. """
+        log_date, project, user, hours, task_name, description = row
+        # The dates, projects and users repeat a lot (and are few), so they
+        # are encoded once. The free text columns are not cached, as most of
+        # their values are unique.
+        encoded = self._encoded
+        try:
+            return (encoded[log_date], encoded[project], encoded[user], hours,
+                    _utf8(task_name), _utf8(description))
+        except KeyError:
+            for value in (log_date, project, user):
+                if value not in encoded:
+                    encoded[value] = self._encode(value)
+            return self._encode_row(row)
+
+    def _checked(self, rows):
+        for row in rows:
+            self._check_row(row)
+            yield row
+
     def write(self, row):
         """ Validates (if apply) and writes a row to the file.
 
@@ -297,33 +399,26 @@ class EffCsvWriter(object):
 
         """
         if self.VALIDATE_ROWS:
-            validation_msg = self._validate_row(row)
-            if validation_msg != "OK":
-                remove(self.file.filename)
-                raise Exception("Error writing %s to csv file: %s"
-                                % (row, validation_msg, ))
-        row = list(row)
-        if isinstance(row[1], Project):
-            row[1] = row[1].external_id
-
-        if hasattr(row[0], 'date'):
-            row[0] = row[0].date().strftime(self.date_format)
-        elif isinstance(row[0], date):
-            row[0] = row[0].strftime(self.date_format)
-
-        # UTF-8 encoding
-        def _encode(x):
-            # This is used to encode all strings in utf8
-            if isinstance(x, unicode):  # if it str, leave it as it is
-                return x.encode('utf-8')
-            return x
-
-        erow = [_encode(x) for x in row]
-        debug("Saving: %s", erow)
-        self.writer.writerow(erow)
+            self._check_row(row)
+        self.writer.writerow(self._encode_row(row))
 
     writerow = write
 
+    def writerows(self, rows):
+        """ Validates (if apply) and writes the rows to the file, faster than
+        writing them one by one.
+
+        @param rows: the task log rows to be writed.
+        @type rows: iterable
+
+        @raise Exception(validation_error_message): if a row to be writed
+        is a not valid task log.
+
+        """
+        if self.VALIDATE_ROWS:
+            rows = self._checked(rows)
+        self.writer.writerows(imap(self._encode_row, rows))
+
 
 def _date_fmts(date_str, fmts=None):
     """
@@ -389,11 +484,235 @@ def validate_header(file_obj):
     return args[0:3] + [_date_fmts(x) for x in args[3:]]
 
 
+# Number of logs inserted by each INSERT statement of load_dump
+LOAD_DUMP_BATCH_SIZE = 100
+
+_TIMELOG_FIELDS = ('date', 'project', 'task_name', 'user', 'hours_booked',
+                   'description', 'dump')
+
+
+def _bulk_insert(model, field_names, rows):
+    """
+    Inserts rows of model with a single multi-row INSERT. No signal is sent.
+
+    @param model: model of the rows
+    @type model: django.db.models.Model subclass
+    @param field_names: names of the fields given in each row (foreign keys
+    are given by id)
+    @type field_names: tuple
+    @param rows: values for field_names
+    @type rows: list of tuples
+    """
+    qn = connection.ops.quote_name
+    fields = [model._meta.get_field(name) for name in field_names]
+    values = '(%s)' % ', '.join(['%s'] * len(fields))
+    sql = 'INSERT INTO %s (%s) VALUES %s' % (
+        qn(model._meta.db_table), ', '.join([qn(f.column) for f in fields]),
+        ', '.join([values] * len(rows)))
+    params = [field.get_db_prep_save(value, connection=connection)
+              for row in rows for (field, value) in zip(fields, row)]
+    connection.cursor().execute(sql, params)
+
+
+def _delete_logs_sql(external_source, client, from_date, to_date):
+    """
+    Returns the (sql, params) of the DELETE of the logs of client imported
+    from external_source between from_date and to_date.
+    """
+    qn = connection.ops.quote_name
+    sql = ('DELETE FROM %(tl)s WHERE %(date)s >= %%s AND %(date)s <= %%s '
+           'AND %(dump_id)s IN (SELECT %(id)s FROM %(dump)s '
+           'WHERE %(source_id)s = %%s) '
+           'AND %(project_id)s IN (SELECT %(id)s FROM %(project)s '
+           'WHERE %(client_id)s = %%s)') % {
+               'tl': qn(TimeLog._meta.db_table), 'date': qn('date'),
+               'dump': qn(Dump._meta.db_table), 'dump_id': qn('dump_id'),
+               'project': qn(Project._meta.db_table),
+               'project_id': qn('project_id'), 'id': qn('id'),
+               'source_id': qn('source_id'), 'client_id': qn('client_id')}
+    date_field = TimeLog._meta.get_field('date')
+    return sql, [date_field.get_db_prep_save(from_date, connection=connection),
+                 date_field.get_db_prep_save(to_date, connection=connection),
+                 external_source.id, client.id]
+
+
+def _delete_logs(external_source, client, from_date, to_date):
+    """
+    Deletes the logs of client imported from external_source between from_date
+    and to_date with a single DELETE, without loading them.
+    """
+    cursor = connection.cursor()
+    cursor.execute(*_delete_logs_sql(external_source, client, from_date,
+                                     to_date))
+    return cursor.rowcount
+
+
+def _delete_ids(model, ids, chunk_size=500):
+    """ Deletes the rows of model with the given ids, without loading them.
+    """
+    qn = connection.ops.quote_name
+    cursor = connection.cursor()
+    for i in xrange(0, len(ids), chunk_size):
+        chunk = ids[i:i + chunk_size]
+        cursor.execute('DELETE FROM %s WHERE %s IN (%s)' % (
+            qn(model._meta.db_table), qn(model._meta.pk.column),
+            ', '.join(['%s'] * len(chunk))), chunk)
+
+
+# Digests of the logs of a day are sums of sha1 digests, modulo this
+_DIGEST_MODULUS = 2 ** 160
+
+# Hours are stored (and so compared) with the precision of the field
+_HOURS_QUANTUM = Decimal(1).scaleb(
+    -TimeLog._meta.get_field('hours_booked').decimal_places)
+
+
+def _fingerprint(a_date, project_id, user_id, hours, task_name, description):
+    """ Identifies a log by all its imported values, see load_dump. """
+    if isinstance(a_date, datetime):
+        a_date = a_date.date()
+    return (a_date, project_id, user_id,
+            Decimal(hours).quantize(_HOURS_QUANTUM),
+            force_unicode(task_name), force_unicode(description))
+
+
+def _log_date(value, date_format=None):
+    """ Date of a log, as read from a csv file or given to load_logs. """
+    if isinstance(value, datetime):
+        return value
+    if isinstance(value, date):
+        return datetime(value.year, value.month, value.day)
+    return _date_fmts(value, date_format and [date_format])
+
+
+def _daily_digests(rows, from_date, to_date, date_format=None):
+    """
+    Returns a dict mapping each day between from_date and to_date to a digest
+    of its logs in rows, which does not depend on their order. The days
+    without logs get the digest of no logs.
+
+    The digest of a day is the sum of the sha1 of each of its logs, so they
+    are computed in a single pass without holding the logs in memory.
+    """
+    first, last = from_date.date(), to_date.date()
+    days = dict((first + timedelta(days=n), 0)
+                for n in xrange((last - first).days + 1))
+    for row in rows:
+        d = _log_date(row[0], date_format).date()
+        if d not in days:
+            continue
+        project = row[1]
+        if isinstance(project, Project):
+            project = project.external_id
+        log = u'\x1f'.join([
+            force_unicode(x) for x in
+            _fingerprint(d, project, row[2], row[3], row[4], row[5])[1:]])
+        days[d] = (days[d] + long(sha1(log.encode('utf-8')).hexdigest(), 16)
+                   ) % _DIGEST_MODULUS
+    return dict((d, '%040x' % digest) for (d, digest) in days.items())
+
+
+class _RowSpool(object):
+    """
+    Temporary file where the rows of an import are kept while they are
+    digested, to read them back without holding them in memory.
+    """
+
+    def __init__(self):
+        self._file = tempfile.TemporaryFile()
+        self.count = 0
+
+    def spooling(self, rows):
+        """ Yields the non empty rows, writing them to the spool. """
+        for row in rows:
+            if not row:
+                continue
+            if isinstance(row[1], Project):
+                row = list(row)
+                row[1] = row[1].external_id
+            cPickle.dump(row, self._file, cPickle.HIGHEST_PROTOCOL)
+            self.count += 1
+            yield row
+
+    def __iter__(self):
+        self._file.seek(0)
+        for i in xrange(self.count):
+            yield cPickle.load(self._file)
+
+    def close(self):
+        self._file.close()
+
+
+def _replace_digests(external_source, client, from_date, to_date, digests):
+    """
+    Replaces the digests of the client logs imported from external_source
+    between from_date and to_date with digests.
+    """
+    qn = connection.ops.quote_name
+    date_field = ImportDigest._meta.get_field('date')
+    connection.cursor().execute(
+        'DELETE FROM %s WHERE %s = %%s AND %s = %%s AND %s >= %%s '
+        'AND %s <= %%s' % (qn(ImportDigest._meta.db_table), qn('source_id'),
+                           qn('client_id'), qn('date'), qn('date')),
+        [external_source.id, client.id,
+         date_field.get_db_prep_save(from_date, connection=connection),
+         date_field.get_db_prep_save(to_date, connection=connection)])
+    if digests:
+        _bulk_insert(ImportDigest, ('source', 'client', 'date', 'digest'),
+                     [(external_source.id, client.id, d, digest)
+                      for (d, digest) in digests.items()])
+
+
+def _insert_staged(dump):
+    """ Moves the staged logs of dump to TimeLog. """
+    qn = connection.ops.quote_name
+    columns = ', '.join([qn(TimeLog._meta.get_field(name).column)
+                         for name in _TIMELOG_FIELDS])
+    connection.cursor().execute(
+        'INSERT INTO %s (%s) SELECT %s FROM %s WHERE %s = %%s' % (
+            qn(TimeLog._meta.db_table), columns, columns,
+            qn(StagedTimeLog._meta.db_table), qn('dump_id')), [dump.id])
+    _delete_staged(dump)
+
+
+def _delete_staged(dump):
+    qn = connection.ops.quote_name
+    connection.cursor().execute('DELETE FROM %s WHERE %s = %%s' % (
+        qn(StagedTimeLog._meta.db_table), qn('dump_id')), [dump.id])
+    transaction.commit_unless_managed()
+
+
+@transaction.commit_on_success
+def _swap_staged(dump, external_source, client, from_date, to_date, vanished,
+                 rollup_from, rollup_to, digests):
+    """
+    Replaces, in a single transaction, the logs of client imported from
+    external_source between from_date and to_date (or only the vanished ones,
+    if given) with the staged logs of dump, updates the daily rollup and the
+    digests of the imported days, and bumps the DataVersion.
+
+    @return: the number of logs removed
+    """
+    if vanished is None:
+        n_removed = _delete_logs(external_source, client, from_date, to_date)
+    else:
+        _delete_ids(TimeLog, vanished)
+        n_removed = len(vanished)
+    _insert_staged(dump)
+    DailyHours.rebuild(rollup_from, rollup_to, client)
+    _replace_digests(external_source, client, from_date, to_date, digests)
+    DataVersion.bump()
+    return n_removed
+
+
 def load_dump(file_obj, date_format=None,
               create_logins=True,
               create_projects=True,
               create_project_assocs=True,
-              is_api=False):
+              is_api=False,
+              incremental=False,
+              skip_unchanged=False,
+              stats=None):
     """
     Load Dumps for file into the database.
 
@@ -407,11 +726,32 @@ def load_dump(file_obj, date_format=None,
 
     Description
     ===========
-    Before uploading the logs to the system all the existing logs for the given
-    external source and client between given dates are deleted. Next a Dump
-    object for this upload is created, and all eff logs in the csv file are
-    imported to the system with the corresponding date, project, user,
-    hours booked, task name and description.
+    All the existing logs for the given external source and client between
+    given dates are replaced by the ones in the file: a Dump object for this
+    upload is created, and all eff logs in the csv file are imported to the
+    system with the corresponding date, project, user, hours booked, task
+    name and description.
+
+    The logs are inserted in batches of L{LOAD_DUMP_BATCH_SIZE} rows, without
+    sending signals, into StagedTimeLog. Only when all of them are staged the
+    old logs are replaced with the staged ones in a single short transaction,
+    so reports never see a half loaded dump. The number of rows imported per
+    second and the time taken by that swap are reported with L{debug}.
+
+    With skip_unchanged a digest of the logs of each day is compared with
+    the one saved by the previous import of the day: if none changed the
+    import is skipped, otherwise only the days from the first to the last
+    changed one are imported. A day without a saved digest is taken as
+    changed. No digest is saved for the days with logs not imported (see
+    below), and the digests of a day are forgotten when its logs change
+    or a dump of the source is deleted. Imports without skip_unchanged
+    forget the digests of their range.
+
+    In incremental mode the existing logs are not deleted up front. Each log
+    is fingerprinted by its date, project, user, hours, task name and
+    description: only the csv logs without an existing twin are inserted
+    (into the new Dump), and only the existing logs without a csv twin are
+    deleted.
 
     In case that the create_logins flag is enabled and function call does not
     come from an API call (is_api flag disabled), then all logs which includes
@@ -452,6 +792,15 @@ def load_dump(file_obj, date_format=None,
         (set to False)
     or should be treated as an API call (set to True)
     @type is_api: bool
+    @param incremental: only insert new logs and delete vanished ones
+    @type incremental: bool
+    @param skip_unchanged: do not import the days whose logs did not change
+    since they were last imported
+    @type skip_unchanged: bool
+    @param stats: optional dict where the number of 'added', 'removed' and
+    'unchanged' logs, the 'seconds' taken and the 'swap_seconds' taken by
+    the swap are stored, and 'skipped' if the import was skipped
+    @type stats: dict
 
     @return: Tuple with four elements:
     list of rows not imported, set of external logins not found,
@@ -469,99 +818,224 @@ def load_dump(file_obj, date_format=None,
     client = Client.objects.get(name=client)
     external_source = ExternalSource.objects.get(name=ext_src)
 
-    # Load all userprofiles so when do not hit the data base
-    # in each iteration of the for loop.
-    userprofile_dict = dict([(external_id.login, up)
-                             for up in UserProfile.objects.all()
-                             for external_id in
-                             up.externalid_set.filter(source=external_source)
-                             ])
+    return load_logs(external_source, client, author, from_date, to_date,
+                     csv.reader(file_obj), date_format=date_format,
+                     create_logins=create_logins,
+                     create_projects=create_projects,
+                     create_project_assocs=create_project_assocs,
+                     is_api=is_api, incremental=incremental,
+                     skip_unchanged=skip_unchanged, stats=stats)
+
+
+def load_logs(external_source, client, author, from_date, to_date, rows,
+              date_format=None,
+              create_logins=True,
+              create_projects=True,
+              create_project_assocs=True,
+              is_api=False,
+              incremental=False,
+              skip_unchanged=False,
+              stats=None):
+    """
+    Loads logs into the database as L{load_dump} does, but taking the header
+    values and the rows directly instead of reading them from an Eff csv file.
+    This lets the external source adapters feed their rows to the importer
+    as they are produced, without writing and reading back a csv file.
+
+    @param external_source: external source the logs were fetched from
+    @type external_source: eff_site.eff.models.ExternalSource
+    @param client: client the logs belong to
+    @type client: eff_site.eff.models.Client
+    @param author: author of the dump
+    @type author: basestring
+    @param from_date: start date of the dump
+    @type from_date: datetime.datetime
+    @param to_date: end date of the dump
+    @type to_date: datetime.datetime
+    @param rows: the task logs, as read from an Eff csv file or as accepted
+    by L{EffCsvWriter.write}
+    @type rows: iterable
+
+    See L{load_dump} for the rest of the parameters and the returned tuple.
+
+    """
+    started = time()
+    digests = {}
+    spool = None
+    if skip_unchanged:
+        spool = _RowSpool()
+        digests = _daily_digests(spool.spooling(rows), from_date, to_date,
+                                 date_format)
+        saved = dict(ImportDigest.objects.filter(
+            source=external_source, client=client, date__gte=from_date,
+            date__lte=to_date).values_list('date', 'digest'))
+        # A day without a saved digest may have logs, so it changed
+        changed = [d for d in digests if digests[d] != saved.get(d)]
+        if not changed:
+            spool.close()
+            elapsed = time() - started
+            debug('%s, %s: %d logs unchanged, import skipped in %.3f seconds',
+                  external_source.name, client.name, spool.count, elapsed)
+            if stats is not None:
+                stats.update(added=0, removed=0, unchanged=spool.count,
+                             seconds=elapsed, swap_seconds=0, skipped=True)
+            r_list = [[], set(), set(), set()]
+            if not is_api and create_logins:
+                r_list.append(None)
+            return tuple(r_list)
+
+        # The days before the first changed one and after the last one are
+        # left as they are
+        first, last = min(changed), max(changed)
+        kept = set(d for d in digests if not first <= d <= last)
+        rows = (row for row in spool
+                if _log_date(row[0], date_format).date() not in kept)
+        from_date = datetime(first.year, first.month, first.day)
+        to_date = datetime(last.year, last.month, last.day)
+        digests = dict((d, digest) for (d, digest) in digests.items()
+                       if first <= d <= last)
+
+    # Load all userprofiles, projects and project associations so we do not
+    # hit the data base in each iteration of the for loop.
+    userprofile_dict = dict(
+        (external_id.login, external_id.userprofile)
+        for external_id in ExternalId.objects.filter(
+            source=external_source).select_related('userprofile'))
 
     projects_dict = dict([(p.external_id, p)
                           for p in Project.objects.filter(client__name=client)])
 
-    reader = csv.reader(file_obj)
-
-    TimeLog.objects.filter(dump__source=external_source,
-                           date__gte=from_date,
-                           date__lte=to_date,
-                           project__client=client).delete()
+    assocs = set(ProjectAssoc.objects.filter(project__client=client
+                    ).values_list('project', 'member'))
+
+    if incremental:
+        existing = {}
+        for log in TimeLog.objects.filter(dump__source=external_source,
+                                          date__gte=from_date,
+                                          date__lte=to_date,
+                                          project__client=client).values_list(
+                'id', 'date', 'project', 'user', 'hours_booked', 'task_name',
+                'description'):
+            existing.setdefault(_fingerprint(*log[1:]), []).append(log[0])
     dump = Dump.objects.create(date=date.today(),
                                creator=author,
                                source=external_source)
 
-    # Define a partial function so when don't branch in the loop
-    if date_format:
-        _partial_date_fmts = lambda x: _date_fmts(x, [date_format])
-    else:
-        _partial_date_fmts = lambda x: _date_fmts(x)
-
     n_rows, n_users, n_projects, n_project_assocs = [], set(), set(), set()
+    # Days with logs not imported, whose digests are not saved so they are
+    # imported again (once the missing users or projects exist)
+    dropped = set()
     a_rows = []
-    for row in reader:
-        if not row:
-            continue
+    batch, n_imported, n_unchanged = [], 0, 0
+    rollup_from, rollup_to = from_date, to_date
+    # The logs are staged first, so readers see the old logs until all of
+    # them are swapped in at once.
+    try:
+        for row in rows:
+            if not row:
+                continue
 
-        lgn = force_unicode(row[2])
-        userprofile = userprofile_dict.get(lgn, None)
-        if not userprofile:
-            #if create_logins or is_api:
-            n_users.add(row[2])
-            n_rows.append(row)
-            a_rows.append(row)
-            continue
-        user = userprofile.user
+            if isinstance(row[1], Project):
+                row = list(row)
+                row[1] = row[1].external_id
+
+            d = _log_date(row[0], date_format)
 
-        d = _partial_date_fmts(row[0])
+            lgn = force_unicode(row[2])
+            userprofile = userprofile_dict.get(lgn, None)
+            if not userprofile:
+                #if create_logins or is_api:
+                n_users.add(row[2])
+                n_rows.append(row)
+                a_rows.append(row)
+                dropped.add(d.date())
+                continue
 
-        t_proj = projects_dict.get(row[1], None)
-        if not t_proj:
-            if create_projects:
-                t_proj = Project.objects.create(name=row[1],
-                                                external_id=row[1],
-                                                client=client,
-                                                start_date=d)
+            t_proj = projects_dict.get(row[1], None)
+            if not t_proj:
+                if create_projects:
+                    t_proj = Project.objects.create(name=row[1],
+                                                    external_id=row[1],
+                                                    client=client,
+                                                    start_date=d)
 
-                passoc = ProjectAssoc.objects.filter(project=t_proj,
-                    member=user.get_profile())
-                if not passoc:
                     ProjectAssoc.objects.create(project=t_proj,
-                                                member=user.get_profile(),
+                                                member=userprofile,
                                                 client_rate=0.0,
                                                 user_rate=0.0,
                                                 from_date=d)
+                    assocs.add((t_proj.id, userprofile.id))
 
-                projects_dict[row[1]] = t_proj
-            else:
-                n_projects.add(row[1])
-                n_project_assocs.add((row[1], user.get_profile()))
-                n_rows.append(row)
-                continue
-        else:
-            passoc = ProjectAssoc.objects.filter(project=t_proj,
-                member=user.get_profile())
-            if not passoc:
+                    projects_dict[row[1]] = t_proj
+                else:
+                    n_projects.add(row[1])
+                    n_project_assocs.add((row[1], userprofile))
+                    n_rows.append(row)
+                    dropped.add(d.date())
+                    continue
+            elif (t_proj.id, userprofile.id) not in assocs:
                 if create_project_assocs:
                     ProjectAssoc.objects.create(project=t_proj,
-                                                member=user.get_profile(),
+                                                member=userprofile,
                                                 client_rate=0.0,
                                                 user_rate=0.0,
                                                 from_date=d)
+                    assocs.add((t_proj.id, userprofile.id))
                 else:
-                    n_project_assocs.add((t_proj.external_id,
-                        user.get_profile()))
+                    n_project_assocs.add((t_proj.external_id, userprofile))
                     n_rows.append(row)
+                    dropped.add(d.date())
                     continue
 
-        tl_dict = {'date': d,
-                   'project': t_proj,
-                   'task_name': row[4],
-                   'user': user,
-                   'hours_booked': row[3],
-                   'description': row[5],
-                   'dump': dump
-                   }
-        TimeLog.objects.create(**tl_dict)
+            if incremental:
+                twins = existing.get(_fingerprint(d, t_proj.id,
+                                                  userprofile.user_id, row[3],
+                                                  row[4], row[5]))
+                if twins:
+                    twins.pop()
+                    n_unchanged += 1
+                    continue
+
+            batch.append((d, t_proj.id, row[4], userprofile.user_id, row[3],
+                          row[5], dump.id))
+            rollup_from, rollup_to = min(rollup_from, d), max(rollup_to, d)
+            if len(batch) == LOAD_DUMP_BATCH_SIZE:
+                _bulk_insert(StagedTimeLog, _TIMELOG_FIELDS, batch)
+                n_imported += len(batch)
+                batch = []
+
+        if batch:
+            _bulk_insert(StagedTimeLog, _TIMELOG_FIELDS, batch)
+            n_imported += len(batch)
+    except Exception:
+        _delete_staged(dump)
+        raise
+    finally:
+        if spool is not None:
+            spool.close()
+    transaction.commit_unless_managed()
+
+    if incremental:
+        vanished = [log_id for ids in existing.values() for log_id in ids]
+    else:
+        vanished = None
+    digests = dict((d, digest) for (d, digest) in digests.items()
+                   if d not in dropped)
+    swap_started = time()
+    n_removed = _swap_staged(dump, external_source, client, from_date,
+                             to_date, vanished, rollup_from, rollup_to,
+                             digests)
+    swap_elapsed = time() - swap_started
+
+    elapsed = time() - started
+    debug('%s, %s: %d logs added, %d removed and %d unchanged in %.2f seconds '
+          '(%.1f rows/sec), swapped in %.3f seconds', external_source.name,
+          client.name, n_imported, n_removed, n_unchanged, elapsed,
+          (n_imported + n_unchanged) / max(elapsed, 0.001), swap_elapsed)
+    if stats is not None:
+        stats.update(added=n_imported, removed=n_removed,
+                     unchanged=n_unchanged, seconds=elapsed,
+                     swap_seconds=swap_elapsed)
 
     r_list = [n_rows, n_users, n_projects, n_project_assocs]
 
@@ -574,10 +1048,14 @@ def load_dump(file_obj, date_format=None,
             temp_writer = EffCsvWriter(external_source, client, author,
                 temp_file, from_date=from_date, to_date=to_date)
 
-            for row in a_rows:
-                row[0] = datetime.strptime(row[0], '%Y-%m-%d')
-                row[3] = row[3]
-                temp_writer.write(row)
+            try:
+                for row in a_rows:
+                    # The rows given by the adapters are tuples of dates
+                    row = list(row)
+                    row[0] = _log_date(row[0], date_format)
+                    temp_writer.write(row)
+            finally:
+                temp_file.close()
 
         r_list.append(temp_path)
 
@@ -23,12 +23,13 @@ import csv
 import urlparse
 import operator
 
+from hashlib import sha1
 from urllib import quote, urlencode
 from datetime import date, timedelta, datetime
 
 from django.shortcuts import render_to_response, get_object_or_404, redirect
 from django.contrib.auth.decorators import login_required, user_passes_test
-from django.template import RequestContext, loader, Context
+from django.template import RequestContext
 from django.http import HttpResponseRedirect, HttpResponse
 from django.utils import simplejson
 from django.core.urlresolvers import reverse
@@ -43,13 +44,15 @@ from dateutil.relativedelta import relativedelta
 
 from profiles import views as profile_views
 
-from relatorio.templates.opendocument import Template
 from reports import format_report_data
 from reports import format_report_data_user, FixedPriceClientReverseBilling
+from reports import (csv_lines, user_detailed_csv_rows,
+                     client_detailed_csv_rows, odt_template)
 
 from eff_site.eff.models import (AvgHours, Wage, TimeLog, Project, Client,
                                  UserProfile, ClientHandles, ExternalId,
-                                 ExternalSource, Dump, CommercialDocumentBase)
+                                 ExternalSource, Dump, CommercialDocumentBase,
+                                 UpdateJob, DataVersion)
 
 from eff_site.eff.utils import overtime_period, previous_week, week, month
 from eff_site.eff.utils import period, validate_header, _date_fmts
@@ -64,16 +67,15 @@ from eff_site.eff.forms import (EffQueryForm, UserProfileForm,
 from django.forms.models import inlineformset_factory
 from django.db.models import Min
 
-from django.views.decorators.http import require_POST
+from django.views.decorators.http import require_POST, condition
+from django.views.decorators.vary import vary_on_cookie
+from django.views.decorators.csrf import csrf_response_exempt
 from django.db.models.loading import get_model
 from django.utils.translation import ugettext
 from attachments.models import Attachment
 from attachments.forms import AttachmentForm
 
 
-cur_dir = os.path.dirname(os.path.abspath(__file__))
-
-
 # ==================== internals ====================
 
 OVERTIME_FLAG = 'overtime_nav'
@@ -123,6 +125,59 @@ def __process_dates(request):
     return context
 
 
+def __csv_response(rows, filename):
+    """ Streams rows as a csv attachment, see reports.csv_lines. """
+    response = HttpResponse(csv_lines(rows), mimetype='text/csv')
+    response['Content-Disposition'] = 'attachment; filename=%s' % filename
+    return response
+
+
+def __if_data_changed(scope_func):
+    """
+    Decorator for the views rendered from the data counted by the
+    DataVersion of the scope returned by scope_func (called as the view).
+    The responses carry an ETag (per user and url) and a Last-Modified
+    taken from that version, so a request repeating them is answered 304
+    Not Modified without running the view while the data does not change.
+    """
+    def _version(request, *args, **kwargs):
+        if not hasattr(request, '_data_version'):
+            scope = scope_func(request, *args, **kwargs)
+            request._data_version = scope and DataVersion.current(scope)
+        return request._data_version
+
+    def _etag(request, *args, **kwargs):
+        version = _version(request, *args, **kwargs)
+        if version:
+            return sha1(u'%s %d %s %d %s %s' % (
+                version.scope, version.version, version.updated,
+                request.user.id, __enough_perms(request.user),
+                request.get_full_path())).hexdigest()
+
+    def _last_modified(request, *args, **kwargs):
+        version = _version(request, *args, **kwargs)
+        return version and version.updated
+
+    def _dec(view_fun):
+        return vary_on_cookie(condition(_etag, _last_modified)(view_fun))
+
+    return _dec
+
+
+def __reports_scope(request, *args, **kwargs):
+    return DataVersion.REPORTS
+
+
+def __summary_scope(request, company_slug=None):
+    if __enough_perms(request.user):
+        company_id = Client.objects.filter(slug=company_slug).values_list(
+            'id', flat=True)[:1]
+        company_id = company_id and company_id[0]
+    else:
+        company_id = request.user.get_profile().company_id
+    return company_id and DataVersion.documents_scope(company_id)
+
+
 def __process_period(request, is_prev):
     context = __process_dates(request)
     from_date = context['from_date']
@@ -236,7 +291,9 @@ def chart_values(username_list, from_date, to_date, request_user):
     delta = timedelta(days=1)
 
     user_list = User.objects.filter(username__in=username_list)
-    profile_list = [user.get_profile() for user in user_list]
+    enough_perms = __enough_perms(request_user)
+    series = TimeLog.daily_series([user.id for user in user_list], from_date,
+                                  to_date, billable_split=enough_perms)
 
     maxhours = len(username_list) * 24
     if len(username_list) <= 3:
@@ -259,24 +316,20 @@ def chart_values(username_list, from_date, to_date, request_user):
     labels = "1:|" + hours_labels + "0:|"
     nombres = "".join(u.first_name + ", " for u in user_list)
     values['name'] = nombres.strip(", ")
-    worked_hours_list = []
-    billable_hours = []
+    # Totals of all the users for each day
+    worked_hours_list = [0] * ((to_date - from_date).days + 1)
+    billable_hours = [0] * len(worked_hours_list)
+    for user_series in series.values():
+        for i, hours in enumerate(user_series['worked']):
+            worked_hours_list[i] += hours
+        if enough_perms:
+            for i, hours in enumerate(user_series['billable']):
+                billable_hours[i] += hours
     current_month = from_date.month
     months = ':|' + monthdict[current_month] + '|'
     tmp_date = from_date
 
     while tmp_date <= to_date:
-        wh = 0
-        for profile in profile_list:
-            wh += profile.get_worked_hours_per_day(tmp_date)
-        worked_hours_list.append(wh)
-        if __enough_perms(request_user):
-            bh = 0
-            for profile in profile_list:
-                bh += profile.billable_hours_a_day(tmp_date)
-            billable_hours.append(bh)
-        else:
-            billable_hours.append(0)
         labels += tmp_date.strftime("%d") + "|"
         tmp_date += delta
         if current_month != tmp_date.month:
@@ -310,7 +363,7 @@ def chart_values(username_list, from_date, to_date, request_user):
         values['axis_range'] = 'chxp=' + idx.strip(',')
         #values['extra'] = 'chm=D,FF89F9,1,0,3,1'
 
-    if __enough_perms(request_user):
+    if enough_perms:
         values['chco'] = '4d89f9,c6d9fd'
     else:
         values['chco'] = '4d89f9'
@@ -538,9 +591,12 @@ def eff_client_summary_period(request):
 
 @login_required
 @user_passes_test(lambda u: __enough_perms_or_client(u), login_url='/accounts/login/')
+@__if_data_changed(__summary_scope)
+@csrf_response_exempt
 def eff_client_summary(request, company_slug=None):
     """
-    Renders a client's account summary.
+    Renders a client's account summary. Its forms carry their csrf tokens, so
+    CsrfResponseMiddleware does not rewrite it (dropping its ETag).
     """
     user = request.user
     try:
@@ -707,15 +763,14 @@ def eff(request):
             object_list = UserProfile.objects.filter(user__in=users)
         else:
             object_list = UserProfile.objects.all()
+        object_list = object_list.select_related('user')
 
-        data_list = [Data(o, from_date, to_date) for o in object_list]
+        stats = TimeLog.period_stats([o.user_id for o in object_list],
+                                     from_date, to_date)
+        data_list = [Data(o, from_date, to_date, stats[o.user_id])
+                     for o in object_list]
 
-        wh, lh, bh = 0, 0, 0
-        for d in data_list:
-            wh += d.worked_hours
-            lh += d.loggable_hours
-            bh += d.billable_hours
-        context['total'] = DataTotal(wh, lh, bh)
+        context['total'] = DataTotal.from_stats(stats.values())
         context['object_list'] = data_list
         context['from_date'] = from_date
         context['to_date'] = to_date
@@ -741,6 +796,7 @@ def eff(request):
 
 @login_required
 @user_passes_test(__not_a_client)
+@__if_data_changed(__reports_scope)
 def eff_chart(request, username):
 
     if not (request.user.has_perm('eff.view_billable') and \
@@ -765,6 +821,7 @@ def eff_chart(request, username):
 
 @login_required
 @user_passes_test(__enough_perms, login_url='/accounts/login/')
+@__if_data_changed(__reports_scope)
 def eff_charts(request):
 
     context = __get_context(request)
@@ -834,6 +891,7 @@ def eff_charts(request):
 @login_required
 @user_passes_test(__not_a_client, login_url='/accounts/login/')
 @__enough_perms_or_follows
+@__if_data_changed(__reports_scope)
 def eff_report(request, user_name):
 
     context = __process_dates(request)
@@ -846,16 +904,13 @@ def eff_report(request, user_name):
         project = request.GET['project']
         context['project'] = project
 
-    # detailed log report
-    context['report'] = user.get_profile().report(from_date, to_date, project)
-
     if 'export' in request.GET:
         if request.GET['export'] == 'odt':
             if 'detailed' in request.GET:
-                basic = Template(source=None, filepath=os.path.join(cur_dir,
-                    '../templates/reporte_usuario_detallado.odt'))
-                report_data = format_report_data_user(context['report'], user,
-                    from_date, to_date, True)
+                basic = odt_template('reporte_usuario_detallado.odt')
+                report_data = format_report_data_user(
+                    user.get_profile().report(from_date, to_date, project),
+                    user, from_date, to_date, True)
                 basic_generated = basic.generate(o=report_data).render()
                 resp = HttpResponse(basic_generated.getvalue(),
                     mimetype='application/vnd.oasis.opendocument.text')
@@ -864,8 +919,7 @@ def eff_report(request, user_name):
                 resp['Content-Disposition'] = cd
                 return resp
             else:
-                basic = Template(source=None, filepath=os.path.join(cur_dir,
-                    '../templates/reporte_usuario.odt'))
+                basic = odt_template('reporte_usuario.odt')
                 report_by_project = list(TimeLog.get_summary_per_project(
                     user.get_profile(), from_date, to_date, True))
                 report_by_project.sort(cmp=lambda (x0, x1, x2, x3, x4),
@@ -888,30 +942,26 @@ def eff_report(request, user_name):
                 resp['Content-Disposition'] = cd
                 return resp
         elif request.GET['export'] == 'csv':
-            response = HttpResponse(mimetype='text/csv')
             if 'detailed' in request.GET:
-                cd = 'attachment; filename=reverse_billing_%s_%s_%s_logs.csv' %\
-                    (user_name, from_date, to_date, )
-                response['Content-Disposition'] = cd
-                report_data = format_report_data_user(context['report'], user,
-                    from_date, to_date, True)
-                t = loader.get_template('csv/reporte_usuario_detallado.txt')
-                c = Context({'data': report_data['user_data']['hs_detail'], })
+                return __csv_response(
+                    user_detailed_csv_rows(user, from_date, to_date, project),
+                    'reverse_billing_%s_%s_%s_logs.csv' % (
+                        user_name, from_date, to_date, ))
             else:
-                cd = 'attachment; filename=reverse_billing_%s_%s_%s.csv' % (
-                    user_name, from_date, to_date, )
-                response['Content-Disposition'] = cd
                 report_by_project = list(TimeLog.get_summary_per_project(
                     user.get_profile(), from_date, to_date))
                 report_by_project.sort(cmp=lambda (x0, x1, x2, x3),
                     (y0, y1, y2, y3): cmp(x3, y3))
                 report_data = format_report_data_user(report_by_project, user,
                     from_date, to_date)
-                t = loader.get_template('csv/reporte_usuario.txt')
-                c = Context({'data': report_data['user_hours'], })
+                return __csv_response(
+                    ((d['project_name'], d['user_hs'])
+                     for d in report_data['user_hours']),
+                    'reverse_billing_%s_%s_%s.csv' % (
+                        user_name, from_date, to_date, ))
 
-            response.write(t.render(c))
-            return response
+    # detailed log report
+    context['report'] = user.get_profile().report(from_date, to_date, project)
 
     # report grouped by project
     report_by_project = list(TimeLog.get_summary_per_project(user.get_profile(),
@@ -949,28 +999,31 @@ def eff_report(request, user_name):
 @login_required
 @user_passes_test(__enough_perms, login_url='/accounts/login/')
 def eff_update_db(request):
+    """
+    Queues the update of the logs of every client from its external source,
+    run by the update worker. Returns the progress of the queued and the
+    last finished updates as JSON: the status is 'ok' if updates were
+    queued, 'wait' if they already were. With the 'full' parameter the
+    updates start on the first day of the previous month instead of the
+    last fetch.
+    """
+    n_queued = UpdateJob.enqueue_all(requested_by=request.user,
+                                     full='full' in request.GET)
 
-    if not os.path.exists(settings.FLAG_FILE):
-        fd = open(settings.FLAG_FILE, 'w')
-        fd.write('%s' % date.today().strftime(settings.EFF_DATE_INPUT_FORMAT +\
-             ' %H:%M'))
-        fd.close()
-
-        # We use a cron job to run the code below now
-        # args = (settings.PYTHON_BINARY, settings.FETCH_EXTERNALS_PATH)
-        # process = Popen(args, stdout=open(settings.DEBUG_FILE, 'w'),
-        #                 close_fds=True)
+    jobs = UpdateJob.objects.select_related('source', 'client')
+    running = jobs.filter(status__in=(UpdateJob.PENDING,) + UpdateJob.RUNNING)
+    last_update = running.order_by('created')[:1] or jobs[:1]
+    finished = jobs.exclude(status__in=(UpdateJob.PENDING,) +
+                            UpdateJob.RUNNING)[:20]
 
-        response_data = dict(status='ok')
-        return HttpResponse(simplejson.dumps(response_data),
-                            mimetype='application/json')
-    else:
-        fd = open(settings.FLAG_FILE, 'r')
-        time = fd.readline()
-        fd.close()
-        response_data = dict(status='wait', last_update=('%s' % time))
-        return HttpResponse(simplejson.dumps(response_data),
-                            mimetype='application/json')
+    response_data = dict(
+        status=n_queued and 'ok' or 'wait',
+        last_update=last_update and last_update[0].created.strftime(
+            settings.EFF_DATE_INPUT_FORMAT + ' %H:%M') or '',
+        jobs=[job.as_dict() for job in running],
+        finished=[job.as_dict() for job in finished])
+    return HttpResponse(simplejson.dumps(response_data),
+                        mimetype='application/json')
 
 
 @login_required
@@ -1002,6 +1055,7 @@ def eff_administration(request):
 
 @login_required
 @user_passes_test(__enough_perms, login_url='/accounts/login/')
+@__if_data_changed(__reports_scope)
 def eff_client_report(request, client_slug):
 
     client = get_object_or_404(Client, slug=client_slug)
@@ -1012,8 +1066,7 @@ def eff_client_report(request, client_slug):
     if 'export' in request.GET:
         if request.GET['export'] == 'odt':
             if 'detailed' in request.GET:
-                basic = Template(source=None, filepath=os.path.join(cur_dir,
-                    '../templates/reporte_cliente_detallado.odt'))
+                basic = odt_template('reporte_cliente_detallado.odt')
                 report_by_project = dict(map(lambda x: x[0], client.report(
                     from_date, to_date, True)))
                 report_data = format_report_data(report_by_project, client,
@@ -1027,8 +1080,7 @@ def eff_client_report(request, client_slug):
                 resp['Content-Disposition'] = cd
                 return resp
             else:
-                basic = Template(source=None, filepath=os.path.join(cur_dir,
-                    '../templates/reporte_cliente.odt'))
+                basic = odt_template('reporte_cliente.odt')
                 report_by_project = dict(map(lambda x: x[0], client.report(
                     from_date, to_date, with_rates=True)))
                 report_data = format_report_data(report_by_project, client,
@@ -1041,30 +1093,22 @@ def eff_client_report(request, client_slug):
                 resp['Content-Disposition'] = cd
                 return resp
         elif request.GET['export'] == 'csv':
-            response = HttpResponse(mimetype='text/csv')
             if 'detailed' in request.GET:
-                cd = 'attachment; filename=billing_%s_%s_%s_logs.csv' % (
-                    client_slug, from_date, to_date, )
-                response['Content-Disposition'] = cd
-                report_by_project = dict(map(lambda x: x[0], client.report(
-                    from_date, to_date, True)))
-                report_data = format_report_data(report_by_project, client,
-                    from_date, to_date, True)
-                t = loader.get_template('csv/reporte_cliente_detallado.txt')
-                c = Context({'data': report_data['projects_users'], })
+                return __csv_response(
+                    client_detailed_csv_rows(client, from_date, to_date),
+                    'billing_%s_%s_%s_logs.csv' % (
+                        client_slug, from_date, to_date, ))
             else:
-                cd = 'attachment; filename=billing_%s_%s_%s.csv' % (
-                    client_slug, from_date, to_date, )
-                response['Content-Disposition'] = cd
                 report_by_project = dict(map(lambda x: x[0], client.report(
                     from_date, to_date)))
                 report_data = format_report_data(report_by_project, client,
                     from_date, to_date)
-                t = loader.get_template('csv/reporte_cliente.txt')
-                c = Context({'data': report_data['projects_users'], })
-
-            response.write(t.render(c))
-            return response
+                return __csv_response(
+                    ((d['project_name'], u['full_name'], u['hs'])
+                     for d in report_data['projects_users']
+                     for u in d['users']),
+                    'billing_%s_%s_%s.csv' % (
+                        client_slug, from_date, to_date, ))
 
     context['report_by_project'] = client.report(from_date, to_date, True)
     context['clientname'] = client.name
@@ -1267,8 +1311,7 @@ def eff_fixed_price_client_reports(request):
                     today.strftime("%m"))
                 )
 
-            basic = Template(source=None, filepath=os.path.join(cur_dir,
-                '../templates/reporte_cliente_precio_fijo.odt'))
+            basic = odt_template('reporte_cliente_precio_fijo.odt')
             basic_generated = basic.generate(o=reverse_billing).render()
             resp = HttpResponse(basic_generated.getvalue(),
                 mimetype='application/vnd.oasis.opendocument.text')
@@ -1,10 +1,13 @@
 <!--
 function update_db() {
     $.getJSON("{% url eff_site.eff.views.eff_update_db %}",function(json){
+        var progress = $.map(json.jobs, function(job) {
+            return job.source + ', ' + job.client + ': ' + job.status;
+        }).join('\n');
         if (json.status == 'ok') {
-            alert('Por favor espere, se está procesando el pedido');
+            alert('Por favor espere, se está procesando el pedido\n' + progress);
         } else {
-            alert('Por favor espere, el ultimo pedido fue hecho: ' + json.last_update);
+            alert('Por favor espere, el ultimo pedido fue hecho: ' + json.last_update + '\n' + progress);
         }
     });
 }
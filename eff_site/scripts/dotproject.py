@@ -16,52 +16,262 @@
 # You should have received a copy of the GNU General Public License
 # along with Eff.  If not, see <http://www.gnu.org/licenses/>.
 
-import MySQLdb
+
+from collections import OrderedDict
+from threading import Lock
 
 from eff_site.eff.utils import EffCsvWriter
 from django.conf import settings
 
 
 class DotProject(object):
+    """
+    Reads the task logs of a dotProject data base, through a connection
+    shared by all the fetches of the process and reopened when it is lost.
+    """
     _connection = None
-    _cursor = None
+    # Held while the shared connection streams the logs of a fetch, the
+    # fetches run meanwhile open connections of their own
+    _lock = Lock()
+    # Number of rows read from the server at a time
+    BATCH_SIZE = 1000
+    # Parameter placeholder of the driver
+    PARAM = '%s'
+
+    @classmethod
+    def _driver(cls):
+        # Only needed when fetching from dotProject
+        import MySQLdb
+        return MySQLdb
 
-    def __init__(self):
-        if self._connection is None:
-            type(self).start_db_connection()
+    @classmethod
+    def _connect(cls):
+        return cls._driver().connect(db=cls.DB,
+                                     user=cls.DB_USER,
+                                     passwd=cls.PASSWD,
+                                     host=cls.HOST,
+                                     port=cls.PORT,
+                                     charset=cls.CHARSET)
+
+    @classmethod
+    def _cursor(cls, connection):
+        # Server side cursor, the rows are streamed instead of being loaded
+        # all at once by the driver
+        from MySQLdb.cursors import SSCursor
+        return connection.cursor(SSCursor)
+
+    @classmethod
+    def _execute(cls, sql, params):
+        """
+        Returns a cursor with sql executed. If the connection was lost it is
+        reopened and sql executed again.
+        """
+        driver = cls._driver()
+        for retry in (True, False):
+            if cls._connection is None:
+                cls._connection = cls._connect()
+            try:
+                cursor = cls._cursor(cls._connection)
+                cursor.execute(sql, params)
+                return cursor
+            except (driver.OperationalError, driver.InterfaceError):
+                try:
+                    cls._connection.close()
+                except Exception:
+                    pass
+                cls._connection = None
+                if not retry:
+                    raise
 
     @classmethod
-    def start_db_connection(cls):
-        cls._connection = MySQLdb.connect(db=cls.DB,
-                                          user=cls.DB_USER,
-                                          passwd=cls.PASSWD,
-                                          host=cls.HOST,
-                                          port=cls.PORT,
-                                          charset=cls.CHARSET)
-        cls._cursor = cls._connection.cursor()
+    def _open(cls, sql, params):
+        """
+        Returns a cursor with sql executed, and the function that releases
+        its connection once the cursor is closed. The shared connection is
+        used if it is free, else (it is streaming the logs of another
+        fetch) a connection of its own is opened, and closed by release.
+        """
+        if cls._lock.acquire(False):
+            try:
+                return cls._execute(sql, params), cls._lock.release
+            except Exception:
+                cls._lock.release()
+                raise
+        connection = cls._connect()
+        try:
+            cursor = cls._cursor(connection)
+            cursor.execute(sql, params)
+        except Exception:
+            connection.close()
+            raise
+        return cursor, connection.close
 
     @classmethod
-    def get_logs(cls, client, from_date, to_date):
+    def get_logs(cls, ranges):
+        """
+        Returns an ordered dict mapping each company name in ranges to an
+        iterator of its logs between the (from_date, to_date) it is mapped
+        to, all of them read with a single query.
+
+        The logs are streamed from the open cursor, which keeps its
+        connection until all of them are read or all the iterators are
+        closed: the iterators are meant to be consumed in order, the logs of
+        the companies skipped over are kept in memory until their iterator
+        is consumed.
+        """
         # The "between X and Y" of mysql is very picky,
         # at least in dates, if Y is Year-month-day-00:00,
         # then it will not pick up logs that were made on
         # _day_
-        to_date = to_date.replace(hour=23, minute=59, second=59, microsecond=0)
-        from_date = str(from_date)
-        to_date = str(to_date)
-        cls._cursor.execute(
-            "SELECT task_log_date, project_short_name, "
-            "users.user_username, task_log_hours, "
-            "task_log_name, task_log_description "
-            "FROM task_log, users, tasks, projects, companies "
-            "WHERE task_log_date BETWEEN %s AND %s "
-            "AND task_log.task_log_creator=users.user_id "
-            "AND tasks.task_project=projects.project_id "
-            "AND tasks.task_id = task_log.task_log_task "
-            "AND companies.company_name=%s "
-            "AND companies.company_id = projects.project_company",
-            (from_date, to_date, client))
-        return cls._cursor.fetchall()
+        companies = sorted(ranges)
+        where, params = [], []
+        for company in companies:
+            from_date, to_date = ranges[company]
+            where.append("(companies.company_name = %(p)s "
+                         "AND task_log_date BETWEEN %(p)s AND %(p)s)")
+            params += [company, str(from_date), str(to_date.replace(
+                hour=23, minute=59, second=59, microsecond=0))]
+        # The logs come in the order of the companies, so each one is read
+        # just once
+        order = ["WHEN %(p)s THEN " + str(i) for i in range(len(companies))]
+        sql = (("SELECT companies.company_name, task_log_date, "
+                "project_short_name, users.user_username, task_log_hours, "
+                "task_log_name, task_log_description "
+                "FROM task_log, users, tasks, projects, companies "
+                "WHERE (" + " OR ".join(where) + ") "
+                "AND task_log.task_log_creator=users.user_id "
+                "AND tasks.task_project=projects.project_id "
+                "AND tasks.task_id = task_log.task_log_task "
+                "AND companies.company_id = projects.project_company "
+                "ORDER BY CASE companies.company_name " + " ".join(order) +
+                " END, task_log_date") % {'p': cls.PARAM})
+        params += companies
+
+        cursor, release = cls._open(sql, params)
+        logs = _CompanyLogs(cursor, companies, cls.BATCH_SIZE, release)
+        return OrderedDict((company, logs.logs(company))
+                           for company in companies)
+
+    @classmethod
+    def fetch_logs(cls, source, client, author, from_date, to_date):
+        return from_date, to_date, cls.get_logs(
+            {client.external_id: (from_date, to_date)})[client.external_id]
+
+    @classmethod
+    def fetch_source_logs(cls, source, author, ranges):
+        """
+        Fetches the logs of several clients of source with a single query.
+
+        @param ranges: maps each client to the (from_date, to_date) of its
+        logs to fetch
+        @type ranges: dict
+
+        @return: ordered dict mapping each client to (from_date, to_date,
+        logs), in the order its logs are best consumed
+        """
+        clients = dict((client.external_id, client) for client in ranges)
+        logs = cls.get_logs(dict((client.external_id, dates)
+                                 for (client, dates) in ranges.items()))
+        return OrderedDict((clients[company], ranges[clients[company]] +
+                            (company_logs,))
+                           for (company, company_logs) in logs.items())
+
+
+class _CompanyLogs(object):
+    """
+    Logs read through a cursor, ordered by company, handed out to an
+    iterator per company. Once all of them are read, or all the iterators
+    are closed, the cursor is closed and release called.
+    """
+
+    def __init__(self, cursor, companies, batch_size, release):
+        self._cursor = cursor
+        self._batch_size = batch_size
+        self._release = release
+        self._rank = dict((company, i) for (i, company) in
+                          enumerate(companies))
+        # The logs read of the companies whose iterator did not start
+        self._pending = dict((company, []) for company in companies)
+        self._open = len(companies)
+        self._batch = []
+        self._closed = False
+
+    def _peek(self):
+        """ Returns the next row without consuming it, None after the last. """
+        if not self._batch and not self._closed:
+            self._batch = list(reversed(
+                self._cursor.fetchmany(self._batch_size)))
+            if not self._batch:
+                self._close_cursor()
+        return self._batch and self._batch[-1] or None
+
+    def _close_cursor(self):
+        if not self._closed:
+            self._closed = True
+            self._batch = []
+            try:
+                self._cursor.close()
+            finally:
+                self._release()
+
+    def close(self):
+        """ Closes the cursor, the logs not read yet are dropped. """
+        self._pending = {}
+        self._close_cursor()
+
+    def _done(self):
+        self._open -= 1
+        if not self._open:
+            self.close()
+
+    def _logs(self, company):
+        for log in self._pending.pop(company, ()):
+            yield log
+        while True:
+            row = self._peek()
+            if row is None:
+                break
+            if row[0] in self._pending and \
+                    self._rank[row[0]] > self._rank[company]:
+                # Left for the iterator of the company
+                break
+            self._batch.pop()
+            if row[0] == company:
+                yield row[1:]
+            elif row[0] in self._pending:
+                self._pending[row[0]].append(row[1:])
+
+    def logs(self, company):
+        """ Returns the iterator of the logs of company. """
+        return _Logs(self, company)
+
+
+class _Logs(object):
+    """
+    Iterator of the logs of a company, see _CompanyLogs. It must be read to
+    the end or closed, even if it is not read at all.
+    """
+
+    def __init__(self, company_logs, company):
+        self._company_logs = company_logs
+        self._rows = company_logs._logs(company)
+        self._closed = False
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        try:
+            return self._rows.next()
+        except StopIteration:
+            self.close()
+            raise
+
+    def close(self):
+        if not self._closed:
+            self._closed = True
+            self._rows.close()
+            self._company_logs._done()
 
 
 class DotProjectSource(DotProject):
@@ -80,13 +290,15 @@ class DotProjectSource(DotProject):
     CHARSET = settings.DOTPROJECT_DB_CHARSET
 
 
+fetch_logs = DotProjectSource.fetch_logs
+fetch_source_logs = DotProjectSource.fetch_source_logs
+
+
 def fetch_all(source, client, author, from_date, to_date, _file):
 
+    from_date, to_date, rows = fetch_logs(source, client, author, from_date,
+                                          to_date)
     writer = EffCsvWriter(source, client, author, _file,
                           from_date=from_date,
                           to_date=to_date)
-
-    for row in DotProjectSource().get_logs(client.external_id,
-                                           from_date,
-                                           to_date):
-        writer.write(row)
+    writer.writerows(rows)
@@ -26,21 +26,311 @@ sys.path.insert(1, path)
 os.environ['DJANGO_SETTINGS_MODULE'] = 'eff_site.settings'
 
 from datetime import datetime
-from dateutil.relativedelta import relativedelta
+from itertools import chain
+from threading import Thread
+from time import time
+from Queue import Queue, Empty
+import traceback
 
-from eff_site.eff.utils import load_dump
-from eff_site.eff.models import ExternalSource, Client
+from eff_site.eff.utils import load_dump, load_logs, EffCsvWriter
+from eff_site.eff.models import ExternalSource, Client, FetchCheckpoint
 from eff_site import settings
+from django.db import connection
 
 from config import EXT_SRC_ASSOC
 
+# Number of fetches run at the same time
+FETCH_WORKERS = getattr(settings, 'FETCH_EXTERNALS_WORKERS', 4)
+# Keep an Eff csv copy of what is imported from each external source
+ARCHIVE_CSV = getattr(settings, 'FETCH_EXTERNALS_ARCHIVE_CSV', True)
+
+
+class FetchJob(object):
+    """
+    Fetch of the logs of a client from an external source and import of them.
+
+    The fetch (network bound) runs in a worker thread of run_jobs, while the
+    import to the data base runs in the thread of run_jobs, one job at a
+    time. status is one of 'pending', 'fetching', 'fetched', 'importing',
+    'done', 'empty' (nothing to import), 'unchanged' (the logs did not
+    change since the last import, which was skipped) or 'failed' (see error).
+
+    If the adapter has a fetch_logs(source, client, author, from_date,
+    to_date) function, returning the dates of the fetched logs and an
+    iterable of them, the logs are streamed to the importer and, if archive
+    is set, written to the csv file on the way. Otherwise the adapter
+    fetch_all writes the csv file, which is then imported.
+
+    After a successful import the FetchCheckpoint of the client is moved
+    forward to to_date. With skip_unchanged the days whose logs did not
+    change since they were last imported are not imported again (see
+    load_dump).
+    """
+
+    def __init__(self, source, client, author, from_date, to_date, adapter,
+                 archive=ARCHIVE_CSV, skip_unchanged=True):
+        self.source = source
+        self.client = client
+        self.author = author
+        self.from_date = from_date
+        self.to_date = to_date
+        # Module with the fetch_all(source, client, author, from_date,
+        # to_date, _file) function of the external source, and maybe the
+        # fetch_logs one
+        self.adapter = adapter
+        self.archive = archive and source.name != 'DotprojectMachinalis'
+        self.skip_unchanged = skip_unchanged
+        # Set by fetch, if the adapter streams the logs
+        self.rows = None
+
+        filename = "%s_%s_%s_%s.csv" % (source.name, client.name,
+                                        from_date.strftime("%Y%m%d"),
+                                        to_date.strftime("%Y%m%d"), )
+        self.filename = os.path.join(settings.FETCH_EXTERNALS_CSV_DIR,
+                                     filename.replace(' ', '_'))
+        self.status = 'pending'
+        self.error = None
+        self.fetch_seconds = None
+        self.import_seconds = None
+        self.stats = {}
+
+    def __unicode__(self):
+        return u'%s, %s' % (self.source.name, self.client.name)
+
+    def _fail(self):
+        self.status = 'failed'
+        self.error = traceback.format_exc()
+
+    def fetch(self):
+        started = time()
+        self.status = 'fetching'
+        try:
+            if hasattr(self.adapter, 'fetch_logs'):
+                self.from_date, self.to_date, self.rows = \
+                    self.adapter.fetch_logs(self.source, self.client,
+                                            self.author, self.from_date,
+                                            self.to_date)
+            else:
+                self._fetch_csv()
+        except Exception:
+            self._fail()
+        else:
+            self.status = 'fetched'
+        self.fetch_seconds = time() - started
+
+    @classmethod
+    def fetch_source(cls, jobs):
+        """
+        Fetches the jobs, all of them of the same source, with a single call
+        to the fetch_source_logs(source, author, ranges) function of their
+        adapter, where ranges maps each client to its (from_date, to_date).
+        It returns a dict mapping each client to (from_date, to_date, logs),
+        and the jobs are sorted (in place) in its order, for the adapters
+        that stream the logs of all the clients through a single cursor.
+        """
+        started = time()
+        first = jobs[0]
+        for job in jobs:
+            job.status = 'fetching'
+        try:
+            fetched = first.adapter.fetch_source_logs(
+                first.source, first.author,
+                dict((job.client, (job.from_date, job.to_date))
+                     for job in jobs))
+        except Exception:
+            for job in jobs:
+                job._fail()
+        else:
+            try:
+                order = list(fetched)
+                jobs.sort(key=lambda job: order.index(job.client))
+                for job in jobs:
+                    job.from_date, job.to_date, job.rows = \
+                        fetched[job.client]
+                    job.status = 'fetched'
+            except Exception:
+                for job in jobs:
+                    job._fail()
+                for from_date, to_date, rows in fetched.values():
+                    getattr(rows, 'close', lambda: None)()
+        for job in jobs:
+            job.fetch_seconds = time() - started
+
+    def _fetch_csv(self):
+        _file = open(self.filename, 'w')
+        try:
+            self.adapter.fetch_all(self.source, self.client, self.author,
+                                   self.from_date, self.to_date, _file)
+        finally:
+            _file.close()
+
+    def load(self):
+        if self.status == 'failed':
+            return
+        started = time()
+        self.status = 'importing'
+        try:
+            if self.rows is None:
+                self._load_csv()
+            else:
+                self._load_rows()
+            if self.status in ('done', 'empty', 'unchanged'):
+                FetchCheckpoint.advance(self.source.id, self.client.id,
+                                        self.to_date)
+        except Exception:
+            self._fail()
+        finally:
+            self.close()
+        self.import_seconds = time() - started
+
+    def close(self):
+        """
+        Releases the streamed rows not read, as the adapters may keep a
+        connection open for them until they are read or closed.
+        """
+        if self.rows is not None:
+            close = getattr(self.rows, 'close', None)
+            self.rows = ()
+            if close is not None:
+                close()
+
+    def _load_rows(self):
+        rows = iter(self.rows)
+        try:
+            first = rows.next()
+        except StopIteration:
+            # Nothing fetched, the logs already imported are kept
+            self.status = 'empty'
+            return
+        rows = chain([first], rows)
+        if self.archive:
+            rows = self._tee(rows)
+        load_logs(self.source, self.client, self.author, self.from_date,
+                  self.to_date, rows, is_api=True,
+                  skip_unchanged=self.skip_unchanged,
+                  stats=self.stats)
+        # Release the fetched data
+        self.rows = ()
+        self.status = self.stats.get('skipped') and 'unchanged' or 'done'
+
+    def _tee(self, rows):
+        """ Yields rows, writing them to the csv file on the way. """
+        _file = open(self.filename, 'w')
+        try:
+            writer = EffCsvWriter(self.source, self.client, self.author,
+                                  _file, from_date=self.from_date,
+                                  to_date=self.to_date)
+            # The rows are checked by the importer
+            writer.VALIDATE_ROWS = False
+            for row in rows:
+                writer.write(row)
+                yield row
+        finally:
+            _file.close()
+
+    def _load_csv(self):
+        n_lines = 0
+        for line in open(self.filename):
+            n_lines += 1
+
+        # Only the header was written
+        if n_lines <= 5:
+            os.unlink(self.filename)
+            self.status = 'empty'
+        else:
+            eff_import = open(self.filename)
+            try:
+                load_dump(eff_import, is_api=True,
+                          skip_unchanged=self.skip_unchanged,
+                          stats=self.stats)
+            finally:
+                eff_import.close()
+            if self.source.name == 'DotprojectMachinalis':
+                os.unlink(self.filename)
+            self.status = self.stats.get('skipped') and 'unchanged' or 'done'
+
+    def report(self):
+        line = u'%s: %s' % (self, self.status)
+        if self.fetch_seconds is not None:
+            line += u', fetched in %.2fs' % self.fetch_seconds
+        if self.import_seconds is not None:
+            line += u', imported in %.2fs' % self.import_seconds
+        if self.stats:
+            line += u' (%(added)d added, %(removed)d removed, ' \
+                    u'%(unchanged)d unchanged)' % self.stats
+        if self.error:
+            line += u'\n' + self.error
+        return line
+
+
+def get_adapter(source):
+    """ Returns the module that fetches the logs of source. """
+    src_mod_name = EXT_SRC_ASSOC[source.name]
+    return __import__('eff_site.scripts.%s' % src_mod_name,
+                      fromlist=['eff_site.scripts'])
+
+
+def run_jobs(jobs, workers=FETCH_WORKERS):
+    """
+    Fetches the jobs concurrently, with at most workers fetches at the same
+    time, and imports each of them (one at a time) as soon as it is fetched.
+    The jobs of a source whose adapter has a fetch_source_logs function are
+    fetched together, see FetchJob.fetch_source.
+    """
+    pending, fetched = Queue(), Queue()
+    by_source = {}
+    for job in jobs:
+        if hasattr(job.adapter, 'fetch_source_logs'):
+            key = (job.adapter, job.source.id)
+            if key not in by_source:
+                by_source[key] = []
+                pending.put(by_source[key])
+            by_source[key].append(job)
+        else:
+            pending.put([job])
+
+    def _worker():
+        try:
+            while True:
+                try:
+                    group = pending.get_nowait()
+                except Empty:
+                    break
+                if len(group) == 1:
+                    group[0].fetch()
+                else:
+                    FetchJob.fetch_source(group)
+                for job in group:
+                    fetched.put(job)
+        finally:
+            # The adapters may have used the data base from this thread
+            connection.close()
+
+    threads = [Thread(target=_worker)
+               for i in xrange(min(workers, pending.qsize()))]
+    for thread in threads:
+        thread.start()
+    for i in xrange(len(jobs)):
+        fetched.get().load()
+    for thread in threads:
+        thread.join()
+    return jobs
+
 
 def run():
     date_format = "%Y%m%d"
     args = sys.argv[1:]
+    full = '--full' in args
+    if full:
+        args.remove('--full')
 
     if not len(args) in (0, 3):
-        print "Usage: $ fetchall.py <source-name> <from-date> <to-date>"
+        print "Usage: $ fetchall.py [--full] [<source-name> <from-date> " \
+              "<to-date>]"
+        print "\tWithout dates each client is fetched from its last fetch " \
+              "(minus FETCH_EXTERNALS_OVERLAP_DAYS), or from the first day " \
+              "of the previous month if --full is given"
+        print "\tWith --full the unchanged days are imported too"
         sources_allowed = map(lambda e: e.name, ExternalSource.objects.all())
         sources_allowed.append(u'ALL')
         print "\tValues allowed for <source-name>: %s" % ' | '.join(
@@ -54,10 +344,8 @@ def run():
         to_date = datetime.strptime(args[2], date_format)
     else:
         source_name = "ALL"
-        today = datetime.today()
-        to_date = datetime(today.year, today.month, today.day)
-        from_date = datetime(to_date.year, to_date.month, 1) - \
-            relativedelta(months=1)
+        # Given by the checkpoint of each client
+        from_date, to_date = None, None
 
     if source_name == "ALL":
         sources = ExternalSource.objects.all()
@@ -71,37 +359,30 @@ def run():
     if not os.path.exists(settings.FETCH_EXTERNALS_CSV_DIR):
         os.makedirs(settings.FETCH_EXTERNALS_CSV_DIR)
 
+    jobs = []
     for source in sources:
 
         author = source.username or 'Eff Fetcher'
 
-        src_clients = Client.objects.filter(external_source=source)
-
-        src_mod_name = EXT_SRC_ASSOC[source.name]
-        src_mod = __import__('eff_site.scripts.%s' % src_mod_name,
-            fromlist=['eff_site.scripts'])
-
-        for client in src_clients:
-
-            filename = "%s_%s_%s_%s.csv" % (source.name, client.name,
-                from_date.strftime("%Y%m%d"),
-                                            to_date.strftime("%Y%m%d"), )
-            filename = os.path.join(settings.FETCH_EXTERNALS_CSV_DIR,
-                filename.replace(' ', '_'))
-            _file = open(filename, 'w')
+        src_mod = get_adapter(source)
 
-            src_mod.fetch_all(source, client, author, from_date, to_date, _file)
-
-            n_lines = len(open(filename).readlines())
-
-            if n_lines <= 5:
-                os.unlink(filename)
+        for client in Client.objects.filter(external_source=source):
+            if from_date is None:
+                job_range = [datetime(*d.timetuple()[:3]) for d in
+                             FetchCheckpoint.fetch_range(source.id, client.id,
+                                                         full=full)]
             else:
-                eff_import = open(filename)
-                load_res = load_dump(eff_import, is_api=True)
-                eff_import.close()
-                if source.name == 'DotprojectMachinalis':
-                    os.unlink(filename)
+                job_range = [from_date, to_date]
+            jobs.append(FetchJob(source, client, author, job_range[0],
+                                 job_range[1], src_mod,
+                                 skip_unchanged=not full))
+
+    started = time()
+    run_jobs(jobs)
+    for job in jobs:
+        print job.report().encode('utf-8')
+    print '%d jobs in %.2fs' % (len(jobs), time() - started)
+    return jobs
 
 if __name__ == '__main__':
     run()
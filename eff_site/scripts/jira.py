@@ -17,9 +17,11 @@
 # along with Eff.  If not, see <http://www.gnu.org/licenses/>.
 
 import csv
+import sys
 
-from StringIO import StringIO
 from datetime import datetime
+from threading import Thread, local
+from Queue import Queue, Empty
 
 import mechanize
 
@@ -36,105 +38,157 @@ class Jira(object):
                   'project_departments','project_types',
                   'project_implementation','project_state','timetrack_origin')
 
+    date_format = "%Y%m%d%H%M%S"
+
     def __init__(self, url, username, password,
-                 from_date=None, to_date=None, projects=None):
+                 from_date=None, to_date=None, projects=None,
+                 window_months=1, workers=4):
         self._url = url
         self._username = username
         self._password = password
         self._projects = projects
         self._from_date = from_date
         self._to_date = to_date
-
-    def _calculate_date_range(self, from_date, to_date):
+        # The range is fetched in windows of window_months months, at most
+        # workers of them at the same time
+        self._window_months = window_months
+        self._workers = workers
+        # Browser of each fetching thread, reused for all its windows
+        self._local = local()
+
+    def _windows(self, from_date, to_date):
         """
+        Returns the (startdate, enddate) windows, of window_months months
+        each, covering from from_date to to_date.
+
         >>> from jira import Jira
         >>> url, username, password = "", "", ""
         >>> from datetime import datetime
-        >>> f = datetime(2009, 9, 1)
-        >>> t = datetime(2010, 10, 14)
+        >>> f = datetime(2010, 9, 14)
+        >>> t = datetime(2010, 11, 1)
         >>> j = Jira(url, username, password, f, t)
-        >>> j._calculate_date_range(f, t)
-        (datetime.datetime(2009, 9, 1, 0, 0), datetime.datetime(2010, 11, 1, 0, 0))
-
-        >>> f = datetime(2009, 1, 12)
-        >>> t = datetime(2010, 9, 1)
-        >>> j._calculate_date_range(f, t)
-        (datetime.datetime(2009, 1, 1, 0, 0), datetime.datetime(2010, 10, 1, 0, 0))
-
-
-        >>> f = datetime(2009, 1, 10)
-        >>> t = datetime(2011, 1, 4)
-        >>> j._calculate_date_range(f, t)
-        (datetime.datetime(2009, 1, 1, 0, 0), datetime.datetime(2011, 2, 1, 0, 0))
-
-        >>> f = datetime(2009, 2, 10)
-        >>> t = datetime(2010, 3, 15)
-        >>> j._calculate_date_range(f, t)
-        (datetime.datetime(2009, 2, 1, 0, 0), datetime.datetime(2010, 4, 1, 0, 0))
+        >>> for window in j._windows(f, t):
+        ...     print window
+        (datetime.datetime(2010, 9, 1, 0, 0), datetime.datetime(2010, 10, 1, 0, 0))
+        (datetime.datetime(2010, 10, 1, 0, 0), datetime.datetime(2010, 11, 1, 0, 0))
+        (datetime.datetime(2010, 11, 1, 0, 0), datetime.datetime(2010, 12, 1, 0, 0))
+
+        >>> j = Jira(url, username, password, f, t, window_months=2)
+        >>> for window in j._windows(f, t):
+        ...     print window
+        (datetime.datetime(2010, 9, 1, 0, 0), datetime.datetime(2010, 11, 1, 0, 0))
+        (datetime.datetime(2010, 11, 1, 0, 0), datetime.datetime(2011, 1, 1, 0, 0))
         """
-
-        startdate = datetime(from_date.year, from_date.month, 1)
-        rd = relativedelta(to_date, startdate)
-        if rd.years > 0 or rd.months > 2:
-            year, month = to_date.year, to_date.month,
-            enddate = datetime(year, month, 1) + relativedelta(months=1)
-        else:
-            enddate = startdate + relativedelta(months=2)
-
-        return (startdate, enddate)
-
-    def fetch_data(self):
-        url, username, password = self._url, self._username, self._password
-
-        br = mechanize.Browser()
-        br.add_password(url, username, password)
-        br.set_handle_robots(False)
-        r = br.open(url)
+        windows = []
+        start = datetime(from_date.year, from_date.month, 1)
+        while start <= to_date:
+            end = start + relativedelta(months=self._window_months)
+            windows.append((start, end))
+            start = end
+        return windows
+
+    def _browser(self):
+        browser = getattr(self._local, 'browser', None)
+        if browser is None:
+            browser = mechanize.Browser()
+            browser.add_password(self._url, self._username, self._password)
+            browser.set_handle_robots(False)
+            self._local.browser = browser
+        return browser
+
+    def _fetch_window(self, startdate, enddate):
+        """
+        Returns the (timetrack_id, log) pairs logged between startdate and
+        enddate, parsed as the response is read.
+        """
+        br = self._browser()
+        br.open(self._url)
         br.select_form(nr=0)
 
-        startdate, enddate = self._calculate_date_range(self._from_date,
-                                                        self._to_date)
-
-        from_date = startdate.strftime("%Y%m%d%H%M%S")
-        to_date = enddate.strftime("%Y%m%d%H%M%S")
-
         # values accepted are for example:
         # 20060101000000
         # 20070901000000
         # 20090601000000
-        br["startdate"] = (from_date,)
-        br["enddate"] = (to_date,)
-        r = br.submit()
-        self._data = r.read()
+        br["startdate"] = (startdate.strftime(self.date_format),)
+        br["enddate"] = (enddate.strftime(self.date_format),)
+        response = br.submit()
+        try:
+            return list(self._parse(iter(response.readline, '')))
+        finally:
+            response.close()
+            # The browser is reused, do not keep the responses
+            br.clear_history()
+
+    def fetch_data(self):
+        windows = self._windows(self._from_date, self._to_date)
+        results = [None] * len(windows)
+        errors = []
+        pending = Queue()
+        for i, window in enumerate(windows):
+            pending.put((i, window))
+
+        def _worker():
+            while not errors:
+                try:
+                    i, window = pending.get_nowait()
+                except Empty:
+                    break
+                try:
+                    results[i] = self._fetch_window(*window)
+                except Exception:
+                    errors.append(sys.exc_info())
+
+        threads = [Thread(target=_worker)
+                   for i in xrange(min(self._workers, len(windows)))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        if errors:
+            raise errors[0][0], errors[0][1], errors[0][2]
+        self._data = results
 
     def set_dates(self, from_date, to_date):
         self._from_date = from_date
         self._to_date = to_date
 
+    def _parse(self, lines):
+        readable_csv = csv.reader(line.decode('latin1').encode('utf-8')
+                                  for line in lines)
+        try:
+            csv_headers = readable_csv.next()
+        except StopIteration:
+            return
+        from_date, to_date = self._from_date.date(), self._to_date.date()
+
+        for values in readable_csv:
+            line = dict(zip(csv_headers, values))
+            t_date = datetime.strptime(line['timetrack_vtime'],
+                                       '%Y-%m-%d %H:%M:%S').date()
+            # The windows are whole months
+            if not from_date <= t_date <= to_date:
+                continue
+            if not line['project_name'].split():
+                continue
+            project_external_id = line['project_name'].split()[0]
+            t_proj = project_external_id
+
+            if self._projects and (t_proj not in self._projects):
+                continue
+
+            t_line = (t_date, t_proj, line['person_loginname'],
+                      line['timetrack_volume'],
+                      line['project_types'], line['timetrack_description'])
+            yield line['timetrack_id'], t_line
+
     def _process_data(self):
-        contents = self._data.decode('latin1').encode('utf-8')
-        readable_csv = csv.reader(StringIO(contents))
-        csv_headers = readable_csv.next()
-
-        while True:
-            try:
-                line = dict(zip(csv_headers, readable_csv.next()))
-                t_date = datetime.strptime(line['timetrack_vtime'],
-                                           '%Y-%m-%d %H:%M:%S').date()
-                if not line['project_name'].split():
-                    continue
-                project_external_id = line['project_name'].split()[0]
-                t_proj = project_external_id
-
-                if self._projects and (t_proj not in self._projects):
-                    continue
-
-                t_line = (t_date, t_proj, line['person_loginname'],
-                          line['timetrack_volume'],
-                          line['project_types'], line['timetrack_description'])
-                yield t_line
-            except StopIteration:
-                break
+        # A log at the edge of two windows is returned by both of them
+        seen = set()
+        for window in self._data:
+            for timetrack_id, t_line in window:
+                if timetrack_id not in seen:
+                    seen.add(timetrack_id)
+                    yield t_line
 
     def write_csv(self, writer=None):
 
@@ -147,12 +201,10 @@ class Jira(object):
             fd = open('tutos_output.csv', 'w')
             csv_writer = csv.writer(fd)
 
-        for row in self._process_data():
-            csv_writer.writerow(row)
+        csv_writer.writerows(self._process_data())
 
 
-def fetch_all(source, client, author, from_date, to_date, _file):
-    from eff_site.eff.utils import EffCsvWriter
+def fetch_logs(source, client, author, from_date, to_date):
 
     if not (source.fetch_url and source.username and source.password):
         # This error is raised because the ExternalSource was created
@@ -162,10 +214,18 @@ def fetch_all(source, client, author, from_date, to_date, _file):
     j = Jira(source.fetch_url, source.username, source.password,
              from_date, to_date)
     j.fetch_data()
+    return from_date, to_date, j._process_data()
+
+
+def fetch_all(source, client, author, from_date, to_date, _file):
+    from eff_site.eff.utils import EffCsvWriter
+
+    from_date, to_date, rows = fetch_logs(source, client, author, from_date,
+                                          to_date)
     writer = EffCsvWriter(source, client, author, _file,
                           from_date=from_date,
                           to_date=to_date)
-    j.write_csv(writer=writer)
+    writer.writerows(rows)
 
 
 if __name__ == '__main__':
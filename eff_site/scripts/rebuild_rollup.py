@@ -0,0 +1,52 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright 2009 - 2011 Machinalis: http://www.machinalis.com/
+#
+# This file is part of Eff.
+#
+# Eff is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Eff is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Eff.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import sys
+import os
+
+path = os.path.normpath(os.path.join(os.path.dirname(__file__), '..', '..'))
+sys.path.insert(1, path)
+os.environ['DJANGO_SETTINGS_MODULE'] = 'eff_site.settings'
+
+from datetime import datetime
+
+from eff_site.eff.models import DailyHours
+
+
+def run():
+    date_format = "%Y%m%d"
+    args = sys.argv[1:]
+
+    if not len(args) in (0, 2):
+        print "Usage: $ rebuild_rollup.py [<from-date> <to-date>]"
+        print "\tWithout dates the whole daily rollup is rebuilt"
+        print "\tDate format: %s ; example: 20100819" % date_format
+        sys.exit(0)
+
+    from_date, to_date = None, None
+    if len(args) == 2:
+        from_date = datetime.strptime(args[0], date_format).date()
+        to_date = datetime.strptime(args[1], date_format).date()
+
+    DailyHours.rebuild(from_date, to_date)
+    print "%d daily rows in the rollup" % DailyHours.objects.count()
+
+if __name__ == '__main__':
+    run()
@@ -32,7 +32,7 @@ def hour_report_last_week():
             receive_report_email=True
         ).exclude(
             user_type=UserProfile.KIND_CLIENT
-        )
+        ).select_related('user', 'calendar')
     for userprofile in userprofiles:
         _send_report_by_email(userprofile, project=None)
 
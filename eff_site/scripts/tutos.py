@@ -22,8 +22,10 @@ import sys
 from StringIO import StringIO
 from datetime import datetime
 
+from dateutil.relativedelta import relativedelta
+
 from zope.testbrowser.browser import Browser
-from eff_site.eff.utils import EffCsvWriter
+from eff_site.eff.utils import EffCsvWriter, debug, WARNING
 
 
 class Tutos(object):
@@ -32,13 +34,74 @@ class Tutos(object):
                   'date,hours,description,worker,state,'
                   'project_name, proyect_type, bogus\n')
 
-    def __init__(self, url, username, password, projects=None):
+    date_format = "%Y%m%d%H%M%S"
+
+    def __init__(self, url, username, password, projects=None,
+                 from_date=None, to_date=None):
         self._url = url
         self._username = username
         self._password = password
         self._projects = projects
+        self._from_date = from_date
+        self._to_date = to_date
+
+    def _month_chunks(self, from_date, to_date, start_dates, end_dates):
+        """
+        Returns the (startdate, enddate, first, last) chunks of the months
+        from the one of from_date to the one of to_date: the startdate and
+        enddate options to submit, and the first and last days of the logs
+        kept from them. The first and last months may be partial, months
+        outside of the options offered are fetched from the nearest ones.
+        Months with no options around them are skipped with a warning.
+
+        >>> from tutos import Tutos
+        >>> t = Tutos("", "", "")
+        >>> start_dates = ['20101001000000', '20101101000000',
+        ...                '20101201000000']
+        >>> end_dates = ['20101101000000', '20101201000000', '20101215000000']
+        >>> for chunk in t._month_chunks(datetime(2010, 10, 20),
+        ...                              datetime(2010, 12, 18),
+        ...                              start_dates, end_dates):
+        ...     print chunk
+        ('20101001000000', '20101101000000', datetime.date(2010, 10, 20), \
+datetime.date(2010, 10, 31))
+        ('20101101000000', '20101201000000', datetime.date(2010, 11, 1), \
+datetime.date(2010, 11, 30))
+        ('20101201000000', '20101215000000', datetime.date(2010, 12, 1), \
+datetime.date(2010, 12, 18))
+        """
+        start_dates = sorted(start_dates)
+        end_dates = sorted(end_dates)
+        chunks = []
+        start = datetime(from_date.year, from_date.month, 1)
+        while start <= to_date:
+            end = start + relativedelta(months=1)
+            month_start = start.strftime(self.date_format)
+            month_end = end.strftime(self.date_format)
+            # The latest start before the month, or the first one if the
+            # history of Tutos begins within it
+            starts = ([d for d in start_dates if d <= month_start][-1:] or
+                      [d for d in start_dates[:1] if d < month_end])
+            # The earliest end after the month, or the last one if the
+            # month is not over yet
+            ends = ([d for d in end_dates if d >= month_end][:1] or
+                    [d for d in end_dates[-1:] if d > month_start])
+            if starts and ends:
+                chunks.append((starts[0], ends[0],
+                               max(start, from_date).date(),
+                               min(end - relativedelta(days=1),
+                                   to_date).date()))
+            else:
+                debug('Tutos has no logs from %s to %s, skipped',
+                      start.date(), end.date(), level=WARNING)
+            start = end
+        return chunks
 
     def fetch_data(self):
+        """
+        Fetches the logs between the from_date and to_date given, one month
+        at a time, or the whole history if they were not given.
+        """
         url, username, password = self._url, self._username, self._password
 
         login_url = '/tutos/php/bookinginserter/login.php'
@@ -51,39 +114,68 @@ class Tutos(object):
         browser.getForm(action=login_url).submit()
 
         browser.getLink(url='showteamhours.php').click()
-        start_date_value = browser.getControl(name='startdate').options[0]
-        browser.getControl(name='startdate').value = [start_date_value]
-        end_date_value = browser.getControl(name='enddate').options[-1]
-        browser.getControl(name='enddate').value = [end_date_value]
-        browser.getForm(action=showteamhours_url).submit()
-
-        self._from_date = start_date_value
-        self._to_date = end_date_value
-        self._data = browser.contents
+        form_url = browser.url
+        start_dates = browser.getControl(name='startdate').options
+        end_dates = browser.getControl(name='enddate').options
+
+        if self._from_date is None or self._to_date is None:
+            self._from_date = datetime.strptime(start_dates[0],
+                                                self.date_format)
+            self._to_date = datetime.strptime(end_dates[-1], self.date_format)
+            chunks = [(start_dates[0], end_dates[-1], self._from_date.date(),
+                       self._to_date.date())]
+        else:
+            chunks = self._month_chunks(self._from_date, self._to_date,
+                                        start_dates, end_dates)
+
+        self._data = []
+        for start, end, first, last in chunks:
+            if self._data:
+                browser.open(form_url)
+            browser.getControl(name='startdate').value = [start]
+            browser.getControl(name='enddate').value = [end]
+            browser.getForm(action=showteamhours_url).submit()
+            self._data.append((browser.contents, first, last))
 
     def get_dates(self):
-        if hasattr(self, '_from_date') and hasattr(self, '_to_date'):
-            return self._from_date, self._to_date
+        if self._from_date is not None and self._to_date is not None:
+            return (self._from_date.strftime(self.date_format),
+                    self._to_date.strftime(self.date_format))
         return None
 
-    def _process_data(self):
-        contents = self._data.decode('latin1').encode('utf-8')
-
+    def _lines(self, contents):
+        """ Yields the lines of a fetched chunk, converted to utf-8. """
         # Tutos doesn't escape quotes from the data that can contain
         # quotes (such as the log description), so you can't read it as a csv :(
         # We made a case-by-case cleanup. Stupid, but effective.
         old = '"Set error:"is gereserveerd, niet met onderstreepteken zou mo"'
         new = '"Set error: is gereserveerd, niet met onderstreepteken zou mo"'
-        contents = contents.replace(old, new)
+        for line in StringIO(contents):
+            yield line.decode('latin1').encode('utf-8').replace(old, new)
 
-        readable_csv = csv.reader(StringIO(contents))
-        csv_headers = readable_csv.next()
+    def _process_data(self):
+        # Each chunk is parsed line by line, and dropped once parsed
+        while self._data:
+            for row in self._process_chunk(*self._data.pop(0)):
+                yield row
+
+    def _process_chunk(self, contents, from_date, to_date):
+        """ Yields the logs of a chunk between from_date and to_date. """
+        readable_csv = csv.reader(self._lines(contents))
+        try:
+            csv_headers = readable_csv.next()
+        except StopIteration:
+            return
 
         while True:
             try:
                 line = dict(zip(csv_headers, readable_csv.next()))
                 t_date = datetime.strptime(line['timetrack_vtime'],
                                            '%Y-%m-%d %H:%M:%S').date()
+                # The chunks are whole months, or more around the first and
+                # last ones
+                if not from_date <= t_date <= to_date:
+                    continue
                 if not line['project_name'].split():
                     continue
                 project_external_id = line['project_name'].split()[0]
@@ -110,26 +202,29 @@ class Tutos(object):
             fd = open('tutos_output.csv', 'w')
             csv_writer = csv.writer(fd)
 
-        for row in self._process_data():
-            csv_writer.writerow(row)
+        csv_writer.writerows(self._process_data())
 
 
-def fetch_all(source, client, author, from_date, to_date, _file):
+def fetch_logs(source, client, author, from_date, to_date):
 
     if not (source.fetch_url and source.username and source.password):
         raise ValueError("The source in the db is missing information")
 
-    tutos = Tutos(source.fetch_url, source.username, source.password)
+    tutos = Tutos(source.fetch_url, source.username, source.password,
+                  from_date=from_date, to_date=to_date)
     tutos.fetch_data()
-    f, t = tutos.get_dates()
 
-    from_date = datetime.strptime(f, "%Y%m%d%H%M%S")
-    to_date = datetime.strptime(t, "%Y%m%d%H%M%S")
+    return from_date, to_date, tutos._process_data()
+
+
+def fetch_all(source, client, author, from_date, to_date, _file):
 
+    from_date, to_date, rows = fetch_logs(source, client, author, from_date,
+                                          to_date)
     writer = EffCsvWriter(source, client, author, _file,
                           from_date=from_date,
                           to_date=to_date)
-    tutos.write_csv(writer=writer)
+    writer.writerows(rows)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,192 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright 2009 - 2011 Machinalis: http://www.machinalis.com/
+#
+# This file is part of Eff.
+#
+# Eff is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Eff is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Eff.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import sys
+import os
+
+path = os.path.normpath(os.path.join(os.path.dirname(__file__), '..', '..'))
+sys.path.insert(1, path)
+os.environ['DJANGO_SETTINGS_MODULE'] = 'eff_site.settings'
+
+from datetime import datetime
+from socket import gethostname
+from threading import Thread, Event
+import signal
+import time
+import traceback
+
+from eff_site.eff.models import UpdateJob, FetchLease
+from eff_site.eff.utils import debug, ERROR, WARNING
+from eff_site.scripts.fetch_all import FetchJob, get_adapter, FETCH_WORKERS
+from eff_site import settings
+from django.db import connection, transaction, reset_queries
+
+# Seconds a worker holds the lease of the logs it is updating
+LEASE_SECONDS = getattr(settings, 'FETCH_EXTERNALS_LEASE_SECONDS', 30 * 60)
+# Seconds between the renewals of the lease while a job runs
+HEARTBEAT_SECONDS = LEASE_SECONDS / 3
+# Seconds an idle worker waits before looking for new jobs
+POLL_SECONDS = getattr(settings, 'FETCH_EXTERNALS_POLL_SECONDS', 2)
+
+
+class LeaseHeartbeat(Thread):
+    """
+    Renews the lease of the logs of a running job every interval seconds,
+    calling renew, so a fetch longer than the lease does not let another
+    worker take the job. lost is set once renew fails (returns False).
+    """
+
+    def __init__(self, renew, interval=HEARTBEAT_SECONDS):
+        Thread.__init__(self)
+        self.daemon = True
+        self.renew = renew
+        self.interval = interval
+        self.stopping = Event()
+        self.lost = Event()
+
+    def run(self):
+        try:
+            while not self.stopping.wait(self.interval):
+                try:
+                    held = self.renew()
+                    transaction.commit_unless_managed()
+                except Exception:
+                    # Retried on the next beat, the lease may last until then
+                    debug('%s: %s', self.name, traceback.format_exc(),
+                          level=ERROR)
+                    continue
+                if not held:
+                    self.lost.set()
+                    break
+        finally:
+            connection.close()
+
+    def stop(self):
+        self.stopping.set()
+        self.join()
+
+
+def run_job(job, owner, adapter=None):
+    """
+    Fetches and imports the logs of job, claimed by owner (see
+    UpdateJob.claim_next), saving its progress. The lease of the logs is
+    renewed by a LeaseHeartbeat while the job runs, and released at the end.
+    If the lease is lost the job is not imported, and its progress is not
+    saved over the one of the worker that took it.
+    """
+    heartbeat = LeaseHeartbeat(lambda: FetchLease.acquire(
+        job.source_id, job.client_id, owner, LEASE_SECONDS))
+    heartbeat.start()
+    fetch_job = None
+    try:
+        if adapter is None:
+            adapter = get_adapter(job.source)
+        source = job.source
+        fetch_job = FetchJob(source, job.client,
+                             source.username or 'Eff Fetcher',
+                             datetime(*job.from_date.timetuple()[:3]),
+                             datetime(*job.to_date.timetuple()[:3]), adapter,
+                             skip_unchanged=not job.full)
+        fetch_job.fetch()
+        if fetch_job.status != 'failed':
+            if heartbeat.lost.is_set() or not FetchLease.acquire(
+                    job.source_id, job.client_id, owner, LEASE_SECONDS):
+                raise RuntimeError('The lease of %s, %s expired' % (
+                    source, job.client))
+            if not job.progress(UpdateJob.IMPORTING,
+                                fetch_seconds=fetch_job.fetch_seconds):
+                raise RuntimeError('%s, %s was taken by another worker' % (
+                    source, job.client))
+            fetch_job.load()
+        stats = fetch_job.stats
+        if not job.progress(fetch_job.status, error=fetch_job.error or '',
+                            fetch_seconds=fetch_job.fetch_seconds,
+                            import_seconds=fetch_job.import_seconds,
+                            added=stats.get('added'),
+                            removed=stats.get('removed'),
+                            unchanged=stats.get('unchanged')):
+            debug('%s: lost the update of %s', owner, job, level=WARNING)
+    except Exception:
+        error = traceback.format_exc()
+        if not job.progress(UpdateJob.FAILED, error=error):
+            debug('%s: lost the update of %s: %s', owner, job, error,
+                  level=WARNING)
+    finally:
+        if fetch_job is not None:
+            # Not loaded if the lease was lost
+            fetch_job.close()
+        heartbeat.stop()
+        FetchLease.release(job.source_id, job.client_id, owner)
+
+
+class Worker(Thread):
+    """ Runs the queued UpdateJobs until stopping is set. """
+
+    def __init__(self, stopping):
+        Thread.__init__(self)
+        self.daemon = True
+        self.stopping = stopping
+        self.owner = '%s:%d:%s' % (gethostname(), os.getpid(), self.name)
+
+    def run(self):
+        try:
+            while not self.stopping.is_set():
+                job = None
+                try:
+                    job = UpdateJob.claim_next(self.owner, LEASE_SECONDS)
+                    if job is not None:
+                        run_job(job, self.owner)
+                except Exception:
+                    debug('%s: %s', self.owner, traceback.format_exc(),
+                          level=ERROR)
+                # End the transaction so the next poll sees the new jobs
+                transaction.commit_unless_managed()
+                reset_queries()
+                if job is None:
+                    self.stopping.wait(POLL_SECONDS)
+        finally:
+            connection.close()
+
+
+def run():
+    args = sys.argv[1:]
+
+    if len(args) > 1 or (args and not args[0].isdigit()):
+        print "Usage: $ update_worker.py [<workers>]"
+        print "\tRuns the queued updates from the external sources, with " \
+              "%d workers by default" % FETCH_WORKERS
+        sys.exit(0)
+
+    stopping = Event()
+    signal.signal(signal.SIGTERM, lambda signum, frame: stopping.set())
+    workers = [Worker(stopping) for i in xrange(int(args and args[0] or
+                                                    FETCH_WORKERS))]
+    for worker in workers:
+        worker.start()
+    try:
+        while not stopping.is_set():
+            time.sleep(1)
+    except KeyboardInterrupt:
+        stopping.set()
+    for worker in workers:
+        worker.join()
+
+if __name__ == '__main__':
+    run()
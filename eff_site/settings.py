@@ -18,6 +18,7 @@
 # Django settings for sitio project.
 
 from os.path import dirname, join, abspath, normpath
+from os import makedirs, chmod
 CURRENT_ABS_DIR = dirname(abspath(normpath(__file__)))
 
 DEBUG = True
@@ -128,8 +129,6 @@ TEMPLATE_CONTEXT_PROCESSORS = (
 
 AUTH_PROFILE_MODULE = 'eff.userprofile'
 
-FLAG_FILE = join(CURRENT_ABS_DIR, 'updatedb.flag')
-LOCK_FILE = join(CURRENT_ABS_DIR, 'updatedb.lock')
 DEBUG_FILE = join(CURRENT_ABS_DIR, 'updatedb.debug')
 
 # Formatting to use for displaying date fields.
@@ -141,6 +140,29 @@ EFF_DATE_INPUT_FORMAT = '%Y-%m-%d'
 SOUTH_TESTS_MIGRATE = False
 
 FETCH_EXTERNALS_CSV_DIR = join(CURRENT_ABS_DIR, 'scripts', 'sources_csv')
+# Number of external source fetches run at the same time
+FETCH_EXTERNALS_WORKERS = 4
+# Seconds an update worker holds the lease of the logs it is updating
+FETCH_EXTERNALS_LEASE_SECONDS = 30 * 60
+# Days before the last fetched date refetched by the next scheduled fetch
+FETCH_EXTERNALS_OVERLAP_DAYS = 7
+# Seconds an idle update worker waits before looking for queued updates
+FETCH_EXTERNALS_POLL_SECONDS = 2
+
+# The reports are cached in files, so all the workers share them (see
+# eff._models.report_cache). The files are pickles, their directory is made
+# below readable and writable only by the user running eff.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'reports': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': join(CURRENT_ABS_DIR, 'reports_cache'),
+        'TIMEOUT': 7 * 24 * 60 * 60,
+        'OPTIONS': {'MAX_ENTRIES': 2000},
+    },
+}
 
 PYTHON_BINARY = '/bin/bash'
 FETCH_EXTERNALS_PATH = join(CURRENT_ABS_DIR, '..', 'django_fetch.sh')
@@ -149,3 +171,13 @@ try:
     from local_settings import *
 except ImportError:
     pass
+
+if CACHES['reports']['BACKEND'].endswith('.FileBasedCache'):
+    try:
+        makedirs(CACHES['reports']['LOCATION'], 0700)
+    except OSError:
+        pass
+    chmod(CACHES['reports']['LOCATION'], 0700)
+
+# The tests do not leave cached reports behind
+TEST_RUNNER = 'eff_site.eff.testing.runner.EffTestSuiteRunner'
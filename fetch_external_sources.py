@@ -17,31 +17,22 @@
 # along with Eff.  If not, see <http://www.gnu.org/licenses/>.
 
 
-from os import environ, remove
+import sys
+from os import environ
 environ['DJANGO_SETTINGS_MODULE'] = 'eff_site.settings'
-import os.path
 
 from eff_site.eff.utils import debug
-from eff_site import settings
+from eff_site.eff.models import UpdateJob
 
-from eff_site.scripts.fetch_all import run
 
-
-def do_all():
-    if not os.path.exists(settings.LOCK_FILE):
-        open(settings.LOCK_FILE, 'w').close()
-        debug("created lock")
-        try:
-            run()
-        finally:
-            debug("removed lock")
-            remove(settings.LOCK_FILE)
-    else:
-        debug("lock exists, did nothing")
-
-    if os.path.exists(settings.FLAG_FILE):
-        remove(settings.FLAG_FILE)
+def do_all(full=False):
+    """
+    Queues the update of every client from its external source, from its
+    last fetch or, if full is set, from the first day of the previous month.
+    The updates are run by the update worker
+    (eff_site/scripts/update_worker.py).
+    """
+    debug("queued %d updates", UpdateJob.enqueue_all(full=full))
 
 if __name__ == '__main__':
-    do_all()
-
+    do_all('--full' in sys.argv[1:])